@@ -0,0 +1,159 @@
+cimport cython
+from libc.math cimport floor
+
+from .TokenBucketTime cimport tb_monotonic_time, TB_HAVE_MONOTONIC
+
+from .TokenBucketClock import DEFAULT_CLOCK
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+# tolerance for the rounding of the queue level, a consumer woken up at its computed time must fit
+cdef double EPSILON = 1e-9
+
+cdef class LeakyBucket(object):
+    """
+    Leaky bucket as a queue, releases consumers at a constant rate of leakamount tokens every leakrate seconds,
+    spread evenly over the interval, which smooths the output rate instead of allowing bursts.
+
+    A consumer is queued behind all queued tokens and released, when the tokens in front of it have drained. The
+    queue is not stored, only the time at which all queued tokens have drained. At most size tokens may be queued,
+    a consumer, that does not fit, waits for room first.
+
+    Provides the interface of the TokenBucket (consumeToken, try_consume, current_filllevel, context manager), so
+    both can be swapped and used with withTokenBucket. A consume without blocking only succeeds, if the queue is
+    empty, as any queued consumer has to wait.
+
+    Cython implementation, the state is only changed by C code, that holds the GIL and does not call into Python,
+    so no lock is needed.
+    """
+
+    cdef public long size
+    cdef readonly double leak_rate
+    cdef readonly long leak_amount
+    cdef readonly double interval  # seconds per token
+    cdef readonly object clock
+    cdef bint _c_clock  # the clock is the default clock, read it without a Python call
+    cdef public double drained_at  # all queued tokens have drained at this time
+    cdef object __weakref__
+
+    def __init__(self, long size, double leakrate, long leakamount=1, clock=None):
+        # type: (int, float, int, object) -> None
+        """
+        :param size: The maximum amount of queued tokens
+        :param leakrate: The time interval for draining leakamount tokens
+        :param leakamount: The amount of tokens to drain per interval
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        """
+
+        self.size = size
+        self.leak_rate = leakrate
+        self.leak_amount = leakamount
+        self.interval = leakrate / leakamount
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+        self._c_clock = TB_HAVE_MONOTONIC and self.clock is DEFAULT_CLOCK
+        self.drained_at = self._now()
+
+    cdef inline double _now(self) except? -1:
+        if self._c_clock:
+            return tb_monotonic_time()
+        return self.clock.time()
+
+    @cython.cdivision(True)
+    cdef inline double _queued(self, double now) noexcept nogil:
+        """
+        the amount of queued tokens
+        """
+        if self.drained_at <= now:
+            return 0.0
+        return (self.drained_at - now) / self.interval
+
+    cdef inline double _enqueue(self, long token_amount, double now) noexcept nogil:
+        """
+        queues token_amount tokens
+
+        :return: the time until the tokens are released
+        """
+        cdef double time_to_wait = self.drained_at - now
+
+        if time_to_wait < 0.0:
+            time_to_wait = 0.0
+        self.drained_at = now + time_to_wait + token_amount * self.interval
+        return time_to_wait
+
+    cpdef long current_filllevel(self) except? -1:
+        # type: () -> int
+        """
+        returns the amount of tokens, that fit into the queue right now
+
+        :return: the current fill level of the limiter
+        """
+        cdef long level = <long> floor(self.size - self._queued(self._now()) + EPSILON)
+
+        return level if level > 0 else 0
+
+    cpdef bint try_consume(self, long token_amount=1) except -1:
+        # type: (int) -> bool
+        """
+        Consumes x tokens, if the queue is empty, without blocking and without raising.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        """
+        cdef double now
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        now = self._now()
+        if self.drained_at > now + EPSILON * self.interval:
+            return False
+        self._enqueue(token_amount, now)
+        return True
+
+    def consumeToken(self, long token_amount, bint blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Queues x tokens and waits until they are released.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until the tokens are released
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        :raises TokenAmountError: a TokenAmountError is raised, if the queue is not empty and blocking is set to
+                                  False
+        :raises TimeoutError: a TimeoutError is raised, if the tokens would be released later than the given timeout
+        """
+        cdef double now, queued, excess, time_to_wait
+        cdef double c_timeout = timeout if timeout else -1
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            now = self._now()
+            queued = self._queued(now)
+            if not blocking and queued > EPSILON:
+                raise TokenAmountError("cannot consume without waiting, " + str(queued) + " tokens are queued")
+            if c_timeout != -1 and self.drained_at - now > c_timeout:
+                raise TimeoutError("the tokens would be released in " + str(
+                    self.drained_at - now) + " seconds, but is longer than allowed timeout of " + str(
+                    c_timeout) + " seconds, returning")
+            excess = queued + token_amount - self.size
+            if excess <= EPSILON:
+                time_to_wait = self._enqueue(token_amount, now)
+                break
+            # wait for room in the queue, then lets try again to queue the tokens
+            time_to_wait = excess * self.interval
+            self.clock.sleep(time_to_wait)
+            if c_timeout != -1:
+                c_timeout -= time_to_wait
+
+        if time_to_wait > 0.0:
+            self.clock.sleep(time_to_wait)
+        return True
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
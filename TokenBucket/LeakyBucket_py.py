@@ -0,0 +1,146 @@
+import math
+import threading
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+# tolerance for the rounding of the queue level, a consumer woken up at its computed time must fit
+EPSILON = 1e-9
+
+
+class LeakyBucket(object):
+    """
+    Leaky bucket as a queue, releases consumers at a constant rate of leakamount tokens every leakrate seconds,
+    spread evenly over the interval, which smooths the output rate instead of allowing bursts.
+
+    A consumer is queued behind all queued tokens and released, when the tokens in front of it have drained. The
+    queue is not stored, only the time at which all queued tokens have drained. At most size tokens may be queued,
+    a consumer, that does not fit, waits for room first.
+
+    Provides the interface of the TokenBucket (consumeToken, try_consume, current_filllevel, context manager), so
+    both can be swapped and used with withTokenBucket. A consume without blocking only succeeds, if the queue is
+    empty, as any queued consumer has to wait.
+    """
+
+    def __init__(self, size, leakrate, leakamount=1, clock=None):
+        # type: (int, float, int, Clock) -> None
+        """
+        :param size: The maximum amount of queued tokens
+        :param leakrate: The time interval for draining leakamount tokens
+        :param leakamount: The amount of tokens to drain per interval
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        """
+
+        self.size = size  # type: int
+        self.leak_rate = leakrate  # type: float
+        self.leak_amount = leakamount  # type: int
+        self.interval = leakrate / float(leakamount)  # type: float  # seconds per token
+        self.mutex = threading.RLock()  # type: threading.RLock
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+        self.drained_at = self.clock.time()  # type: float  # all queued tokens have drained at this time
+
+    def _queued(self, now):
+        # type: (float) -> float
+        """
+        the amount of queued tokens, must be called with the mutex held
+        """
+
+        if self.drained_at <= now:
+            return 0.0
+        return (self.drained_at - now) / self.interval
+
+    def _enqueue(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        queues token_amount tokens, must be called with the mutex held
+
+        :return: the time until the tokens are released
+        """
+
+        time_to_wait = self.drained_at - now
+        if time_to_wait < 0.0:
+            time_to_wait = 0.0
+        self.drained_at = now + time_to_wait + token_amount * self.interval
+        return time_to_wait
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the amount of tokens, that fit into the queue right now
+
+        :return: the current fill level of the limiter
+        """
+
+        with self.mutex:
+            return max(0, int(math.floor(self.size - self._queued(self.clock.time()) + EPSILON)))
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        """
+        Consumes x tokens, if the queue is empty, without blocking and without raising.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        with self.mutex:
+            now = self.clock.time()
+            if self.drained_at > now + EPSILON * self.interval:
+                return False
+            self._enqueue(token_amount, now)
+            return True
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Queues x tokens and waits until they are released.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until the tokens are released
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        :raises TokenAmountError: a TokenAmountError is raised, if the queue is not empty and blocking is set to
+                                  False
+        :raises TimeoutError: a TimeoutError is raised, if the tokens would be released later than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                queued = self._queued(now)
+                if not blocking and queued > EPSILON:
+                    raise TokenAmountError("cannot consume without waiting, " + str(queued) + " tokens are queued")
+                if timeout:
+                    time_to_release = self.drained_at - now
+                    if time_to_release > timeout:
+                        raise TimeoutError("the tokens would be released in " + str(
+                            time_to_release) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+                excess = queued + token_amount - self.size
+                if excess <= EPSILON:
+                    time_to_wait = self._enqueue(token_amount, now)
+                    break
+                # wait for room in the queue
+                time_to_wait = excess * self.interval
+
+            # sleep outside of the mutex, then lets try again to queue the tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+        if time_to_wait > 0.0:
+            self.clock.sleep(time_to_wait)
+        return True
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -0,0 +1,178 @@
+cimport cython
+from libc.math cimport floor
+
+from .TokenBucketTime cimport tb_monotonic_time, TB_HAVE_MONOTONIC
+
+from .TokenBucketClock import DEFAULT_CLOCK
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+# tolerance for the rounding of the weighted count, a consumer woken up at its computed time must pass
+cdef double EPSILON = 1e-9
+
+cdef class SlidingWindowLimiter(object):
+    """
+    Sliding window counter, allows about size tokens within any window of window seconds.
+
+    Only the counts of the current and of the previous fixed window are stored. The count of the sliding window is
+    estimated by weighting the count of the previous window with the part of it, that still overlaps the sliding
+    window. Unlike the step refill of the TokenBucket, there is no burst of a full bucket at every window boundary.
+
+    Provides the interface of the TokenBucket (consumeToken, try_consume, current_filllevel, context manager), so
+    both can be swapped and used with withTokenBucket. Blocked consumers are served greedy.
+
+    Cython implementation, the state is only changed by C code, that holds the GIL and does not call into Python,
+    so no lock is needed.
+    """
+
+    cdef public long size
+    cdef public double window
+    cdef readonly object clock
+    cdef bint _c_clock  # the clock is the default clock, read it without a Python call
+    cdef public double window_start
+    cdef public long current
+    cdef public long previous
+    cdef object __weakref__
+
+    def __init__(self, long size, double window, clock=None):
+        # type: (int, float, object) -> None
+        """
+        :param size: The amount of tokens allowed per window
+        :param window: The length of the window in seconds
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        """
+
+        self.size = size
+        self.window = window
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+        self._c_clock = TB_HAVE_MONOTONIC and self.clock is DEFAULT_CLOCK
+        self.window_start = self._now()
+        self.current = 0
+        self.previous = 0
+
+    cdef inline double _now(self) except? -1:
+        if self._c_clock:
+            return tb_monotonic_time()
+        return self.clock.time()
+
+    @cython.cdivision(True)
+    cdef inline void _roll(self, double now) noexcept nogil:
+        """
+        moves the current window forward to now
+        """
+        cdef long windows = <long> ((now - self.window_start) / self.window)
+
+        if self.window_start + (windows + 1) * self.window <= now:
+            # the division rounded down, but the window has passed
+            windows += 1
+        if windows > 0:
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.window_start += windows * self.window
+
+    @cython.cdivision(True)
+    cdef inline double _count(self, double now) noexcept nogil:
+        """
+        estimates the count of the sliding window, must be called after a roll
+        """
+        return self.previous * (1.0 - (now - self.window_start) / self.window) + self.current
+
+    @cython.cdivision(True)
+    cdef double _time_to_wait(self, long token_amount, double now) noexcept nogil:
+        """
+        calculates the time until token_amount tokens are allowed, must be called after a roll
+        """
+        cdef double excess = self._count(now) + token_amount - self.size
+        cdef double remaining
+
+        if excess <= EPSILON:
+            return 0.0
+        remaining = self.window_start + self.window - now
+        # the weight of the previous window decreases linearly until the end of the current window
+        if self.previous and excess * self.window / self.previous < remaining:
+            return excess * self.window / self.previous
+        # in the next window the current window is the previous one
+        excess = self.current + token_amount - self.size
+        if excess <= 0:
+            return remaining
+        return remaining + excess * self.window / self.current
+
+    cdef inline bint _consume(self, long token_amount, double now) noexcept nogil:
+        self._roll(now)
+        if self._count(now) + token_amount <= self.size + EPSILON:
+            self.current += token_amount
+            return True
+        return False
+
+    cpdef long current_filllevel(self) except? -1:
+        # type: () -> int
+        """
+        returns the amount of tokens, that are allowed right now
+
+        :return: the current fill level of the limiter
+        """
+        cdef double now = self._now()
+        cdef long level
+
+        self._roll(now)
+        level = <long> floor(self.size - self._count(now) + EPSILON)
+        return level if level > 0 else 0
+
+    cpdef bint try_consume(self, long token_amount=1) except -1:
+        # type: (int) -> bool
+        """
+        Consumes x tokens, if they are allowed, without blocking and without raising.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        return self._consume(token_amount, self._now())
+
+    def consumeToken(self, long token_amount, bint blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens.
+        Per default this method waits and blocks until at least x tokens are allowed.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are allowed
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        :raises TokenAmountError: a TokenAmountError is raised, if token_amount tokens are not allowed right now and
+                                  blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the time to wait until token_amount tokens are allowed
+                              would take longer than the given timeout
+        """
+        cdef double now, time_to_wait
+        cdef double c_timeout = timeout if timeout else -1
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            now = self._now()
+            if self._consume(token_amount, now):
+                return True
+            if not blocking:
+                raise TokenAmountError("cannot consume more tokens than allowed in the window, try less tokens, "
+                                       "currently allowed tokens are " + str(self.size - self._count(now)))
+            time_to_wait = self._time_to_wait(token_amount, now)
+            if c_timeout != -1:
+                if time_to_wait > c_timeout:
+                    raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                        time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                        c_timeout) + " seconds, returning")
+                c_timeout -= time_to_wait
+
+            # lets try again to consume some tokens after the sleep
+            self.clock.sleep(time_to_wait)
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -0,0 +1,162 @@
+import math
+import threading
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+# tolerance for the rounding of the weighted count, a consumer woken up at its computed time must pass
+EPSILON = 1e-9
+
+
+class SlidingWindowLimiter(object):
+    """
+    Sliding window counter, allows about size tokens within any window of window seconds.
+
+    Only the counts of the current and of the previous fixed window are stored. The count of the sliding window is
+    estimated by weighting the count of the previous window with the part of it, that still overlaps the sliding
+    window. Unlike the step refill of the TokenBucket, there is no burst of a full bucket at every window boundary.
+
+    Provides the interface of the TokenBucket (consumeToken, try_consume, current_filllevel, context manager), so
+    both can be swapped and used with withTokenBucket. Blocked consumers are served greedy.
+    """
+
+    def __init__(self, size, window, clock=None):
+        # type: (int, float, Clock) -> None
+        """
+        :param size: The amount of tokens allowed per window
+        :param window: The length of the window in seconds
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        """
+
+        self.size = size  # type: int
+        self.window = window  # type: float
+        self.mutex = threading.RLock()  # type: threading.RLock
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+        self.window_start = self.clock.time()  # type: float
+        self.current = 0  # type: int
+        self.previous = 0  # type: int
+
+    def _roll(self, now):
+        # type: (float) -> None
+        """
+        moves the current window forward to now, must be called with the mutex held
+        """
+
+        windows = int((now - self.window_start) / self.window)
+        if self.window_start + (windows + 1) * self.window <= now:
+            # the division rounded down, but the window has passed
+            windows += 1
+        if windows > 0:
+            self.previous = self.current if windows == 1 else 0
+            self.current = 0
+            self.window_start += windows * self.window
+
+    def _count(self, now):
+        # type: (float) -> float
+        """
+        estimates the count of the sliding window, must be called with the mutex held and after a roll
+        """
+
+        return self.previous * (1.0 - (now - self.window_start) / self.window) + self.current
+
+    def _time_to_wait(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        calculates the time until token_amount tokens are allowed, must be called with the mutex held and after a
+        roll
+        """
+
+        excess = self._count(now) + token_amount - self.size
+        if excess <= EPSILON:
+            return 0.0
+        remaining = self.window_start + self.window - now
+        # the weight of the previous window decreases linearly until the end of the current window
+        if self.previous and excess * self.window / self.previous < remaining:
+            return excess * self.window / self.previous
+        # in the next window the current window is the previous one
+        excess = self.current + token_amount - self.size
+        if excess <= 0:
+            return remaining
+        return remaining + excess * self.window / self.current
+
+    def _consume(self, token_amount, now):
+        # type: (int, float) -> bool
+        self._roll(now)
+        if self._count(now) + token_amount <= self.size + EPSILON:
+            self.current += token_amount
+            return True
+        return False
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the amount of tokens, that are allowed right now
+
+        :return: the current fill level of the limiter
+        """
+
+        with self.mutex:
+            now = self.clock.time()
+            self._roll(now)
+            return max(0, int(math.floor(self.size - self._count(now) + EPSILON)))
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        """
+        Consumes x tokens, if they are allowed, without blocking and without raising.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        with self.mutex:
+            return self._consume(token_amount, self.clock.time())
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens.
+        Per default this method waits and blocks until at least x tokens are allowed.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are allowed
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the size
+        :raises TokenAmountError: a TokenAmountError is raised, if token_amount tokens are not allowed right now and
+                                  blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the time to wait until token_amount tokens are allowed
+                              would take longer than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                if self._consume(token_amount, now):
+                    return True
+                if not blocking:
+                    raise TokenAmountError("cannot consume more tokens than allowed in the window, try less tokens, "
+                                           "currently allowed tokens are " + str(self.size - self._count(now)))
+                time_to_wait = self._time_to_wait(token_amount, now)
+                if timeout:
+                    if time_to_wait > timeout:
+                        raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                            time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
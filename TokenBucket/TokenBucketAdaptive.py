@@ -0,0 +1,97 @@
+import threading
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+
+
+class AIMDController(object):
+    """
+    Adapts the rate of a Token Bucket to the fluctuating capacity of a downstream service by additive increase and
+    multiplicative decrease (AIMD), like the congestion control of TCP.
+
+    The caller reports the outcome of every request. success() raises the rate by increase / rate tokens per second,
+    so at full usage the rate grows by about increase tokens per second every second. throttled(), e.g. on a 429 or
+    a 503, multiplies the rate by decrease. A success slower than latency_target counts as throttled. A decrease is
+    applied at most once per cooldown, so a burst of rejections of requests, that were sent at the old rate, reduces
+    the rate only once.
+
+    The rate is applied by reconfiguring the refill interval of the bucket, its size and refill amount are kept.
+    Increases are applied at most once per refill interval, so the successes do not contend for the mutex of the
+    bucket, decreases are applied right away.
+    """
+
+    def __init__(self, bucket, min_rate, max_rate, initial_rate=None, increase=1.0, decrease=0.5,
+                 latency_target=None, cooldown=1.0, clock=None):
+        # type: (object, float, float, float, float, float, float, float, Clock) -> None
+        """
+        :param bucket: The Token Bucket to control, it must provide reconfigure()
+        :param min_rate: The lowest rate in tokens per second
+        :param max_rate: The highest rate in tokens per second
+        :param initial_rate: The rate to start with, defaults to the current rate of the bucket
+        :param increase: The additive increase in tokens per second, per rate-worth of successes
+        :param decrease: The factor to multiply the rate with on throttling
+        :param latency_target: Successes slower than latency_target seconds count as throttled, None to ignore
+        :param cooldown: The minimum time in seconds between two decreases
+        :param clock: The clock to take the time from, defaults to the clock of the bucket
+        """
+
+        self.bucket = bucket
+        self.min_rate = min_rate  # type: float
+        self.max_rate = max_rate  # type: float
+        self.increase = increase  # type: float
+        self.decrease = decrease  # type: float
+        self.latency_target = latency_target  # type: float
+        self.cooldown = cooldown  # type: float
+        if clock is None:
+            clock = getattr(bucket, 'clock', DEFAULT_CLOCK)
+        self.clock = clock  # type: Clock
+        self.mutex = threading.Lock()  # type: threading.Lock
+        self.last_decrease = float('-inf')  # type: float
+        if initial_rate is None:
+            initial_rate = bucket.refill_amount / float(bucket.refill_rate)
+        self.rate = min(max(initial_rate, min_rate), max_rate)  # type: float
+        self.applied_rate = None  # type: float  # the rate the bucket is configured with
+        self.last_apply = None  # type: float
+        self._apply(self.clock.time())
+
+    def _apply(self, now):
+        # type: (float) -> None
+        self.bucket.reconfigure(refillrate=self.bucket.refill_amount / self.rate)
+        self.applied_rate = self.rate
+        self.last_apply = now
+
+    def success(self, latency=None):
+        # type: (float) -> float
+        """
+        reports a successful request
+
+        :param latency: the latency of the request in seconds
+        :return: the new rate
+        """
+
+        if self.latency_target is not None and latency is not None and latency > self.latency_target:
+            return self.throttled()
+        with self.mutex:
+            self.rate = min(self.rate + self.increase / self.rate, self.max_rate)
+            if self.rate != self.applied_rate:
+                now = self.clock.time()
+                if now - self.last_apply >= self.bucket.refill_rate:
+                    self._apply(now)
+            return self.rate
+
+    def throttled(self):
+        # type: () -> float
+        """
+        reports a request, that was throttled or failed because of overload
+
+        :return: the new rate
+        """
+
+        with self.mutex:
+            now = self.clock.time()
+            if now - self.last_decrease < self.cooldown:
+                return self.rate
+            self.last_decrease = now
+            self.rate = max(self.rate * self.decrease, self.min_rate)
+            if self.rate != self.applied_rate:
+                self._apply(now)
+            return self.rate
@@ -0,0 +1,274 @@
+import asyncio
+import collections
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK, check_timestamp
+from .TokenBucketCore import refill_state, time_to_wait as core_time_to_wait
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+
+class AsyncTokenBucket(object):
+    """
+    asyncio implementation of a Token Bucket.
+    Uses the same refill semantics as the synchronous TokenBucket, but waiting consumers are parked on
+    asyncio futures instead of blocking the event loop with time.sleep().
+
+    Waiting consumers are served in FIFO order by a single timer per bucket, which fires at the next refill.
+    The bucket is not thread safe, it must only be used from within the event loop it is used with.
+    The clock only provides the time, waiting is always done by the timers of the event loop.
+    """
+
+    def __init__(self, size, refillrate, refillamount, value=None, lastupdate=None, clock=None):
+        # type: (int, float, int, int, float, Clock) -> None
+        """
+        :param size: The size of the Token Bucket
+        :param refillrate: The time interval for refilling the Token Bucket
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param value: Initialize the Token Bucket with a given value
+        :param lastupdate: Initialize the Token Bucket with a given timestamp of its clock
+        :param clock: The clock to take the time from, defaults to a monotonic clock
+        """
+
+        self.size = size  # type: int
+        self.value = size  # type: int
+        self.refill_rate = refillrate  # type: float
+        self.refill_amount = refillamount  # type: int
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+        self.last_update = self.clock.time()  # type: float
+        if value is not None:
+            self.value = value  # type: int
+        if lastupdate is not None:
+            check_timestamp(self.clock, lastupdate)
+            self.last_update = lastupdate  # type: float
+        self.waiters = collections.deque()  # type: collections.deque
+        self._timer = None  # type: asyncio.TimerHandle
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the current fill level of the Token Bucket (self.value).
+        refills bucket automatically, so the returned value is more up to date.
+
+        :return: the current fill level of the Token Bucket
+        """
+
+        self._refill(self.clock.time())
+        return self.value
+
+    def refill(self, now=None, force=False):
+        # type: (float, bool) -> None
+        """
+        Performs a refill operation on the Token Bucket.
+        The refill operation will only succeed, if the last update is long enough ago.
+
+        :param now: Specifies the current time to use
+        :param force: perform a refill operation, even if no refill operation can be done at the moment.
+        """
+
+        if not now:
+            now = self.clock.time()  # type: float
+        else:
+            check_timestamp(self.clock, now)
+        self._refill(now, force)
+
+    def _refill(self, now, force=False):
+        # type: (float, bool) -> None
+        self.value, self.last_update = refill_state(self.value, self.last_update, self.size, self.refill_rate,
+                                                    self.refill_amount, now, force)
+
+    def _time_to_wait(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        calculates the time until token_amount tokens are available for a consumer, that queues up behind all
+        currently waiting consumers.
+
+        :param token_amount: amount of tokens to consume
+        :param now: Specifies the current time to use
+        :return: the time to wait in seconds
+        """
+
+        queued_tokens = sum(amount for amount, waiter in self.waiters if not waiter.done())
+        return core_time_to_wait(self.value, self.last_update, self.refill_rate, self.refill_amount,
+                                 queued_tokens + token_amount, now)
+
+    def _wakeup(self):
+        # type: () -> None
+        """
+        timer callback, refills the bucket and hands tokens to the waiting consumers in FIFO order.
+        Re-arms the timer for the next refill, if consumers are still waiting.
+        """
+
+        self._timer = None
+        now = self.clock.time()
+        self._refill(now)
+        while self.waiters:
+            amount, waiter = self.waiters[0]
+            if waiter.done():  # cancelled consumer, drop it
+                self.waiters.popleft()
+                continue
+            if amount > self.value:
+                break
+            self.waiters.popleft()
+            self.value -= amount
+            waiter.set_result(True)
+        self._schedule(now)
+
+    def _schedule(self, now):
+        # type: (float) -> None
+        if self._timer is not None or not self.waiters:
+            return
+        time_to_wait = max(0.0, self.last_update + self.refill_rate - now)
+        self._timer = asyncio.get_running_loop().call_later(time_to_wait, self._wakeup)
+
+    def _reschedule(self):
+        # type: () -> None
+        """
+        serves the waiting consumers right away instead of at the armed timer, after the queue or the fill level
+        changed.
+        """
+
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wakeup()
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        """
+        Consumes x tokens from the Token Bucket, if there are enough tokens, without waiting and without raising.
+        Waiting consumers are not overtaken.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        self._refill(self.clock.time())
+        if not self.waiters and token_amount <= self.value:
+            self.value -= token_amount
+            return True
+        return False
+
+    def reserve(self, token_amount=1):
+        # type: (int) -> float
+        """
+        Debits x tokens from the Token Bucket immediately, even if there are not enough tokens, and returns the time
+        the caller has to wait before using them. The fill level stays negative, until the refills paid the debt.
+        Reservations take precedence over waiting consumers, which wait until the debt is paid.
+
+        :param token_amount: amount of tokens to reserve
+        :return: the time to wait in seconds, 0 if the tokens were available
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        now = self.clock.time()
+        self._refill(now)
+        time_to_wait = core_time_to_wait(self.value, self.last_update, self.refill_rate, self.refill_amount,
+                                         token_amount, now)
+        self.value -= token_amount
+        return time_to_wait
+
+    def refund(self, token_amount):
+        # type: (int) -> None
+        """
+        Gives x unused tokens back to the Token Bucket, e.g. tokens, that were taken ahead of use, but not used.
+        The fill level is capped at the size, the waiting consumers are served right away, if possible.
+
+        :param token_amount: amount of tokens to give back
+        """
+
+        self._refill(self.clock.time())
+        self.value = min(self.size, self.value + token_amount)
+        if self.waiters:
+            self._reschedule()
+
+    async def consume(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens from the Token Bucket.
+        Per default this coroutine waits until at least x tokens are available for consuming, without blocking the
+        event loop.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this coroutine should wait, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        :raises TokenAmountError: a TokenAmountError is raised, if the current amount of tokens in the Bucket is
+                                  smaller than token_amount and blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the bucket has not enough tokens and the time to wait for a
+                              sufficient amount of tokens would take longer than the given timeout, or if the
+                              tokens were not granted within the timeout, e.g. because of consumers queued in front
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        now = self.clock.time()
+        self._refill(now)
+
+        # only take the nice case, if nobody is waiting in front of us
+        if not self.waiters and token_amount <= self.value:
+            self.value -= token_amount
+            return True
+        if not blocking:
+            raise TokenAmountError(
+                "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                "current aviable tokens are " + str(self.value))
+
+        time_to_wait = self._time_to_wait(token_amount, now)
+        if timeout and time_to_wait > timeout:
+            raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                timeout) + " seconds, returning")
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.waiters.append((token_amount, waiter))
+        self._schedule(now)
+        # the estimate above does not cover the consumers queued in front, the deadline is enforced while waiting
+        deadline = loop.call_later(timeout, self._expire, token_amount, waiter, timeout) if timeout else None
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                try:
+                    self.waiters.remove((token_amount, waiter))
+                except ValueError:  # already dropped by the timer
+                    pass
+            else:
+                # the timer granted the tokens right before the cancellation, give them back
+                self.value = min(self.size, self.value + token_amount)
+            # the consumers behind the cancelled one may be served now
+            self._reschedule()
+            raise
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+
+    def _expire(self, token_amount, waiter, timeout):
+        # type: (int, asyncio.Future, float) -> None
+        """
+        fails a waiting consumer, whose timeout passed before its tokens were granted
+        """
+
+        if waiter.done():  # granted or cancelled meanwhile
+            return
+        self.waiters.remove((token_amount, waiter))
+        waiter.set_exception(TimeoutError("not enough tokens aviable within the allowed timeout of " + str(
+            timeout) + " seconds, returning"))
+        # the consumers behind the expired one may be served now
+        self._reschedule()
+
+    async def __aenter__(self):
+        await self.consume(1)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -0,0 +1,253 @@
+import threading
+from typing import Iterable, List, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+from .TokenBucketCore import consume_state
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+
+class TokenBucketBackend(object):
+    """
+    Interface of a storage for the state of many Token Buckets, addressed by key.
+
+    A backend performs refill and consume of one bucket as a single atomic operation. The configuration of the
+    bucket is passed with every call, so a backend does not need to store it.
+    """
+
+    def consume(self, key, size, refill_rate, refill_amount, token_amount):
+        # type: (str, int, float, int, int) -> Tuple[bool, int, float]
+        """
+        Refills the bucket for key and consumes token_amount tokens, if there are enough tokens.
+        Consuming 0 tokens returns the current fill level.
+
+        :param key: the key of the bucket
+        :param size: The size of the Token Bucket
+        :param refill_rate: The time interval for refilling the Token Bucket
+        :param refill_amount: The amount of tokens to refill per refill operation
+        :param token_amount: amount of tokens to consume
+        :return: if the tokens were consumed, the fill level of the bucket and the time to wait until enough tokens
+                 are available, if the tokens were not consumed
+        """
+
+        raise NotImplementedError()
+
+    def consume_batch(self, requests, size, refill_rate, refill_amount):
+        # type: (Iterable[Tuple[str, int]], int, float, int) -> List[Tuple[bool, int, float]]
+        """
+        Performs consume() for every (key, token_amount) pair of requests.
+
+        :return: the result of consume() for every request
+        """
+
+        return [self.consume(key, size, refill_rate, refill_amount, token_amount) for key, token_amount in requests]
+
+
+class LocalBackend(TokenBucketBackend):
+    """
+    In-process reference backend, stores the state of the buckets in a dict.
+    """
+
+    def __init__(self, clock=None):
+        # type: (Clock) -> None
+        """
+        :param clock: The clock to take the time from, defaults to a monotonic clock
+        """
+
+        self.states = {}  # type: dict  # key -> (value, last update)
+        self.mutex = threading.RLock()  # type: threading.RLock
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+
+    def consume(self, key, size, refill_rate, refill_amount, token_amount):
+        # type: (str, int, float, int, int) -> Tuple[bool, int, float]
+        with self.mutex:
+            now = self.clock.time()
+            value, last_update = self.states.get(key, (size, now))
+            granted, value, last_update, time_to_wait = consume_state(value, last_update, size, refill_rate,
+                                                                      refill_amount, token_amount, now)
+            self.states[key] = (value, last_update)
+            return granted, value, time_to_wait
+
+    def consume_batch(self, requests, size, refill_rate, refill_amount):
+        # type: (Iterable[Tuple[str, int]], int, float, int) -> List[Tuple[bool, int, float]]
+        with self.mutex:
+            return super(LocalBackend, self).consume_batch(requests, size, refill_rate, refill_amount)
+
+
+class RedisBackend(TokenBucketBackend):
+    """
+    Backend, that stores the state of the buckets in a Redis server (or any server speaking the Redis protocol).
+
+    Refill and consume are performed by a server side Lua script in a single round trip, using the clock of the
+    server, so the clocks of the clients do not need to be synchronized. Buckets expire, once they would be
+    refilled to full. Batches are sent in one pipeline. Requires the redis package.
+    """
+
+    CONSUME_SCRIPT = """
+-- KEYS[1]: key of the bucket
+-- ARGV: size, refill rate, refill amount, token amount
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local size = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local refill_amount = tonumber(ARGV[3])
+local token_amount = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'value', 'last_update')
+local value = tonumber(state[1])
+local last_update = tonumber(state[2])
+if value == nil or last_update == nil then
+    value = size
+    last_update = now
+end
+
+local refill_count = math.floor((now - last_update) / refill_rate)
+if refill_count > 0 then
+    value = value + refill_count * refill_amount
+    last_update = last_update + refill_count * refill_rate
+end
+if value > size then
+    value = size
+end
+
+local granted = 0
+local time_to_wait = 0
+if token_amount <= value then
+    value = value - token_amount
+    granted = 1
+else
+    time_to_wait = last_update + math.ceil((token_amount - value) / refill_amount) * refill_rate - now
+    if time_to_wait < 0 then
+        time_to_wait = 0
+    end
+end
+
+redis.call('HSET', KEYS[1], 'value', value, 'last_update', string.format('%.6f', last_update))
+-- an idle bucket is full after this time, dropping it then is lossless
+local full_after = math.ceil((size - value) / refill_amount) * refill_rate - (now - last_update)
+redis.call('PEXPIRE', KEYS[1], math.max(1, math.ceil(full_after * 1000)))
+return {granted, value, string.format('%.6f', time_to_wait)}
+"""
+
+    def __init__(self, client=None, url=None, prefix='tokenbucket:'):
+        # type: (redis.Redis, str, str) -> None
+        """
+        :param client: The Redis client to use, its connection pool is shared by all calls
+        :param url: Create a client with its own connection pool for the given url, if no client is given
+        :param prefix: Prefix for the keys of the buckets in Redis
+        """
+
+        if client is None:
+            if redis is None:
+                raise ImportError("RedisBackend requires the redis package")
+            client = redis.Redis.from_url(url) if url else redis.Redis()
+        self.client = client  # type: redis.Redis
+        self.prefix = prefix  # type: str
+        self.script = client.register_script(self.CONSUME_SCRIPT)
+
+    def consume(self, key, size, refill_rate, refill_amount, token_amount):
+        # type: (str, int, float, int, int) -> Tuple[bool, int, float]
+        granted, value, time_to_wait = self.script(keys=[self.prefix + key],
+                                                   args=[size, refill_rate, refill_amount, token_amount])
+        return bool(granted), int(value), float(time_to_wait)
+
+    def consume_batch(self, requests, size, refill_rate, refill_amount):
+        # type: (Iterable[Tuple[str, int]], int, float, int) -> List[Tuple[bool, int, float]]
+        pipeline = self.client.pipeline(transaction=False)
+        for key, token_amount in requests:
+            self.script(keys=[self.prefix + key], args=[size, refill_rate, refill_amount, token_amount],
+                        client=pipeline)
+        return [(bool(granted), int(value), float(time_to_wait))
+                for granted, value, time_to_wait in pipeline.execute()]
+
+
+class BackendTokenBucket(object):
+    """
+    Token Bucket, whose state is kept in a TokenBucketBackend under a key.
+    Can be used as a drop-in for TokenBucket and with withTokenBucket.
+    """
+
+    def __init__(self, backend, key, size, refillrate, refillamount, clock=None):
+        # type: (TokenBucketBackend, str, int, float, int, Clock) -> None
+        """
+        :param backend: The backend, that stores the state of the Token Bucket
+        :param key: The key of the Token Bucket in the backend
+        :param size: The size of the Token Bucket
+        :param refillrate: The time interval for refilling the Token Bucket
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param clock: The clock to wait with, defaults to the clock of the backend or a monotonic clock. The time
+                      is taken by the backend.
+        """
+
+        self.backend = backend  # type: TokenBucketBackend
+        self.key = key  # type: str
+        self.size = size  # type: int
+        self.refill_rate = refillrate  # type: float
+        self.refill_amount = refillamount  # type: int
+        if clock is None:
+            clock = getattr(backend, 'clock', DEFAULT_CLOCK)
+        self.clock = clock  # type: Clock
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the current fill level of the Token Bucket.
+
+        :return: the current fill level of the Token Bucket
+        """
+
+        return self.backend.consume(self.key, self.size, self.refill_rate, self.refill_amount, 0)[1]
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens from the Token Bucket.
+        Per default this method waits and blocks until at least x tokens are available for consuming.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        :raises TokenAmountError: a TokenAmountError is raised, if the current amount of tokens in the Bucket is
+                                  smaller than token_amount and blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the bucket has not enough tokens and the time to wait for a
+                              sufficient amount of tokens would take longer than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            granted, value, time_to_wait = self.backend.consume(self.key, self.size, self.refill_rate,
+                                                                self.refill_amount, token_amount)
+            if granted:
+                return True
+            if not blocking:
+                raise TokenAmountError(
+                    "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                    "current aviable tokens are " + str(value))
+            if timeout:
+                if time_to_wait > timeout:
+                    raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                        time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                        timeout) + " seconds, returning")
+
+            # lets try again to consume some tokens after the refill
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -0,0 +1,155 @@
+import collections
+import threading
+from typing import Iterable, Tuple
+
+from .TokenBucketClock import DEFAULT_CLOCK
+from .TokenBucketCore import time_to_wait as core_time_to_wait
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+
+def _time_to_wait(bucket, token_amount, now):
+    # type: (object, int, float) -> float
+    """
+    calculates the time until bucket holds token_amount tokens, must be called with the mutex of bucket held.
+    """
+
+    refill_rate = bucket.refill_rate
+    refill_amount = bucket.refill_amount
+    if getattr(bucket, 'continuous', False):
+        # refilled token by token
+        refill_rate = refill_rate / float(refill_amount)
+        refill_amount = 1
+    return core_time_to_wait(bucket.value, bucket.last_update, refill_rate, refill_amount, token_amount, now)
+
+
+def _leave_queue(bucket, waiter):
+    # type: (object, tuple) -> None
+    """
+    removes waiter from the FIFO queue of bucket, the head hands over to the next consumer in line.
+    Must be called with the mutex of bucket held.
+    """
+
+    was_head = bucket.waiters[0] is waiter
+    bucket.waiters.remove(waiter)
+    if was_head and bucket.waiters:
+        bucket.waiters[0][1].notify()
+
+
+def _record(ordered, method, seconds):
+    # type: (list, str, float) -> None
+    """
+    records the result of a consume into the metrics of every bucket, that has metrics
+    """
+
+    for bucket, token_amount in ordered:
+        metrics = getattr(bucket, 'metrics', None)
+        if metrics is not None:
+            getattr(metrics, method)(bucket, token_amount, seconds)
+
+
+def consume_many(requests, blocking=True, timeout=None):
+    # type: (Iterable[Tuple[object, int]], bool, float) -> bool
+    """
+    Atomically consumes tokens from several Token Buckets.
+    Either all buckets are debited or none of them.
+
+    The mutexes of the buckets are acquired in a deterministic order (by id of the bucket), so concurrent calls
+    with overlapping buckets cannot deadlock. While blocking, the mutexes are released during the sleep.
+    Every bucket is refilled with the time of its own clock, e.g. a SharedTokenBucket with the wall clock and a
+    TokenBucket with a monotonic clock, the waiting is done with the clock of the first bucket.
+
+    Waiting consumers of FIFO buckets are never overtaken. A blocked call queues up in every FIFO bucket as one
+    consumer of its whole amount, so it is served in turn and the consumers behind it wait for it.
+    The consumes are recorded into the metrics of the buckets.
+
+    :param requests: pairs of (bucket, token_amount), a bucket may appear more than once
+    :param blocking: specifies, if this function should block, until enough tokens are available in all buckets
+    :param timeout: specifies the maximum time to wait, if blocking is enabled
+    :return: returns if the tokens could be consumed or not
+    :raises BucketSizeError: a BucketSizeError is raised, if a token_amount is bigger than the maximum size of its
+                             bucket
+    :raises TokenAmountError: a TokenAmountError is raised, if one of the buckets has less tokens than requested
+                              and blocking is set to False
+    :raises TimeoutError: a TimeoutError is raised, if the time to wait for a sufficient amount of tokens in all
+                          buckets would take longer than the given timeout
+    """
+
+    # merge requests for the same bucket and sort them by the lock order
+    amounts = {}
+    buckets = {}
+    for bucket, token_amount in requests:
+        amounts[id(bucket)] = amounts.get(id(bucket), 0) + token_amount
+        buckets[id(bucket)] = bucket
+    ordered = [(buckets[key], amounts[key]) for key in sorted(buckets)]
+    clocks = [getattr(bucket, 'clock', DEFAULT_CLOCK) for bucket, _ in ordered]
+    clock = clocks[0] if clocks else DEFAULT_CLOCK
+
+    for bucket, token_amount in ordered:
+        if token_amount > bucket.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+    queued = {}  # id of a FIFO bucket -> the waiter of this call in its queue
+    started = None  # time of the first wait
+    try:
+        while True:
+            acquired = []
+            try:
+                for bucket, token_amount in ordered:
+                    bucket.mutex.acquire()
+                    acquired.append(bucket)
+                now = clock.time()
+                time_to_wait = 0.0
+                for (bucket, token_amount), bucket_clock in zip(ordered, clocks):
+                    # the timestamps of different clocks are not comparable
+                    bucket_now = now if bucket_clock is clock else bucket_clock.time()
+                    bucket.refill(bucket_now)
+                    waiter = queued.get(id(bucket))
+                    # the tokens of the waiting consumers in front of this call
+                    ahead = 0
+                    for entry in getattr(bucket, 'waiters', None) or ():
+                        if entry is waiter:
+                            break
+                        ahead += entry[0]
+                    time_to_wait = max(time_to_wait, _time_to_wait(bucket, ahead + token_amount, bucket_now))
+
+                # nice case, every bucket has enough tokens
+                if time_to_wait == 0:
+                    for bucket, token_amount in ordered:
+                        bucket.value -= token_amount
+                    for bucket, token_amount in ordered:
+                        if id(bucket) in queued:
+                            _leave_queue(bucket, queued.pop(id(bucket)))
+                    _record(ordered, 'record_granted', now - started if started is not None else 0.0)
+                    return True
+                if not blocking:
+                    _record(ordered, 'record_denied', time_to_wait)
+                    raise TokenAmountError("cannot reduce all buckets by the requested amount of tokens, "
+                                           "at least one bucket has not enough tokens")
+                if timeout:
+                    if time_to_wait > timeout:
+                        _record(ordered, 'record_timeout', time_to_wait)
+                        raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                            time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+                if started is None:
+                    started = now
+                    for bucket, token_amount in ordered:
+                        if getattr(bucket, 'fifo', False):
+                            queued[id(bucket)] = (token_amount, threading.Condition(bucket.mutex))
+                            if bucket.waiters is None:  # the Cython bucket creates its queue on first use
+                                bucket.waiters = collections.deque()
+                            bucket.waiters.append(queued[id(bucket)])
+            finally:
+                for bucket in reversed(acquired):
+                    bucket.mutex.release()
+
+            # sleep outside of the mutexes, then lets try again to consume some tokens
+            clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+    finally:
+        # leave the queues, if the call did not succeed
+        for bucket, token_amount in ordered:
+            if id(bucket) in queued:
+                with bucket.mutex:
+                    _leave_queue(bucket, queued.pop(id(bucket)))
@@ -0,0 +1,136 @@
+import threading
+import time
+
+
+class Clock(object):
+    """
+    Source of time for Token Buckets.
+
+    A clock provides the current time and a way to wait. All timestamps of a bucket (last_update, the now
+    parameters) are in the time scale of its clock.
+    """
+
+    def time(self):
+        # type: () -> float
+        """
+        :return: the current time in seconds
+        """
+
+        raise NotImplementedError()
+
+    def sleep(self, seconds):
+        # type: (float) -> None
+        """
+        waits for the given amount of seconds
+
+        :param seconds: the time to wait
+        """
+
+        raise NotImplementedError()
+
+    def wait(self, condition, timeout):
+        # type: (threading.Condition, float) -> None
+        """
+        waits on condition, which must be acquired, until it is notified or timeout seconds have passed
+
+        :param condition: the condition to wait on
+        :param timeout: the maximum time to wait, None waits until notified
+        """
+
+        condition.wait(timeout)
+
+
+class MonotonicClock(Clock):
+    """
+    Clock based on time.monotonic(), it never jumps, e.g. when the system time is adjusted by NTP.
+    This is the default clock of the Token Buckets.
+    """
+
+    # sleep first, time shadows the time module in the class body
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.monotonic)
+
+
+class WallClock(Clock):
+    """
+    Clock based on time.time(), for buckets whose timestamps must be meaningful outside of the current process,
+    e.g. when they are persisted.
+    """
+
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.time)
+
+
+class VirtualClock(Clock):
+    """
+    Clock, that only advances when it is told so.
+
+    Sleeping and waiting advance the virtual time instead of blocking, so a blocking consume returns immediately
+    with the clock moved to the moment the tokens became available. Meant for tests and simulations, that drive
+    the buckets from a single thread.
+    """
+
+    def __init__(self, start=0.0):
+        # type: (float) -> None
+        """
+        :param start: the initial time of the clock
+        """
+
+        self.now = start  # type: float
+
+    def time(self):
+        # type: () -> float
+        return self.now
+
+    def sleep(self, seconds):
+        # type: (float) -> None
+        self.advance(seconds)
+
+    def wait(self, condition, timeout):
+        # type: (threading.Condition, float) -> None
+        if timeout is not None:
+            self.advance(timeout)
+
+    def advance(self, seconds):
+        # type: (float) -> None
+        """
+        moves the clock forward
+
+        :param seconds: the time to move forward, negative values are ignored
+        """
+
+        if seconds > 0:
+            self.now += seconds
+
+    def set(self, now):
+        # type: (float) -> None
+        """
+        moves the clock forward to the given time, the clock never goes backwards
+
+        :param now: the new time of the clock
+        """
+
+        if now > self.now:
+            self.now = now
+
+
+DEFAULT_CLOCK = MonotonicClock()
+
+# time.time() passed this in 2001, time.monotonic() counts from the boot on most platforms and stays far below
+EPOCH_SCALE = 1e9
+
+
+def check_timestamp(clock, timestamp):
+    # type: (Clock, float) -> None
+    """
+    rejects timestamps of the wall clock for a bucket with a monotonic clock. The default clock of the buckets used
+    to be the wall clock, a timestamp of time.time() passed as lastupdate or now would never let the bucket refill.
+
+    :param clock: the clock of the bucket
+    :param timestamp: the timestamp passed to the bucket
+    :raises ValueError: the timestamp is a time.time() timestamp, but the clock is monotonic
+    """
+
+    if timestamp >= EPOCH_SCALE and isinstance(clock, MonotonicClock) and clock.time() < EPOCH_SCALE:
+        raise ValueError("timestamp " + str(timestamp) + " is from time.time(), but the clock of the bucket is "
+                         "monotonic, pass timestamps of the clock of the bucket or clock=WallClock()")
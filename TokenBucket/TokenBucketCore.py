@@ -0,0 +1,103 @@
+"""
+Storage agnostic arithmetic of the Token Bucket.
+
+The functions operate on the plain state of a bucket (its value and the time of its last update) and return the new
+state, so the same arithmetic can be used by buckets, that keep their state in instance attributes, in arrays, in
+shared memory or in a remote storage.
+"""
+import math
+from typing import Tuple
+
+# version of the state of pickled buckets and of snapshots, increased on incompatible changes
+STATE_VERSION = 1
+
+
+def check_state_version(version):
+    # type: (int) -> None
+    """
+    :raises ValueError: a ValueError is raised, if a state was stored by an unknown version
+    """
+
+    if version != STATE_VERSION:
+        raise ValueError("unsupported state version " + str(version) + ", expected " + str(STATE_VERSION))
+
+
+def refill_state(value, last_update, size, refill_rate, refill_amount, now, force=False):
+    # type: (int, float, int, float, int, float, bool) -> Tuple[int, float]
+    """
+    Performs a refill operation on the state of a Token Bucket.
+    The refill operation will only succeed, if the last update is long enough ago.
+
+    :param value: the current value of the bucket
+    :param last_update: the time of the last refill of the bucket
+    :param size: The size of the Token Bucket
+    :param refill_rate: The time interval for refilling the Token Bucket
+    :param refill_amount: The amount of tokens to refill per refill operation
+    :param now: Specifies the current time to use
+    :param force: perform a refill operation, even if no refill operation can be done at the moment.
+    :return: the refilled value and the time of the last refill
+    """
+
+    refill_count = int((now - last_update) / refill_rate)  # how many refill operations we can perform
+    if last_update + (refill_count + 1) * refill_rate <= now:
+        # the division rounded down, but the time to wait for the next refill has passed
+        refill_count += 1
+    if refill_count > 0:
+        value += refill_count * refill_amount  # how many items can be refilled
+
+        # amount of refill operations * refilltime -> last update
+        # this is a logical calculation, based that the clock is accurate
+        last_update += refill_count * refill_rate
+    elif force:
+        value += refill_amount
+        last_update += 1 * refill_rate
+
+    if value > size:
+        value = size
+    return value, last_update
+
+
+def time_to_wait(value, last_update, refill_rate, refill_amount, token_amount, now):
+    # type: (int, float, float, int, int, float) -> float
+    """
+    calculates the time until a refilled bucket holds token_amount tokens.
+
+    :param value: the current value of the bucket, after it has been refilled
+    :param last_update: the time of the last refill of the bucket
+    :param refill_rate: The time interval for refilling the Token Bucket
+    :param refill_amount: The amount of tokens to refill per refill operation
+    :param token_amount: amount of tokens to wait for
+    :param now: Specifies the current time to use
+    :return: the time to wait in seconds
+    """
+
+    additional_tokes = token_amount - value  # the ammount of tokens we are short
+    if additional_tokes <= 0:
+        return 0.0
+    refill_count = math.ceil(additional_tokes / float(refill_amount))  # refill operations to wait for
+    time_to_wait = last_update + refill_count * refill_rate - now
+    if time_to_wait < 0:
+        return 0.0
+    return time_to_wait
+
+
+def consume_state(value, last_update, size, refill_rate, refill_amount, token_amount, now):
+    # type: (int, float, int, float, int, int, float) -> Tuple[bool, int, float, float]
+    """
+    refills the state of a Token Bucket and consumes token_amount tokens, if there are enough tokens.
+
+    :param value: the current value of the bucket
+    :param last_update: the time of the last refill of the bucket
+    :param size: The size of the Token Bucket
+    :param refill_rate: The time interval for refilling the Token Bucket
+    :param refill_amount: The amount of tokens to refill per refill operation
+    :param token_amount: amount of tokens to consume
+    :param now: Specifies the current time to use
+    :return: if the tokens were consumed, the new value, the new time of the last refill and the time to wait until
+             enough tokens are available, if the tokens were not consumed
+    """
+
+    value, last_update = refill_state(value, last_update, size, refill_rate, refill_amount, now)
+    if token_amount <= value:
+        return True, value - token_amount, last_update, 0.0
+    return False, value, last_update, time_to_wait(value, last_update, refill_rate, refill_amount, token_amount, now)
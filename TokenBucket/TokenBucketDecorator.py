@@ -1,31 +1,261 @@
-from typing import Callable
+import asyncio
+import functools
+import inspect
+import time
+from typing import TYPE_CHECKING, Callable, Hashable
 
-import wrapt
+try:
+    import wrapt
+except ImportError:
+    # wrapt is optional, the fallback wraps with functools.wraps, which copies the metadata of the function, but does
+    # not bind instance to the wrapper
+    wrapt = None
 
-from . import TokenBucket
 # noinspection PyUnresolvedReferences
 from .TokenBucketErrors import TimeoutError, BucketSizeError, TokenAmountError
 
+if TYPE_CHECKING:
+    # for the type comments only, importing the decorator does not load the buckets
+    from . import TokenBucket
+    from .TokenBucketKeyed import KeyedTokenBucket
+    from .TokenBucketMetrics import TokenBucketMetrics
 
-def withTokenBucket(bucket, token_amount=1, blocking=True, timeout=None):
-    # type: (TokenBucket, int, bool, float) -> Callable
+
+class _KeyedBucket(object):
+    """
+    the bucket of one key of a keyed store like KeyedTokenBucket, with the interface of a TokenBucket used by the
+    decorator
+    """
+
+    __slots__ = ('store', 'key')
+
+    def __init__(self, store, key):
+        # type: (KeyedTokenBucket, Hashable) -> None
+        self.store = store
+        self.key = key
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        return self.store.consumeToken(self.key, token_amount, blocking=blocking, timeout=timeout)
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        return self.store.try_consume(self.key, token_amount)
+
+
+def withTokenBucket(bucket, token_amount=1, blocking=True, timeout=None, metrics=None, on_reject=None,
+                    reserve=False, cost=None, key=None, fast=False):
+    # type: (TokenBucket, int, bool, float, TokenBucketMetrics, Callable, bool, Callable, Callable, bool) -> Callable
     """
     Decorator to limit a function with a TokenBucket
 
-    :param bucket: The TokenBucket to use
+    Coroutine functions are detected and get an async wrapper. If the bucket is an AsyncTokenBucket, waiting for
+    tokens is done without blocking the event loop, a synchronous bucket is waited for in the default executor of
+    the loop, so the event loop is not blocked either. Generator and async generator functions take their tokens, when
+    they are started by the first iteration, not when they are called.
+
+    With on_reject, tokens are taken with bucket.try_consume() and a rejected call returns the result of
+    on_reject(*args, **kwargs) instead of raising, a rejected generator yields the items of the result, if it is not
+    None. With reserve, tokens are taken with bucket.reserve() and the returned delay is slept, for coroutine
+    functions with asyncio.sleep(), so even a synchronous bucket does not block the event loop. blocking and timeout
+    do not apply to both modes.
+
+    With cost, a call takes cost(*args, **kwargs) tokens instead of token_amount, e.g. to charge by payload size.
+    With key, bucket is a keyed store, a mapping of keys to buckets or a store taking the key as first argument of
+    consumeToken() and try_consume() like KeyedTokenBucket, and a call takes its tokens from the bucket of
+    key(*args, **kwargs), e.g. to limit per user. A store like KeyedTokenBucket does not support reserve.
+
+    The wrapper is built with wrapt, if installed, which binds methods like the decorated function. With fast, or
+    without wrapt, a plain function wrapper is returned, which saves the wrapt proxy on every call. Either way, for
+    methods, self is passed to on_reject, cost and key like any other argument.
+
+    :param bucket: The TokenBucket to use, or the keyed store of Token Buckets, if key is given
     :param token_amount: The amount of tokens to consume for one function call
     :param blocking: If the token requiring process should block
     :param timeout: The timeout to use for requiring a token
+    :param metrics: Record the consumes of the decorated function into the given metrics, meant for buckets, that do
+                    not record consumes themselves. The time to wait of denied consumes is unknown and reported as
+                    None.
+    :param on_reject: Called instead of the function, if there are not enough tokens
+    :param reserve: Reserve the tokens and wait for the returned delay
+    :param cost: Called with the arguments of a call, returns the amount of tokens to consume for it
+    :param key: Called with the arguments of a call, returns the key of the bucket in the keyed store to use
+    :param fast: Return a plain function wrapper instead of a wrapt proxy
     :exception TimeoutError: The time to require all needed tokes exceeds the given timeout
     :exception BucketSizeError: The amount of tokens to acquire for a function call exceeds the TokenBucket Size
     :exception TokenAmountError: Raised when token acquiring is not in blocking mode. Required token amount for a
                                  function call exceeds the current fill level of the bucket
     """
 
-    # noinspection PyUnusedLocal
-    @wrapt.decorator
-    def wrapper(wrapped, instance, args, kwargs):
-        bucket.consumeToken(token_amount=token_amount, blocking=blocking, timeout=timeout)
+    # a keyed store, that is not a mapping of buckets, takes the key as argument like KeyedTokenBucket
+    keyed_store = key is not None and not hasattr(bucket, '__getitem__')
+    if keyed_store and reserve:
+        raise ValueError("a keyed store like KeyedTokenBucket does not support reserve")
+
+    # the bucket and the amount of tokens of a call are selected by functions chosen once here, not on every call
+    if key is None:
+        def select(args, kwargs):
+            return bucket
+    elif keyed_store:
+        def select(args, kwargs):
+            return _KeyedBucket(bucket, key(*args, **kwargs))
+    else:
+        def select(args, kwargs):
+            return bucket[key(*args, **kwargs)]
+
+    if cost is None:
+        def amount(args, kwargs):
+            return token_amount
+    else:
+        def amount(args, kwargs):
+            return cost(*args, **kwargs)
+
+    def consume(target, tokens):
+        if metrics is None:
+            target.consumeToken(token_amount=tokens, blocking=blocking, timeout=timeout)
+            return
+        started = time.monotonic()
+        try:
+            target.consumeToken(token_amount=tokens, blocking=blocking, timeout=timeout)
+        except TokenAmountError:
+            metrics.record_denied(target, tokens, None)
+            raise
+        except TimeoutError:
+            metrics.record_timeout(target, tokens, None)
+            raise
+        metrics.record_granted(target, tokens, time.monotonic() - started)
+
+    async def consume_async(target, tokens):
+        if metrics is None:
+            await target.consume(tokens, blocking=blocking, timeout=timeout)
+            return
+        started = time.monotonic()
+        try:
+            await target.consume(tokens, blocking=blocking, timeout=timeout)
+        except TokenAmountError:
+            metrics.record_denied(target, tokens, None)
+            raise
+        except TimeoutError:
+            metrics.record_timeout(target, tokens, None)
+            raise
+        metrics.record_granted(target, tokens, time.monotonic() - started)
+
+    if key is None and cost is None and metrics is None and on_reject is None and not reserve:
+        # the common case, a fixed amount of tokens from one bucket
+        def take(args, kwargs):
+            bucket.consumeToken(token_amount=token_amount, blocking=blocking, timeout=timeout)
+            return True
+    else:
+        def take(args, kwargs):
+            """
+            takes the tokens for a call
+
+            :return: False, if the call is rejected
+            """
+
+            target = select(args, kwargs)
+            tokens = amount(args, kwargs)
+            if on_reject is not None:
+                return target.try_consume(tokens)
+            if reserve:
+                delay = target.reserve(tokens)
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                consume(target, tokens)
+            return True
+
+    async def take_async(args, kwargs):
+        target = select(args, kwargs)
+        tokens = amount(args, kwargs)
+        if on_reject is not None:
+            return target.try_consume(tokens)
+        if reserve:
+            delay = target.reserve(tokens)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif hasattr(target, 'consume'):
+            await consume_async(target, tokens)
+        elif blocking:
+            # a synchronous bucket blocks the waiting thread, that must not be the thread of the event loop
+            await asyncio.get_running_loop().run_in_executor(None, consume, target, tokens)
+        else:
+            consume(target, tokens)
+        return True
+
+    def call(wrapped, args, kwargs):
+        if not take(args, kwargs):
+            return on_reject(*args, **kwargs)
         return wrapped(*args, **kwargs)
 
-    return wrapper
+    async def call_async(wrapped, args, kwargs):
+        if not await take_async(args, kwargs):
+            result = on_reject(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return await wrapped(*args, **kwargs)
+
+    def call_generator(wrapped, args, kwargs):
+        if not take(args, kwargs):
+            result = on_reject(*args, **kwargs)
+            if result is not None:
+                yield from result
+            return
+        return (yield from wrapped(*args, **kwargs))
+
+    async def call_async_generator(wrapped, args, kwargs):
+        # async generators have no yield from, values sent with asend() are not passed on
+        if not await take_async(args, kwargs):
+            result = on_reject(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            if hasattr(result, '__aiter__'):
+                async for item in result:
+                    yield item
+            elif result is not None:
+                for item in result:
+                    yield item
+            return
+        async for item in wrapped(*args, **kwargs):
+            yield item
+
+    def decorator(wrapped):
+        if inspect.isasyncgenfunction(wrapped):
+            caller = call_async_generator
+
+            async def function(*args, **kwargs):
+                async for item in call_async_generator(wrapped, args, kwargs):
+                    yield item
+        elif asyncio.iscoroutinefunction(wrapped):
+            caller = call_async
+
+            async def function(*args, **kwargs):
+                return await call_async(wrapped, args, kwargs)
+        elif inspect.isgeneratorfunction(wrapped):
+            caller = call_generator
+
+            def function(*args, **kwargs):
+                return (yield from call_generator(wrapped, args, kwargs))
+        else:
+            caller = call
+
+            def function(*args, **kwargs):
+                if not take(args, kwargs):
+                    return on_reject(*args, **kwargs)
+                return wrapped(*args, **kwargs)
+
+        if fast or wrapt is None:
+            return functools.wraps(wrapped)(function)
+
+        # noinspection PyUnusedLocal
+        def wrapper(wrapped_, instance, args, kwargs):
+            # wrapt passes bound methods without self, it is passed on like the plain function wrapper does
+            function_ = getattr(wrapped_, '__func__', None)
+            if function_ is not None:
+                return caller(function_, (wrapped_.__self__,) + args, kwargs)
+            return caller(wrapped_, args, kwargs)
+
+        return wrapt.decorator(wrapper)(wrapped)
+
+    return decorator
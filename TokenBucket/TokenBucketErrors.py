@@ -12,3 +12,7 @@ class TokenAmountError(TokenBucketError):
 
 class BucketSizeError(TokenBucketError):
     pass
+
+
+class QueueFullError(TokenBucketError):
+    pass
@@ -0,0 +1,370 @@
+import asyncio
+import concurrent.futures
+import heapq
+import inspect
+import itertools
+import os
+import threading
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from .TokenBucketErrors import QueueFullError
+
+
+def _default_workers():
+    # type: () -> int
+    # the default of the ThreadPoolExecutor
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _refund(bucket, cost):
+    # type: (object, int) -> None
+    # gives the tokens of a callable, that was cancelled while its tokens were waited for, back to the bucket, if it
+    # has a refund() method, otherwise they are dropped
+    refund = getattr(bucket, 'refund', None)
+    if refund is not None:
+        refund(cost)
+
+
+def _settle(future, exc):
+    # type: (asyncio.Future, BaseException) -> None
+    # a cancelled dispatcher or call cancels the future of the caller, other errors are raised by the future
+    if future.done():
+        return
+    if isinstance(exc, asyncio.CancelledError):
+        future.cancel()
+    else:
+        future.set_exception(exc)
+
+
+class RateLimitedExecutor(concurrent.futures.Executor):
+    """
+    Executor, that starts the submitted callables no faster than the bucket allows.
+
+    Submitted callables are queued by priority, a single dispatcher thread waits for a free worker and for the
+    tokens of the next callable, then hands the callable to a worker thread. The worker threads never wait for
+    tokens, only the dispatcher does. Callables with a higher priority are dispatched first, callables with the same
+    priority in submission order.
+    The tokens of a callable, whose future was cancelled while they were waited for, are given back to the bucket,
+    if it has a refund() method.
+    """
+
+    def __init__(self, bucket, max_workers=None, max_queue=0, costs=None):
+        # type: (object, int, int, Dict[Callable, int]) -> None
+        """
+        :param bucket: The Token Bucket to consume the tokens of a callable from, before it is started
+        :param max_workers: The amount of worker threads
+        :param max_queue: The maximum amount of queued callables, 0 for an unbounded queue
+        :param costs: The amount of tokens per callable, callables without an entry cost 1 token
+        """
+
+        self.bucket = bucket
+        self.max_queue = max_queue  # type: int
+        self.costs = dict(costs) if costs else {}  # type: Dict[Callable, int]
+        self._queue = []  # type: List[Tuple[float, int, int, concurrent.futures.Future, Callable, tuple, dict]]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._shutdown = False  # type: bool
+        max_workers = max_workers or _default_workers()
+        self._slots = threading.Semaphore(max_workers)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._dispatcher = threading.Thread(target=self._dispatch, name='RateLimitedExecutor', daemon=True)
+        self._dispatcher.start()
+
+    @property
+    def queue_depth(self):
+        # type: () -> int
+        """
+        the amount of callables waiting to be dispatched
+        """
+
+        return len(self._queue)
+
+    def submit(self, fn, *args, **kwargs):
+        # type: (Callable, *Any, **Any) -> concurrent.futures.Future
+        return self.submit_with(fn, args, kwargs)
+
+    def submit_with(self, fn, args=(), kwargs=None, cost=None, priority=0, block=True, timeout=None):
+        # type: (Callable, tuple, dict, int, float, bool, float) -> concurrent.futures.Future
+        """
+        queues a callable
+
+        :param fn: the callable
+        :param args: the positional arguments for the callable
+        :param kwargs: the keyword arguments for the callable
+        :param cost: the amount of tokens to consume, defaults to the entry in costs
+        :param priority: callables with a higher priority are dispatched first
+        :param block: wait for space in a full queue
+        :param timeout: the maximum time to wait for space in a full queue
+        :return: the future of the call
+        :raises QueueFullError: a QueueFullError is raised, if the queue is full and blocking is set to False, or if
+                                there was no space in the queue within the timeout
+        """
+
+        if cost is None:
+            cost = self.costs.get(fn, 1)
+        future = concurrent.futures.Future()
+        with self._condition:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                if not block or not self._condition.wait_for(
+                        lambda: len(self._queue) < self.max_queue or self._shutdown, timeout):
+                    raise QueueFullError("the queue holds " + str(self.max_queue) + " callables")
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            heapq.heappush(self._queue, (-priority, next(self._sequence), cost, future, fn, args, kwargs or {}))
+            self._condition.notify_all()
+        return future
+
+    def _dispatch(self):
+        # type: () -> None
+        while True:
+            # take a free worker first, so a callable queued meanwhile may still overtake by priority
+            self._slots.acquire()
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._shutdown)
+                if not self._queue:
+                    self._slots.release()
+                    self._pool.shutdown(wait=False)
+                    return
+                _, _, cost, future, fn, args, kwargs = heapq.heappop(self._queue)
+                self._condition.notify_all()
+            if future.cancelled():
+                self._slots.release()
+                continue
+            try:
+                self.bucket.consumeToken(cost)
+            except BaseException as exc:
+                self._slots.release()
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(exc)
+                continue
+            if not future.set_running_or_notify_cancel():
+                self._slots.release()
+                _refund(self.bucket, cost)
+                continue
+            self._pool.submit(self._run, future, fn, args, kwargs)
+
+    def _run(self, future, fn, args, kwargs):
+        # type: (concurrent.futures.Future, Callable, tuple, dict) -> None
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        # type: (bool, bool) -> None
+        """
+        stops accepting callables, the queued callables are still dispatched, unless cancel_futures is set.
+
+        :param wait: wait until all queued callables are done
+        :param cancel_futures: cancel all queued callables
+        """
+
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for item in self._queue:
+                    item[3].cancel()
+                del self._queue[:]
+            self._condition.notify_all()
+        if wait:
+            self._dispatcher.join()
+            self._pool.shutdown(wait=True)
+
+
+class AsyncRateLimitedExecutor(object):
+    """
+    asyncio flavour of the RateLimitedExecutor, starts coroutine functions or plain callables no faster than the
+    bucket allows, without blocking the event loop.
+
+    The bucket may be an AsyncTokenBucket, a synchronous bucket with reserve(), the dispatcher then sleeps for the
+    reservation, or any other synchronous bucket, which is waited for in a thread.
+    The executor must only be used from within one event loop.
+    """
+
+    def __init__(self, bucket, max_concurrency=None, max_queue=0, costs=None):
+        # type: (object, int, int, Dict[Callable, int]) -> None
+        """
+        :param bucket: The Token Bucket to consume the tokens of a callable from, before it is started
+        :param max_concurrency: The maximum amount of running callables, None for no limit
+        :param max_queue: The maximum amount of queued callables, 0 for an unbounded queue
+        :param costs: The amount of tokens per callable, callables without an entry cost 1 token
+        """
+
+        self.bucket = bucket
+        self.max_concurrency = max_concurrency  # type: int
+        self.max_queue = max_queue  # type: int
+        self.costs = dict(costs) if costs else {}  # type: Dict[Callable, int]
+        self._queue = []  # type: List[Tuple[float, int, int, asyncio.Future, Callable, tuple, dict]]
+        self._sequence = itertools.count()
+        self._condition = None  # type: asyncio.Condition
+        self._slots = None  # type: asyncio.Semaphore
+        self._dispatcher = None  # type: asyncio.Task
+        self._running = set()  # type: Set[asyncio.Task]
+        self._shutdown = False  # type: bool
+
+    @property
+    def queue_depth(self):
+        # type: () -> int
+        """
+        the amount of callables waiting to be dispatched
+        """
+
+        return len(self._queue)
+
+    def _start(self):
+        # type: () -> None
+        # created on first use, the primitives and the task belong to the running event loop
+        self._condition = asyncio.Condition()
+        if self.max_concurrency:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def submit(self, fn, *args, **kwargs):
+        # type: (Callable, *Any, **Any) -> asyncio.Future
+        return await self.submit_with(fn, args, kwargs)
+
+    async def submit_with(self, fn, args=(), kwargs=None, cost=None, priority=0, block=True, timeout=None):
+        # type: (Callable, tuple, dict, int, float, bool, float) -> asyncio.Future
+        """
+        queues a coroutine function or a callable, the result of the call is awaited, if it is awaitable
+
+        :param fn: the coroutine function or callable
+        :param args: the positional arguments for the call
+        :param kwargs: the keyword arguments for the call
+        :param cost: the amount of tokens to consume, defaults to the entry in costs
+        :param priority: callables with a higher priority are dispatched first
+        :param block: wait for space in a full queue
+        :param timeout: the maximum time to wait for space in a full queue
+        :return: the future of the call
+        :raises QueueFullError: a QueueFullError is raised, if the queue is full and blocking is set to False, or if
+                                there was no space in the queue within the timeout
+        """
+
+        if self._shutdown:
+            raise RuntimeError('cannot schedule new futures after shutdown')
+        if self._dispatcher is None:
+            self._start()
+        if cost is None:
+            cost = self.costs.get(fn, 1)
+        future = asyncio.get_running_loop().create_future()
+        async with self._condition:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                if not block:
+                    raise QueueFullError("the queue holds " + str(self.max_queue) + " callables")
+                try:
+                    await asyncio.wait_for(self._condition.wait_for(
+                        lambda: len(self._queue) < self.max_queue or self._shutdown), timeout)
+                except asyncio.TimeoutError:
+                    raise QueueFullError("the queue holds " + str(self.max_queue) + " callables")
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            heapq.heappush(self._queue, (-priority, next(self._sequence), cost, future, fn, args, kwargs or {}))
+            self._condition.notify_all()
+        return future
+
+    async def _consume(self, cost):
+        # type: (int) -> None
+        bucket = self.bucket
+        if hasattr(bucket, 'consume'):
+            await bucket.consume(cost)
+        elif hasattr(bucket, 'reserve'):
+            delay = bucket.reserve(cost)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                _refund(bucket, cost)
+                raise
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, bucket.consumeToken, cost)
+
+    def _release(self):
+        # type: () -> None
+        if self._slots is not None:
+            self._slots.release()
+
+    async def _dispatch(self):
+        # type: () -> None
+        try:
+            while True:
+                if self._slots is not None:
+                    await self._slots.acquire()
+                async with self._condition:
+                    await self._condition.wait_for(lambda: self._queue or self._shutdown)
+                    if not self._queue:
+                        self._release()
+                        return
+                    _, _, cost, future, fn, args, kwargs = heapq.heappop(self._queue)
+                    self._condition.notify_all()
+                if future.cancelled():
+                    self._release()
+                    continue
+                try:
+                    await self._consume(cost)
+                except BaseException as exc:
+                    self._release()
+                    _settle(future, exc)
+                    if not isinstance(exc, Exception):
+                        raise
+                    continue
+                if future.cancelled():
+                    self._release()
+                    _refund(self.bucket, cost)
+                    continue
+                task = asyncio.ensure_future(self._run(future, fn, args, kwargs))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        except BaseException:
+            # the dispatcher was cancelled, e.g. with its event loop, the queued callables are never started
+            for item in self._queue:
+                item[3].cancel()
+            del self._queue[:]
+            raise
+
+    async def _run(self, future, fn, args, kwargs):
+        # type: (asyncio.Future, Callable, tuple, dict) -> None
+        try:
+            result = fn(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+        except BaseException as exc:
+            _settle(future, exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._release()
+
+    async def shutdown(self, wait=True, cancel_futures=False):
+        # type: (bool, bool) -> None
+        """
+        stops accepting callables, the queued callables are still dispatched, unless cancel_futures is set.
+
+        :param wait: wait until all queued callables are done
+        :param cancel_futures: cancel all queued callables
+        """
+
+        self._shutdown = True
+        if self._dispatcher is None:
+            return
+        async with self._condition:
+            if cancel_futures:
+                for item in self._queue:
+                    item[3].cancel()
+                del self._queue[:]
+            self._condition.notify_all()
+        if wait:
+            await self._dispatcher
+            if self._running:
+                await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.shutdown()
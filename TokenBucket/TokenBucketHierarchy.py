@@ -0,0 +1,235 @@
+import math
+import threading
+from typing import List
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK, check_timestamp
+from .TokenBucketCore import refill_state, time_to_wait as core_time_to_wait
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+
+class HierarchicalTokenBucket(object):
+    """
+    Token Bucket in a tree of nested limits, e.g. global > tenant > user > endpoint.
+
+    A consume from a bucket draws the tokens from the bucket and from all of its ancestors at once, either all of
+    them are debited or none, so no subtree can exceed the limit of its root. The whole tree shares one mutex,
+    which is acquired once per consume, every consume passes the root anyway.
+
+    A child created with borrow=True may consume more than its own tokens by borrowing the missing tokens from the
+    spare capacity of its parent. Spare are the tokens of the parent, that are not covered by the current fill
+    levels of its children, e.g. the share of idle siblings. Children, that borrowed within the last refill interval
+    of the parent, share the spare capacity by their weights. A borrowing child is debited its own tokens only.
+    """
+
+    def __init__(self, size, refillrate, refillamount, parent=None, weight=1, borrow=False, clock=None):
+        # type: (int, float, int, HierarchicalTokenBucket, float, bool, Clock) -> None
+        """
+        :param size: The size of the Token Bucket
+        :param refillrate: The time interval for refilling the Token Bucket
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param parent: The parent bucket, None for the root of a tree
+        :param weight: The share of the spare capacity of the parent, relative to the other borrowing children
+        :param borrow: Borrow tokens from the spare capacity of the parent, if the own tokens are not enough
+        :param clock: The clock of the tree, only used for a root, defaults to a monotonic clock
+        """
+
+        self.size = size  # type: int
+        self.value = size  # type: int
+        self.refill_rate = refillrate  # type: float
+        self.refill_amount = refillamount  # type: int
+        self.parent = parent  # type: HierarchicalTokenBucket
+        self.weight = weight  # type: float
+        self.borrow = borrow and parent is not None  # type: bool
+        self.children = []  # type: List[HierarchicalTokenBucket]
+        self.last_borrow = float('-inf')  # type: float
+        if parent is None:
+            self.mutex = threading.RLock()  # type: threading.RLock
+            self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+            self.path = [self]  # type: List[HierarchicalTokenBucket]  # root first
+        else:
+            self.mutex = parent.mutex
+            self.clock = parent.clock
+            self.path = parent.path + [self]
+            with self.mutex:
+                parent.children.append(self)
+        self.last_update = self.clock.time()  # type: float
+
+    def child(self, size, refillrate, refillamount, weight=1, borrow=True):
+        # type: (int, float, int, float, bool) -> HierarchicalTokenBucket
+        """
+        creates a child bucket
+
+        :param size: The size of the child bucket
+        :param refillrate: The time interval for refilling the child bucket
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param weight: The share of the spare capacity of this bucket, relative to the other borrowing children
+        :param borrow: Borrow tokens from the spare capacity of this bucket, if the own tokens are not enough
+        :return: the child bucket
+        """
+
+        return HierarchicalTokenBucket(size, refillrate, refillamount, parent=self, weight=weight, borrow=borrow)
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the current fill level of this bucket, without the tokens it could borrow.
+
+        :return: the current fill level of the Token Bucket
+        """
+
+        with self.mutex:
+            self._refill(self.clock.time())
+            return self.value
+
+    def refill(self, now=None, force=False):
+        # type: (float, bool) -> None
+        """
+        Performs a refill operation on this bucket.
+        The refill operation will only succeed, if the last update is long enough ago.
+
+        :param now: Specifies the current time to use
+        :param force: perform a refill operation, even if no refill operation can be done at the moment.
+        """
+
+        with self.mutex:
+            if not now:
+                now = self.clock.time()
+            else:
+                check_timestamp(self.clock, now)
+            self._refill(now, force)
+
+    def _refill(self, now, force=False):
+        # type: (float, bool) -> None
+        self.value, self.last_update = refill_state(self.value, self.last_update, self.size, self.refill_rate,
+                                                    self.refill_amount, now, force)
+
+    def _borrowable(self, now):
+        # type: (float) -> int
+        """
+        calculates the amount of tokens this bucket may borrow from its parent, must be called with the mutex held
+        and after a refill of the path.
+        """
+
+        parent = self.parent
+        claimed = 0
+        borrowers_weight = self.weight
+        for sibling in parent.children:
+            if sibling is not self:
+                sibling._refill(now)
+                if now - sibling.last_borrow < parent.refill_rate:
+                    borrowers_weight += sibling.weight
+            claimed += sibling.value
+        spare = parent.value - claimed
+        if spare <= 0:
+            return 0
+        return int(math.ceil(spare * self.weight / borrowers_weight))
+
+    def _time_to_wait(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        calculates the time until the path may have enough tokens, must be called with the mutex held and after a
+        refill of the path. A bucket, that may borrow, is checked again at the next refill of its parent.
+        """
+
+        time_to_wait = 0.0
+        for node in self.path:
+            if node.value >= token_amount:
+                continue
+            node_wait = core_time_to_wait(node.value, node.last_update, node.refill_rate, node.refill_amount,
+                                          token_amount, now)
+            if node.borrow:
+                parent = node.parent
+                node_wait = min(node_wait, max(0.0, parent.last_update + parent.refill_rate - now))
+            time_to_wait = max(time_to_wait, node_wait)
+        return time_to_wait
+
+    def _consume(self, token_amount, now):
+        # type: (int, float) -> bool
+        """
+        debits the path, if every bucket has enough own or borrowed tokens, must be called with the mutex held.
+        """
+
+        path = self.path
+        for node in path:
+            node._refill(now)
+        # check from the leaf up, a borrowing bucket only needs its parent to have enough spare tokens
+        borrowers = []
+        for node in reversed(path):
+            if node.value >= token_amount:
+                continue
+            if not node.borrow or token_amount - node.value > node._borrowable(now):
+                return False
+            borrowers.append(node)
+        for node in path:
+            node.value = node.value - token_amount if node.value >= token_amount else 0
+        for node in borrowers:
+            node.last_borrow = now
+        return True
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        """
+        Consumes x tokens from this bucket and all of its ancestors, if there are enough tokens, without blocking
+        and without raising.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 size of a bucket on the path, that cannot borrow
+        """
+
+        self._check_size(token_amount)
+        with self.mutex:
+            return self._consume(token_amount, self.clock.time())
+
+    def _check_size(self, token_amount):
+        # type: (int) -> None
+        for node in self.path:
+            if token_amount > node.size and not node.borrow:
+                raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens from this bucket and all of its ancestors.
+        Per default this method waits and blocks until at least x tokens are available for consuming.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 size of a bucket on the path, that cannot borrow
+        :raises TokenAmountError: a TokenAmountError is raised, if a bucket on the path has not enough tokens and
+                                  blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the path has not enough tokens and the time to wait for a
+                              sufficient amount of tokens would take longer than the given timeout
+        """
+
+        self._check_size(token_amount)
+
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                if self._consume(token_amount, now):
+                    return True
+                if not blocking:
+                    raise TokenAmountError("cannot reduce all buckets of the path by the requested amount of tokens, "
+                                           "at least one bucket has not enough tokens")
+                time_to_wait = self._time_to_wait(token_amount, now)
+                if timeout:
+                    if time_to_wait > timeout:
+                        raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                            time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
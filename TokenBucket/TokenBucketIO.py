@@ -0,0 +1,386 @@
+"""
+Bandwidth limited wrappers for files, sockets and asyncio streams, one token is one byte.
+
+I/O is split into pieces, that the bucket can grant, so buffers larger than the bucket never raise a
+BucketSizeError. An operation takes the tokens for its bytes, as far as they are available without waiting, and
+waits for one refill otherwise. Tokens of a read or write, that transferred less bytes, are given back to the
+bucket right away, so a wrapper holds no tokens between operations.
+
+Buffers are sliced with memoryview, the data is not copied. A wrapper must only be used by one thread (or task)
+at a time, like the object it wraps.
+"""
+import asyncio
+
+from .TokenBucketErrors import TokenAmountError, BucketSizeError
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class _Throttle(object):
+    """
+    hands out tokens of a bucket for bytes
+    """
+
+    def __init__(self, bucket, chunk_size):
+        # type: (object, int) -> None
+        self.bucket = bucket
+        self.chunk_size = chunk_size  # type: int
+        # the most tokens the bucket grants at once, a HierarchicalTokenBucket is limited by its ancestors too
+        nodes = getattr(bucket, 'path', None) or (bucket,)
+        self.size = min(node.size for node in nodes if not getattr(node, 'borrow', False))  # type: int
+
+    def _take_available(self, wanted):
+        # type: (int) -> int
+        """
+        takes up to wanted tokens, as far as the bucket grants them without waiting. Uses try_consume() or
+        consumeToken(blocking=False) of the bucket, so ancestors of a HierarchicalTokenBucket, leases and metrics
+        are honoured.
+        """
+
+        bucket = self.bucket
+        taken = min(wanted, bucket.current_filllevel(), self.size)
+        if taken <= 0:
+            return 0
+        try_consume = getattr(bucket, 'try_consume', None)
+        try:
+            if try_consume is not None:
+                return taken if try_consume(taken) else 0
+            bucket.consumeToken(taken, blocking=False)
+        except (TokenAmountError, BucketSizeError):
+            return 0
+        return taken
+
+    def _minimum(self, wanted):
+        # type: (int) -> int
+        """
+        :return: the amount of tokens to wait for, if no token is available
+        """
+
+        return max(1, min(wanted, getattr(self.bucket, 'refill_amount', self.size), self.size))
+
+    def acquire(self, wanted):
+        # type: (int) -> int
+        """
+        blocks until at least one token is available
+
+        :param wanted: the amount of bytes to transfer
+        :return: the amount of bytes, that may be transferred now, between 1 and wanted
+        """
+
+        granted = self._take_available(wanted)
+        if not granted:
+            granted = self._minimum(wanted)
+            self.bucket.consumeToken(granted)
+        return granted
+
+    async def acquire_async(self, wanted):
+        # type: (int) -> int
+        """
+        like acquire(), but waits without blocking the event loop. Waits with consume() of an AsyncTokenBucket,
+        sleeps for a reservation of a synchronous bucket with reserve(), or waits for consumeToken() of other
+        buckets in the default executor.
+        """
+
+        granted = self._take_available(wanted)
+        if not granted:
+            bucket = self.bucket
+            granted = self._minimum(wanted)
+            if hasattr(bucket, 'consume'):
+                await bucket.consume(granted)
+            elif hasattr(bucket, 'reserve'):
+                await asyncio.sleep(bucket.reserve(granted))
+            else:
+                await asyncio.get_running_loop().run_in_executor(None, bucket.consumeToken, granted)
+        return granted
+
+    def give_back(self, amount):
+        # type: (int) -> None
+        """
+        gives tokens of an acquire(), that were not used by the I/O operation, back to the bucket, if it has a
+        refund() method, otherwise they are dropped
+        """
+
+        if amount > 0:
+            refund = getattr(self.bucket, 'refund', None)
+            if refund is not None:
+                refund(amount)
+
+
+class ThrottledFile(object):
+    """
+    Wraps a binary file-like object, reads and writes are limited by the bucket.
+    All other attributes are passed through to the wrapped object.
+    """
+
+    def __init__(self, raw, bucket, chunk_size=DEFAULT_CHUNK_SIZE):
+        # type: (object, object, int) -> None
+        """
+        :param raw: the binary file-like object to wrap
+        :param bucket: the Token Bucket to take one token per byte from
+        :param chunk_size: the amount of bytes to transfer at once, if the amount is not limited by the caller
+        """
+
+        self.raw = raw
+        self.throttle = _Throttle(bucket, chunk_size)  # type: _Throttle
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def readinto(self, buffer):
+        # type: (bytearray) -> int
+        """
+        reads up to len(buffer) bytes, may return less bytes, if not enough tokens are available at once
+
+        :return: the amount of bytes read, 0 at the end of the file
+        """
+
+        view = memoryview(buffer).cast('B')
+        if not len(view):
+            return 0
+        granted = self.throttle.acquire(len(view))
+        read = self.raw.readinto(view[:granted]) or 0
+        self.throttle.give_back(granted - read)
+        return read
+
+    def read(self, size=-1):
+        # type: (int) -> bytes
+        """
+        reads up to size bytes, all bytes until the end of the file, if size is negative.
+        May return less bytes than size, if not enough tokens are available at once.
+        """
+
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(self.throttle.chunk_size)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if size == 0:
+            return b''
+        granted = self.throttle.acquire(size)
+        data = self.raw.read(granted) or b''
+        self.throttle.give_back(granted - len(data))
+        return data
+
+    def write(self, data):
+        # type: (bytes) -> int
+        """
+        writes all of data, in pieces the bucket grants
+
+        :return: the amount of bytes written, None if a non-blocking file would block before any byte was written
+        """
+
+        view = memoryview(data).cast('B')
+        offset = 0
+        while offset < len(view):
+            granted = self.throttle.acquire(len(view) - offset)
+            written = self.raw.write(view[offset:offset + granted])
+            if written is None:  # non-blocking file, that would block
+                self.throttle.give_back(granted)
+                return offset or None
+            self.throttle.give_back(granted - written)
+            offset += written
+        return offset
+
+    def close(self):
+        # type: () -> None
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ThrottledSocket(object):
+    """
+    Wraps a socket, sends and receives are limited by the bucket.
+    All other attributes are passed through to the wrapped socket.
+    """
+
+    def __init__(self, sock, bucket, chunk_size=DEFAULT_CHUNK_SIZE):
+        # type: (socket.socket, object, int) -> None
+        """
+        :param sock: the socket to wrap
+        :param bucket: the Token Bucket to take one token per byte from
+        :param chunk_size: the amount of bytes to transfer at once, if the amount is not limited by the caller
+        """
+
+        self.sock = sock
+        self.throttle = _Throttle(bucket, chunk_size)  # type: _Throttle
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def send(self, data, flags=0):
+        # type: (bytes, int) -> int
+        """
+        sends a part of data, at most as many bytes as the bucket grants at once
+
+        :return: the amount of bytes sent
+        """
+
+        view = memoryview(data).cast('B')
+        if not len(view):
+            return 0
+        granted = self.throttle.acquire(len(view))
+        try:
+            sent = self.sock.send(view[:granted], flags)
+        except BaseException:
+            self.throttle.give_back(granted)
+            raise
+        self.throttle.give_back(granted - sent)
+        return sent
+
+    def sendall(self, data, flags=0):
+        # type: (bytes, int) -> None
+        view = memoryview(data).cast('B')
+        offset = 0
+        while offset < len(view):
+            offset += self.send(view[offset:], flags)
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        # type: (bytearray, int, int) -> int
+        """
+        receives up to nbytes (or len(buffer)) bytes, may receive less bytes, if not enough tokens are available at
+        once
+        """
+
+        view = memoryview(buffer).cast('B')
+        wanted = nbytes or len(view)
+        if not wanted:
+            return 0
+        granted = self.throttle.acquire(wanted)
+        try:
+            received = self.sock.recv_into(view[:granted], granted, flags)
+        except BaseException:
+            self.throttle.give_back(granted)
+            raise
+        self.throttle.give_back(granted - received)
+        return received
+
+    def recv(self, bufsize, flags=0):
+        # type: (int, int) -> bytes
+        buffer = bytearray(bufsize)
+        received = self.recv_into(buffer, bufsize, flags)
+        return bytes(memoryview(buffer)[:received])
+
+    def sendfile(self, file, offset=0, count=None):
+        # type: (object, int, int) -> int
+        """
+        sends the content of file with socket.sendfile(), in pieces the bucket grants, so the data is not copied to
+        user space where the platform supports it. The socket must be blocking.
+
+        :param file: a regular file opened in binary mode
+        :param offset: where to start reading the file
+        :param count: the amount of bytes to send, until the end of the file if None
+        :return: the amount of bytes sent
+        """
+
+        total = 0
+        while count is None or total < count:
+            wanted = self.throttle.chunk_size if count is None else count - total
+            granted = self.throttle.acquire(wanted)
+            sent = self.sock.sendfile(file, offset + total, granted)
+            self.throttle.give_back(granted - sent)
+            total += sent
+            if not sent:  # end of the file
+                break
+        return total
+
+    def close(self):
+        # type: () -> None
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ThrottledStreamReader(object):
+    """
+    Wraps an asyncio.StreamReader, reads are limited by the bucket without blocking the event loop.
+    The bucket may be an AsyncTokenBucket or a synchronous bucket with reserve().
+    """
+
+    def __init__(self, reader, bucket, chunk_size=DEFAULT_CHUNK_SIZE):
+        # type: (asyncio.StreamReader, object, int) -> None
+        self.reader = reader  # type: asyncio.StreamReader
+        self.throttle = _Throttle(bucket, chunk_size)  # type: _Throttle
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    async def read(self, n=-1):
+        # type: (int) -> bytes
+        """
+        reads up to n bytes, all bytes until EOF, if n is negative
+        """
+
+        if n < 0:
+            chunks = []
+            while True:
+                chunk = await self.read(self.throttle.chunk_size)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if n == 0:
+            return b''
+        granted = await self.throttle.acquire_async(n)
+        data = await self.reader.read(granted)
+        self.throttle.give_back(granted - len(data))
+        return data
+
+    async def readexactly(self, n):
+        # type: (int) -> bytes
+        chunks = []
+        remaining = n
+        while remaining:
+            granted = await self.throttle.acquire_async(remaining)
+            try:
+                chunks.append(await self.reader.readexactly(granted))
+            except asyncio.IncompleteReadError as e:
+                self.throttle.give_back(granted - len(e.partial))
+                raise asyncio.IncompleteReadError(b''.join(chunks) + e.partial, n) from None
+            except BaseException:
+                self.throttle.give_back(granted)
+                raise
+            remaining -= granted
+        return b''.join(chunks)
+
+
+class ThrottledStreamWriter(object):
+    """
+    Wraps an asyncio.StreamWriter, writes are limited by the bucket without blocking the event loop.
+    The bucket may be an AsyncTokenBucket or a synchronous bucket with reserve().
+    """
+
+    def __init__(self, writer, bucket, chunk_size=DEFAULT_CHUNK_SIZE):
+        # type: (asyncio.StreamWriter, object, int) -> None
+        self.writer = writer  # type: asyncio.StreamWriter
+        self.throttle = _Throttle(bucket, chunk_size)  # type: _Throttle
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    async def write(self, data):
+        # type: (bytes) -> None
+        """
+        writes all of data, in pieces the bucket grants, and drains the writer after every piece
+        """
+
+        view = memoryview(data).cast('B')
+        offset = 0
+        while offset < len(view):
+            granted = await self.throttle.acquire_async(len(view) - offset)
+            self.writer.write(view[offset:offset + granted])
+            await self.writer.drain()
+            offset += granted
+
+    def close(self):
+        # type: () -> None
+        self.writer.close()
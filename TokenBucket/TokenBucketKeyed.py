@@ -0,0 +1,277 @@
+import array
+import collections
+import itertools
+import math
+import threading
+from typing import Iterable, List, Union
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+from .TokenBucketCore import STATE_VERSION, check_state_version, refill_state, time_to_wait as core_time_to_wait
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+
+class KeyedTokenBucket(object):
+    """
+    Registry of Token Buckets, one per key (e.g. per API key or per client IP), that share one configuration.
+
+    Buckets are created lazily on the first use of a key. Their state is stored compactly in parallel arrays indexed
+    by a slot number, instead of one TokenBucket object with its own lock per key. All keys share one mutex.
+
+    Buckets that were not used for long enough to be refilled to full are evicted, this is lossless because a
+    full bucket is recreated on the next use of its key. An optional ttl evicts idle buckets earlier, an optional
+    max_keys limit evicts the least recently used buckets.
+    """
+
+    def __init__(self, size, refillrate, refillamount, ttl=None, max_keys=None, clock=None):
+        # type: (int, float, int, float, int, Clock) -> None
+        """
+        :param size: The size of every Token Bucket
+        :param refillrate: The time interval for refilling the Token Buckets
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param ttl: Evict buckets that were idle for longer than ttl seconds, even if not refilled to full yet
+        :param max_keys: The maximum amount of buckets to keep, evicts the least recently used bucket
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        """
+
+        self.size = size  # type: int
+        self.refill_rate = refillrate  # type: float
+        self.refill_amount = refillamount  # type: int
+        self.ttl = ttl  # type: float
+        self.max_keys = max_keys  # type: int
+        self.mutex = threading.RLock()  # type: threading.RLock
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+
+        # time after which an idle bucket is refilled to full
+        self.full_after = math.ceil(size / float(refillamount)) * refillrate  # type: float
+        self.idle_timeout = self.full_after  # type: float
+        if ttl is not None and ttl < self.full_after:
+            self.idle_timeout = ttl
+
+        # key -> slot, least recently used key first
+        self.slots = collections.OrderedDict()  # type: collections.OrderedDict
+        self.free_slots = []  # type: list
+        self.values = array.array('q')  # type: array.array
+        self.last_updates = array.array('d')  # type: array.array
+        self.last_access = array.array('d')  # type: array.array
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.slots)
+
+    def __contains__(self, key):
+        # type: (object) -> bool
+        return key in self.slots
+
+    def _slot(self, key, now):
+        # type: (object, float) -> int
+        """
+        returns the slot of the bucket for key, creates a full bucket if the key is unknown.
+        Must be called with the mutex held.
+        """
+
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.slots.move_to_end(key)
+            self.last_access[slot] = now
+            return slot
+
+        self.evict(now)
+        if self.max_keys is not None and len(self.slots) >= self.max_keys:
+            self.free_slots.append(self.slots.popitem(last=False)[1])
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.values[slot] = self.size
+            self.last_updates[slot] = now
+            self.last_access[slot] = now
+        else:
+            slot = len(self.values)
+            self.values.append(self.size)
+            self.last_updates.append(now)
+            self.last_access.append(now)
+        self.slots[key] = slot
+        return slot
+
+    def _refill(self, slot, now):
+        # type: (int, float) -> None
+        """
+        refills the bucket in slot, same semantics as TokenBucket.refill().
+        Must be called with the mutex held.
+        """
+
+        self.values[slot], self.last_updates[slot] = refill_state(
+            self.values[slot], self.last_updates[slot], self.size, self.refill_rate, self.refill_amount, now)
+
+    def evict(self, now=None):
+        # type: (float) -> int
+        """
+        evicts all buckets, that were idle for longer than the idle timeout.
+        The buckets are kept in least recently used order, so only the evicted buckets are visited.
+
+        :param now: Specifies the current time to use
+        :return: the amount of evicted buckets
+        """
+
+        with self.mutex:
+            if not now:
+                now = self.clock.time()
+            evicted = 0
+            while self.slots:
+                key, slot = next(iter(self.slots.items()))
+                if now - self.last_access[slot] < self.idle_timeout:
+                    break
+                del self.slots[key]
+                self.free_slots.append(slot)
+                evicted += 1
+            return evicted
+
+    def current_filllevel(self, key):
+        # type: (object) -> int
+        """
+        returns the current fill level of the Token Bucket for key.
+        Does not create a bucket for unknown keys.
+
+        :param key: the key of the bucket
+        :return: the current fill level of the Token Bucket
+        """
+
+        with self.mutex:
+            slot = self.slots.get(key)
+            if slot is None:
+                return self.size
+            self._refill(slot, self.clock.time())
+            return self.values[slot]
+
+    def consumeToken(self, key, token_amount=1, blocking=True, timeout=None):
+        # type: (object, int, bool, float) -> bool
+        """
+        Consumes x tokens from the Token Bucket for key.
+        Per default this method waits and blocks until at least x tokens are available for consuming.
+
+        :param key: the key of the bucket
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        :raises TokenAmountError: a TokenAmountError is raised, if the current amount of tokens in the Bucket is
+                                  smaller than token_amount and blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the bucket has not enough tokens and the time to wait for a
+                              sufficient amount of tokens would take longer than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                slot = self._slot(key, now)
+                self._refill(slot, now)
+                value = self.values[slot]
+                if token_amount <= value:
+                    self.values[slot] = value - token_amount
+                    return True
+                if not blocking:
+                    raise TokenAmountError(
+                        "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                        "current aviable tokens are " + str(value))
+                time_to_wait = core_time_to_wait(value, self.last_updates[slot], self.refill_rate, self.refill_amount,
+                                                 token_amount, now)
+                if timeout:
+                    if time_to_wait > timeout:
+                        raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                            time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def try_consume(self, key, token_amount=1):
+        # type: (object, int) -> bool
+        """
+        Consumes x tokens from the Token Bucket for key, if they are available, without blocking and without raising.
+
+        :param key: the key of the bucket
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        with self.mutex:
+            now = self.clock.time()
+            slot = self._slot(key, now)
+            self._refill(slot, now)
+            value = self.values[slot]
+            if token_amount <= value:
+                self.values[slot] = value - token_amount
+                return True
+            return False
+
+    def consume_batch(self, keys, token_amounts=1):
+        # type: (Iterable, Union[int, Iterable[int]]) -> List[bool]
+        """
+        Consumes tokens for a whole batch of requests with a single acquisition of the mutex.
+        Every request is handled independently and without blocking, like consumeToken(key, amount, blocking=False).
+
+        :param keys: the key of the bucket for every request
+        :param token_amounts: the amount of tokens for every request, or one amount for all requests
+        :return: for every request, if its tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised before any tokens are consumed, if a token_amount is
+                                 bigger than the maximum bucket size
+        """
+
+        if isinstance(token_amounts, int):
+            token_amounts = itertools.repeat(token_amounts)
+        requests = list(zip(keys, token_amounts))
+        if any(token_amount > self.size for _, token_amount in requests):
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+        results = []
+        append = results.append
+        values = self.values
+        with self.mutex:
+            now = self.clock.time()
+            for key, token_amount in requests:
+                slot = self._slot(key, now)
+                self._refill(slot, now)
+                value = values[slot]
+                if token_amount <= value:
+                    values[slot] = value - token_amount
+                    append(True)
+                else:
+                    append(False)
+        return results
+
+    def __getstate__(self):
+        # type: () -> tuple
+        """
+        returns the state of all buckets, the keys in least recently used order and the values, the ages of the last
+        updates and the idle times in arrays. Ages are stored instead of timestamps, timestamps of a monotonic clock
+        are meaningless in another process or after a restart. The clock is not part of the state.
+        """
+
+        with self.mutex:
+            now = self.clock.time()
+            keys = list(self.slots)
+            slots = list(self.slots.values())
+            values = array.array('q', [self.values[slot] for slot in slots])
+            ages = array.array('d', [now - self.last_updates[slot] for slot in slots])
+            idle = array.array('d', [now - self.last_access[slot] for slot in slots])
+        return (STATE_VERSION, self.size, self.refill_rate, self.refill_amount, self.ttl, self.max_keys, keys, values,
+                ages, idle)
+
+    def __setstate__(self, state):
+        # type: (tuple) -> None
+        check_state_version(state[0])
+        _, size, refill_rate, refill_amount, ttl, max_keys, keys, values, ages, idle = state
+        self.__init__(size, refill_rate, refill_amount, ttl, max_keys)
+        now = self.clock.time()
+        self.slots = collections.OrderedDict(zip(keys, range(len(keys))))
+        self.values = values
+        self.last_updates = array.array('d', [now - age for age in ages])
+        self.last_access = array.array('d', [now - age for age in idle])
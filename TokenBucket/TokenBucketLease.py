@@ -0,0 +1,149 @@
+import contextlib
+import threading
+
+from .TokenBucketClock import Clock, DEFAULT_CLOCK
+from .TokenBucketErrors import TokenAmountError, BucketSizeError
+
+
+class LeasedTokenBucket(object):
+    """
+    Serves consumes from tokens, that were leased in chunks from an authoritative Token Bucket, e.g. a
+    SharedTokenBucket or a BackendTokenBucket, to save a round trip to the authority for most consumes.
+
+    A lease is valid for max_staleness seconds after it was fetched, measured with the clock of the authority per
+    default.
+    Unused tokens of an expired lease are given back to the authority, if the authority has a refund() method (like
+    TokenBucket and SharedTokenBucket), otherwise they are dropped. Leased tokens are already debited from the
+    authority, so leasing never admits more tokens than the authority allows, but every lease holder may spend up to
+    lease_size tokens later than the authority granted them, within the staleness window.
+
+    Leases are held per process (shared by all threads) or, with per_thread, per thread without locking. A consume,
+    that has to wait for the authority, waits without holding the lock of the lease.
+    """
+
+    def __init__(self, authority, lease_size, max_staleness=1.0, per_thread=False, clock=None):
+        # type: (object, int, float, bool, Clock) -> None
+        """
+        :param authority: The authoritative Token Bucket to lease tokens from
+        :param lease_size: The amount of tokens to lease at once
+        :param max_staleness: The time in seconds, after which unused leased tokens expire
+        :param per_thread: Hold one lease per thread instead of one lease per process
+        :param clock: The clock to measure the expiry with, defaults to the clock of the authority
+        """
+
+        self.authority = authority
+        self.lease_size = min(lease_size, authority.size)  # type: int
+        self.max_staleness = max_staleness  # type: float
+        self.per_thread = per_thread  # type: bool
+        self.size = authority.size  # type: int
+        if clock is None:
+            clock = getattr(authority, 'clock', DEFAULT_CLOCK)
+        self.clock = clock  # type: Clock
+        # a lease per thread is only used by its own thread and needs no locking
+        self.mutex = contextlib.nullcontext() if per_thread else threading.RLock()
+        self.fetches = 0  # type: int  # amount of requests to the authority
+        self.local = threading.local()  # type: threading.local
+        self.lease = [0, 0.0]  # type: list  # leased tokens, expiry time
+
+    def _lease(self):
+        # type: () -> list
+        if not self.per_thread:
+            return self.lease
+        lease = getattr(self.local, 'lease', None)
+        if lease is None:
+            lease = self.local.lease = [0, 0.0]
+        return lease
+
+    def _give_back(self, token_amount):
+        # type: (int) -> None
+        """
+        returns unused tokens to the authority, if possible
+        """
+
+        refund = getattr(self.authority, 'refund', None)
+        if refund is not None and token_amount:
+            refund(token_amount)
+
+    def release(self):
+        # type: () -> None
+        """
+        gives the unused tokens of the current lease back to the authority
+        """
+
+        with self.mutex:
+            lease = self._lease()
+            self._give_back(lease[0])
+            lease[0] = 0
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the amount of leased tokens plus the current fill level of the authority
+
+        :return: the amount of tokens, that can be consumed without waiting
+        """
+
+        with self.mutex:
+            lease = self._lease()
+            tokens = lease[0] if lease[1] > self.clock.time() else 0
+        return tokens + self.authority.current_filllevel()
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens from the leased tokens, fetches a new lease from the authority if needed.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        :raises TokenAmountError: a TokenAmountError is raised, if the leased tokens and the authority have not
+                                  enough tokens and blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the authority has not enough tokens and the time to wait
+                              for a sufficient amount of tokens would take longer than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        with self.mutex:
+            lease = self._lease()
+            if lease[1] <= self.clock.time() and lease[0]:  # lease expired
+                self._give_back(lease[0])
+                lease[0] = 0
+
+            # nice case, served from the lease without asking the authority
+            if token_amount <= lease[0]:
+                lease[0] -= token_amount
+                return True
+
+            missing = token_amount - lease[0]
+            fetched = max(missing, self.lease_size)
+            self.fetches += 1
+            try:
+                self.authority.consumeToken(fetched, blocking=False)
+            except TokenAmountError:
+                # the authority cannot serve a whole lease, take the leased tokens and wait for the missing ones only
+                taken = lease[0]
+                lease[0] = 0
+            else:
+                lease[0] += fetched - token_amount
+                lease[1] = self.clock.time() + self.max_staleness
+                return True
+
+        # wait outside of the lock, so the other consumers are not stalled meanwhile
+        try:
+            self.authority.consumeToken(missing, blocking=blocking, timeout=timeout)
+        except BaseException:
+            with self.mutex:
+                self._lease()[0] += taken
+            raise
+        return True
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -0,0 +1,172 @@
+import bisect
+import threading
+import weakref
+from typing import Callable, Dict, Iterable, Tuple
+
+DEFAULT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)  # seconds
+
+
+class TokenBucketMetrics(object):
+    """
+    Counters for the consumes of one or more Token Buckets.
+
+    Counts granted, denied (TokenAmountError) and timed out (TimeoutError) consumes, the amounts of granted and
+    refunded tokens and a histogram of the time granted consumes waited for their tokens. The fill level gauge sums
+    up the current fill levels of the attached buckets.
+
+    Buckets record into their metrics attribute, which is None per default, so an uninstrumented bucket only pays
+    for a None check. The optional callbacks are called with (bucket, token_amount, seconds) right after a consume
+    was recorded. seconds is the time waited for granted consumes. For denied and timed out consumes it is the time
+    that would have been needed to wait, the timeout, if it expired in the FIFO queue, or None, if it is unknown.
+    Callbacks may be called with the mutex of the bucket held and should return quickly.
+    """
+
+    def __init__(self, labels=None, wait_buckets=DEFAULT_WAIT_BUCKETS, on_granted=None, on_denied=None,
+                 on_timeout=None):
+        # type: (Dict[str, str], Tuple[float, ...], Callable, Callable, Callable) -> None
+        """
+        :param labels: Prometheus labels to export the metrics with, e.g. {'bucket': 'api'}
+        :param wait_buckets: upper bounds of the wait time histogram buckets in seconds
+        :param on_granted: called for every granted consume
+        :param on_denied: called for every denied consume
+        :param on_timeout: called for every timed out consume
+        """
+
+        self.labels = dict(labels or {})  # type: Dict[str, str]
+        self.wait_buckets = tuple(sorted(wait_buckets))  # type: Tuple[float, ...]
+        self.on_granted = on_granted  # type: Callable
+        self.on_denied = on_denied  # type: Callable
+        self.on_timeout = on_timeout  # type: Callable
+        self.mutex = threading.Lock()  # type: threading.Lock
+        self.buckets = weakref.WeakSet()  # type: weakref.WeakSet
+        self.reset()
+
+    def reset(self):
+        # type: () -> None
+        """
+        sets all counters to 0
+        """
+
+        with self.mutex:
+            self.granted = 0  # type: int
+            self.denied = 0  # type: int
+            self.timed_out = 0  # type: int
+            self.tokens_granted = 0  # type: int
+            self.tokens_refunded = 0  # type: int
+            self.wait_counts = [0] * (len(self.wait_buckets) + 1)  # type: list  # last one is +Inf
+            self.wait_sum = 0.0  # type: float
+
+    def attach(self, bucket):
+        # type: (object) -> object
+        """
+        lets bucket record into these metrics and adds its fill level to the gauge
+
+        :param bucket: a bucket with a metrics attribute
+        :return: the bucket
+        """
+
+        bucket.metrics = self
+        self.buckets.add(bucket)
+        return bucket
+
+    def record_granted(self, bucket, token_amount, waited):
+        # type: (object, int, float) -> None
+        with self.mutex:
+            self.granted += 1
+            self.tokens_granted += token_amount
+            self.wait_counts[bisect.bisect_left(self.wait_buckets, waited)] += 1
+            self.wait_sum += waited
+        if self.on_granted is not None:
+            self.on_granted(bucket, token_amount, waited)
+
+    def record_denied(self, bucket, token_amount, time_to_wait):
+        # type: (object, int, float) -> None
+        with self.mutex:
+            self.denied += 1
+        if self.on_denied is not None:
+            self.on_denied(bucket, token_amount, time_to_wait)
+
+    def record_timeout(self, bucket, token_amount, time_to_wait):
+        # type: (object, int, float) -> None
+        with self.mutex:
+            self.timed_out += 1
+        if self.on_timeout is not None:
+            self.on_timeout(bucket, token_amount, time_to_wait)
+
+    def record_refunded(self, bucket, token_amount):
+        # type: (object, int) -> None
+        with self.mutex:
+            self.tokens_refunded += token_amount
+
+    def fill_level(self):
+        # type: () -> int
+        """
+        :return: the sum of the current fill levels of the attached buckets
+        """
+
+        return sum(bucket.current_filllevel() for bucket in list(self.buckets))
+
+
+def _format_labels(labels):
+    # type: (Dict[str, str]) -> str
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                       .replace('\n', '\\n'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def prometheus_text(metrics, namespace='tokenbucket'):
+    # type: (Iterable[TokenBucketMetrics], str) -> str
+    """
+    renders metrics in the Prometheus text exposition format, e.g. to be served by any web framework on /metrics.
+
+    :param metrics: the metrics to render, distinguished by their labels
+    :param namespace: prefix of the metric names
+    :return: the exposition text
+    """
+
+    metrics = list(metrics)
+    lines = []
+
+    lines.append('# HELP %s_consumes_total Consumes by result.' % namespace)
+    lines.append('# TYPE %s_consumes_total counter' % namespace)
+    for metric in metrics:
+        for result, value in (('granted', metric.granted), ('denied', metric.denied),
+                              ('timeout', metric.timed_out)):
+            lines.append('%s_consumes_total%s %s' % (namespace, _format_labels(dict(metric.labels, result=result)),
+                                                     value))
+
+    lines.append('# HELP %s_tokens_consumed_total Tokens consumed by granted consumes.' % namespace)
+    lines.append('# TYPE %s_tokens_consumed_total counter' % namespace)
+    for metric in metrics:
+        lines.append('%s_tokens_consumed_total%s %s' % (namespace, _format_labels(metric.labels),
+                                                        metric.tokens_granted))
+
+    lines.append('# HELP %s_tokens_refunded_total Tokens given back unused.' % namespace)
+    lines.append('# TYPE %s_tokens_refunded_total counter' % namespace)
+    for metric in metrics:
+        lines.append('%s_tokens_refunded_total%s %s' % (namespace, _format_labels(metric.labels),
+                                                        metric.tokens_refunded))
+
+    lines.append('# HELP %s_wait_seconds Time granted consumes waited for tokens.' % namespace)
+    lines.append('# TYPE %s_wait_seconds histogram' % namespace)
+    for metric in metrics:
+        with metric.mutex:
+            wait_counts = list(metric.wait_counts)
+            wait_sum = metric.wait_sum
+        cumulative = 0
+        for bound, count in zip(metric.wait_buckets + (float('inf'),), wait_counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(float(bound))
+            lines.append('%s_wait_seconds_bucket%s %s' % (namespace, _format_labels(dict(metric.labels, le=le)),
+                                                          cumulative))
+        lines.append('%s_wait_seconds_sum%s %s' % (namespace, _format_labels(metric.labels), repr(wait_sum)))
+        lines.append('%s_wait_seconds_count%s %s' % (namespace, _format_labels(metric.labels), cumulative))
+
+    lines.append('# HELP %s_fill_level Current amount of tokens in the buckets.' % namespace)
+    lines.append('# TYPE %s_fill_level gauge' % namespace)
+    for metric in metrics:
+        lines.append('%s_fill_level%s %s' % (namespace, _format_labels(metric.labels), metric.fill_level()))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+import threading
+from typing import Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from .TokenBucketClock import Clock, WallClock
+from .TokenBucketCore import refill_state, time_to_wait as core_time_to_wait
+from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+
+# magic, layout version, size, refill_rate, refill_amount, value, last_update
+_STATE = struct.Struct('<4sIqdqqd')
+_VALUES = struct.Struct('<qd')  # value, last_update
+_VALUES_OFFSET = _STATE.size - _VALUES.size
+_MAGIC = b'TBkt'
+_VERSION = 1
+
+
+class SharedMutex(object):
+    """
+    Reentrant lock, that is shared between threads and processes.
+    Threads of one process are synchronized by a RLock, processes by an exclusive flock() on the state file.
+    """
+
+    def __init__(self, bucket):
+        # type: (SharedTokenBucket) -> None
+        self.bucket = bucket  # type: SharedTokenBucket
+        self.thread_lock = threading.RLock()  # type: threading.RLock
+        self.depth = 0  # type: int
+
+    def acquire(self, blocking=True):
+        # type: (bool) -> bool
+        if not self.thread_lock.acquire(blocking):
+            return False
+        if self.depth == 0:
+            try:
+                self.bucket._check_fork()
+                fcntl.flock(self.bucket.fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BaseException:
+                self.thread_lock.release()
+                if not blocking:
+                    return False
+                raise
+        self.depth += 1
+        return True
+
+    def release(self):
+        # type: () -> None
+        self.depth -= 1
+        if self.depth == 0:
+            fcntl.flock(self.bucket.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class SharedTokenBucket(object):
+    """
+    Token Bucket, whose state is shared between processes, e.g. the worker processes of a gunicorn server.
+
+    The state lives in a memory mapped file (preferably on a tmpfs like /dev/shm), every process opens the same
+    path. Changes of the state are guarded by a SharedMutex. The refill semantics are the same as for TokenBucket.
+    An instance inherited by fork() reopens the file, so every process holds its own file lock.
+    The state outlives the processes, so its timestamps are taken from the wall clock (time.time()).
+    """
+
+    def __init__(self, path, size=None, refillrate=None, refillamount=None, value=None, lastupdate=None):
+        # type: (str, int, float, int, int, float) -> None
+        """
+        Opens the shared Token Bucket at path. If path does not hold a bucket yet, it gets initialized with the given
+        configuration, otherwise the configuration stored in the file is used.
+
+        :param path: The path of the file, that holds the state of the Token Bucket
+        :param size: The size of the Token Bucket
+        :param refillrate: The time interval for refilling the Token Bucket
+        :param refillamount: The amount of tokens to refill per refill operation
+        :param value: Initialize the Token Bucket with a given value
+        :param lastupdate: Initialize the Token Bucket with a given timestamp
+        """
+
+        if fcntl is None:
+            raise NotImplementedError("SharedTokenBucket requires fcntl.flock(), which is not available")
+        self.path = path  # type: str
+        self.fd = -1  # type: int
+        self.map = None  # type: mmap.mmap
+        self.pid = -1  # type: int
+        self.clock = WallClock()  # type: Clock
+        self.mutex = SharedMutex(self)  # type: SharedMutex
+        self._open()
+
+        with self.mutex:
+            if os.fstat(self.fd).st_size >= _STATE.size:
+                if self.map is None:
+                    # another process initialized the file between opening and locking it
+                    self.map = mmap.mmap(self.fd, _STATE.size)
+                magic, version = _STATE.unpack_from(self.map)[:2]
+                if magic != _MAGIC or version != _VERSION:
+                    raise ValueError("file " + path + " does not hold a shared Token Bucket")
+                return
+            if size is None or refillrate is None or refillamount is None:
+                raise ValueError("file " + path + " does not hold a shared Token Bucket yet, "
+                                 "size, refillrate and refillamount are required")
+            os.ftruncate(self.fd, _STATE.size)
+            self.map = mmap.mmap(self.fd, _STATE.size)
+            _STATE.pack_into(self.map, 0, _MAGIC, _VERSION, size, refillrate, refillamount,
+                             value if value is not None else size,
+                             lastupdate if lastupdate is not None else self.clock.time())
+
+    def _open(self):
+        # type: () -> None
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.pid = os.getpid()
+        self.map = None
+        if os.fstat(self.fd).st_size >= _STATE.size:
+            self.map = mmap.mmap(self.fd, _STATE.size)
+
+    def _check_fork(self):
+        # type: () -> None
+        """
+        file locks are shared by all processes, that inherited the file descriptor, reopen the file after a fork()
+        """
+
+        if self.pid != os.getpid():
+            os.close(self.fd)
+            self._open()
+
+    def close(self):
+        # type: () -> None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __reduce__(self):
+        return self.__class__, (self.path,)
+
+    @property
+    def size(self):
+        # type: () -> int
+        return _STATE.unpack_from(self.map)[2]
+
+    @property
+    def refill_rate(self):
+        # type: () -> float
+        return _STATE.unpack_from(self.map)[3]
+
+    @property
+    def refill_amount(self):
+        # type: () -> int
+        return _STATE.unpack_from(self.map)[4]
+
+    @property
+    def value(self):
+        # type: () -> int
+        return _VALUES.unpack_from(self.map, _VALUES_OFFSET)[0]
+
+    @value.setter
+    def value(self, value):
+        # type: (int) -> None
+        struct.pack_into('<q', self.map, _VALUES_OFFSET, value)
+
+    @property
+    def last_update(self):
+        # type: () -> float
+        return _VALUES.unpack_from(self.map, _VALUES_OFFSET)[1]
+
+    @last_update.setter
+    def last_update(self, last_update):
+        # type: (float) -> None
+        struct.pack_into('<d', self.map, _VALUES_OFFSET + 8, last_update)
+
+    def _refill(self, now, force=False):
+        # type: (float, bool) -> Tuple[int, float]
+        """
+        refill operation, must be called with the mutex held.
+
+        :return: the refilled value and the time of the last refill
+        """
+
+        _, _, size, refill_rate, refill_amount, value, last_update = _STATE.unpack_from(self.map)
+        value, last_update = refill_state(value, last_update, size, refill_rate, refill_amount, now, force)
+        _VALUES.pack_into(self.map, _VALUES_OFFSET, value, last_update)
+        return value, last_update
+
+    def current_filllevel(self):
+        # type: () -> int
+        """
+        returns the current fill level of the Token Bucket.
+        refills bucket automatically, so the returned value is more up to date.
+
+        :return: the current fill level of the Token Bucket
+        """
+
+        with self.mutex:
+            return self._refill(self.clock.time())[0]
+
+    def refill(self, now=None, force=False):
+        # type: (float, bool) -> None
+        """
+        Performs a refill operation on the Token Bucket.
+        The refill operation will only succeed, if the last update is long enough ago.
+
+        :param now: Specifies the current time to use
+        :param force: perform a refill operation, even if no refill operation can be done at the moment.
+        """
+
+        with self.mutex:
+            if not now:
+                now = self.clock.time()
+            self._refill(now, force)
+
+    def refund(self, token_amount):
+        # type: (int) -> None
+        """
+        Gives x unused tokens back to the Token Bucket, e.g. tokens, that were taken ahead of use, but not used.
+        The fill level is capped at the size.
+
+        :param token_amount: amount of tokens to give back
+        """
+
+        with self.mutex:
+            value, last_update = self._refill(self.clock.time())
+            value += token_amount
+            size = self.size
+            _VALUES.pack_into(self.map, _VALUES_OFFSET, value if value < size else size, last_update)
+
+    def consumeToken(self, token_amount, blocking=True, timeout=None):
+        # type: (int, bool, float) -> bool
+        """
+        Consumes x tokens from the Token Bucket.
+        Per default this method waits and blocks until at least x tokens are available for consuming.
+
+        :param token_amount: amount of tokens to consume
+        :param blocking: specifies, if this method should block, until enough tokens are available
+        :param timeout: specifies the maximum time to wait, if blocking is enabled
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        :raises TokenAmountError: a TokenAmountError is raised, if the current amount of tokens in the Bucket is
+                                  smaller than token_amount and blocking is set to False
+        :raises TimeoutError: a TimeoutError is raised, if the bucket has not enough tokens and the time to wait for a
+                              sufficient amount of tokens would take longer than the given timeout
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                value, last_update = self._refill(now)
+                if token_amount <= value:
+                    _VALUES.pack_into(self.map, _VALUES_OFFSET, value - token_amount, last_update)
+                    return True
+                if not blocking:
+                    raise TokenAmountError(
+                        "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                        "current aviable tokens are " + str(value))
+                time_to_wait = core_time_to_wait(value, last_update, self.refill_rate, self.refill_amount,
+                                                 token_amount, now)
+                if timeout:
+                    if time_to_wait > timeout:
+                        raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                            time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                            timeout) + " seconds, returning")
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def __enter__(self):
+        self.consumeToken(1)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
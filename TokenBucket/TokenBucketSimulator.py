@@ -0,0 +1,143 @@
+"""
+Discrete-event simulation of Token Buckets in virtual time.
+
+A trace of requests (timestamp, key, token_amount) is replayed through one or many buckets, without sleeping. The
+buckets should be created with a VirtualClock, so their timeline starts together with the trace, the clock is moved
+to the timestamp of every request.
+"""
+import array
+import csv
+import random
+from typing import Iterable, Iterator, Tuple
+
+from .TokenBucketBatch import _time_to_wait
+from .TokenBucketClock import VirtualClock
+
+
+class SimulationResult(object):
+    """
+    Outcome of a simulation, the requests are counted as admitted without waiting, admitted after a delay or
+    rejected.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.admitted = 0  # type: int
+        self.delayed = 0  # type: int
+        self.rejected = 0  # type: int
+        self.delays = array.array('d')  # type: array.array  # delay of every delayed request in seconds
+
+    @property
+    def total(self):
+        # type: () -> int
+        return self.admitted + self.delayed + self.rejected
+
+    def percentile(self, fraction):
+        # type: (float) -> float
+        """
+        :param fraction: the percentile as fraction, e.g. 0.99
+        :return: the delay, that fraction of the delayed requests did not exceed, 0 if no request was delayed
+        """
+
+        if not self.delays:
+            return 0.0
+        delays = sorted(self.delays)
+        return delays[min(len(delays) - 1, int(fraction * len(delays)))]
+
+    def summary(self):
+        # type: () -> dict
+        """
+        :return: the counts and the delay distribution of the delayed requests
+        """
+
+        return {
+            'total': self.total,
+            'admitted': self.admitted,
+            'delayed': self.delayed,
+            'rejected': self.rejected,
+            'delay_mean': sum(self.delays) / len(self.delays) if self.delays else 0.0,
+            'delay_p50': self.percentile(0.50),
+            'delay_p90': self.percentile(0.90),
+            'delay_p99': self.percentile(0.99),
+            'delay_max': max(self.delays) if self.delays else 0.0,
+        }
+
+
+def poisson_trace(rate, duration, keys=(None,), token_amount=1, seed=None):
+    # type: (float, float, Tuple, int, int) -> Iterator[Tuple[float, object, int]]
+    """
+    generates a synthetic trace with exponentially distributed inter-arrival times, the keys are chosen uniformly.
+
+    :param rate: the mean amount of requests per second
+    :param duration: the length of the trace in seconds
+    :param keys: the keys to send requests to
+    :param token_amount: the amount of tokens of every request
+    :param seed: seed for the random generator, for reproducible traces
+    :return: the requests as (timestamp, key, token_amount), ordered by timestamp
+    """
+
+    generator = random.Random(seed)
+    now = generator.expovariate(rate)
+    while now < duration:
+        yield now, keys[0] if len(keys) == 1 else generator.choice(keys), token_amount
+        now += generator.expovariate(rate)
+
+
+def load_trace(path):
+    # type: (str) -> Iterator[Tuple[float, str, int]]
+    """
+    reads a recorded trace from a CSV file with the columns timestamp, key and optionally token_amount.
+
+    :param path: path of the CSV file
+    :return: the requests as (timestamp, key, token_amount)
+    """
+
+    with open(path, newline='') as trace:
+        for row in csv.reader(trace):
+            if not row or row[0].startswith('#'):
+                continue
+            yield float(row[0]), row[1], int(row[2]) if len(row) > 2 else 1
+
+
+def simulate(trace, buckets, max_delay=0.0):
+    # type: (Iterable[Tuple[float, object, int]], object, float) -> SimulationResult
+    """
+    Replays trace through the buckets in virtual time.
+
+    A request is admitted, if its bucket holds enough tokens at its timestamp. Otherwise it is delayed, if the
+    tokens are available within max_delay seconds, like a blocking consumeToken() with that timeout, or rejected.
+    Delayed requests reserve their tokens, later requests queue up behind them, as with fifo=True.
+
+    The buckets must not be used by other threads during the simulation.
+
+    :param trace: the requests as (timestamp, key, token_amount), ordered by timestamp
+    :param buckets: a single bucket for all requests, or a mapping of key -> bucket
+    :param max_delay: the maximum time a request may wait for tokens
+    :return: the counts and delays of the requests
+    """
+
+    result = SimulationResult()
+    delays = result.delays
+    single = buckets if hasattr(buckets, 'consumeToken') else None
+    for now, key, token_amount in trace:
+        bucket = single if single is not None else buckets[key]
+        clock = bucket.clock
+        if isinstance(clock, VirtualClock):
+            clock.set(now)
+        if token_amount > bucket.size:
+            result.rejected += 1
+            continue
+        bucket.refill(now)
+        if token_amount <= bucket.value:
+            bucket.value -= token_amount
+            result.admitted += 1
+            continue
+        time_to_wait = _time_to_wait(bucket, token_amount, now)
+        if time_to_wait <= max_delay:
+            # take the tokens in advance, the value drops below 0 until the refills catch up
+            bucket.value -= token_amount
+            result.delayed += 1
+            delays.append(time_to_wait)
+        else:
+            result.rejected += 1
+    return result
@@ -0,0 +1,184 @@
+"""
+Compact binary snapshots of many Token Buckets, to checkpoint them and to warm start them after a restart,
+instead of starting all buckets full.
+
+A snapshot is a header followed by one fixed size record per bucket, little endian and 8 byte aligned, so a
+snapshot file can be memory mapped and its records can be read one by one with a SnapshotView, without loading the
+whole file. The records hold the state of TokenBucket.__getstate__(), the age of the last update is stored instead
+of its timestamp. The header holds the wall clock time of the snapshot, so the time between the snapshot and the
+restore can be counted as refill time.
+"""
+import mmap
+import struct
+import time
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, Iterator, List
+
+from .TokenBucketCore import STATE_VERSION, check_state_version
+
+if TYPE_CHECKING:
+    # for the type comments only, importing the module does not load the buckets
+    from . import TokenBucket
+
+MAGIC = b'TBKT'
+# magic, version, record size, amount of records, wall clock time of the snapshot
+HEADER = struct.Struct('<4sHHQd8x')
+# size, value, refill_rate, refill_amount, age, flags
+RECORD = struct.Struct('<qqdqdB7x')
+
+FLAG_FIFO = 1
+FLAG_CONTINUOUS = 2
+
+
+def _factory(factory):
+    # type: (Callable[..., TokenBucket]) -> Callable[..., TokenBucket]
+    """
+    :return: factory, or the TokenBucket of the active backend, resolved on first use instead of on import
+    """
+
+    if factory is None:
+        from . import TokenBucket as bucket_class
+        return bucket_class
+    return factory
+
+
+def dumps(buckets):
+    # type: (Iterable[TokenBucket]) -> bytes
+    """
+    :param buckets: the buckets to store, every bucket must implement __getstate__() like TokenBucket
+    :return: the snapshot of the buckets
+    """
+
+    states = [bucket.__getstate__() for bucket in buckets]
+    buffer = bytearray(HEADER.size + RECORD.size * len(states))
+    HEADER.pack_into(buffer, 0, MAGIC, STATE_VERSION, RECORD.size, len(states), time.time())
+    offset = HEADER.size
+    pack_into = RECORD.pack_into
+    for _, size, value, refill_rate, refill_amount, age, fifo, continuous in states:
+        pack_into(buffer, offset, size, value, refill_rate, refill_amount, age,
+                  (FLAG_FIFO if fifo else 0) | (FLAG_CONTINUOUS if continuous else 0))
+        offset += RECORD.size
+    return bytes(buffer)
+
+
+def dump(buckets, file):
+    # type: (Iterable[TokenBucket], BinaryIO) -> None
+    """
+    writes the snapshot of the buckets to a binary file
+    """
+
+    file.write(dumps(buckets))
+
+
+class SnapshotView(object):
+    """
+    Read access to the records of a snapshot in a buffer, e.g. bytes or a memory mapped file.
+    Records are decoded on access.
+    """
+
+    def __init__(self, buffer):
+        # type: (bytes) -> None
+        """
+        :param buffer: the snapshot, any object supporting the buffer protocol
+        :raises ValueError: a ValueError is raised, if the buffer is not a snapshot of a known version
+        """
+
+        self.buffer = buffer
+        if len(buffer) < HEADER.size:
+            raise ValueError("not a Token Bucket snapshot, too short")
+        magic, version, record_size, count, timestamp = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("not a Token Bucket snapshot")
+        check_state_version(version)
+        if record_size != RECORD.size or len(buffer) < HEADER.size + record_size * count:
+            raise ValueError("truncated or corrupt Token Bucket snapshot")
+        self.version = version  # type: int
+        self.count = count  # type: int
+        self.timestamp = timestamp  # type: float
+
+    def __len__(self):
+        # type: () -> int
+        return self.count
+
+    def state(self, index, downtime=True):
+        # type: (int, bool) -> tuple
+        """
+        :param index: the index of the bucket in the snapshot
+        :param downtime: add the time since the snapshot to the age of the last update
+        :return: the state of the bucket, as accepted by TokenBucket.__setstate__()
+        """
+
+        if not 0 <= index < self.count:
+            raise IndexError("snapshot index out of range")
+        size, value, refill_rate, refill_amount, age, flags = RECORD.unpack_from(
+            self.buffer, HEADER.size + index * RECORD.size)
+        if downtime:
+            age += max(0.0, time.time() - self.timestamp)
+        return (self.version, size, value, refill_rate, refill_amount, age, bool(flags & FLAG_FIFO),
+                bool(flags & FLAG_CONTINUOUS))
+
+    def restore(self, index, factory=None, downtime=True):
+        # type: (int, Callable[..., TokenBucket], bool) -> TokenBucket
+        """
+        :param index: the index of the bucket in the snapshot
+        :param factory: the bucket class to restore the bucket as, defaults to the TokenBucket of the active backend
+        :param downtime: count the time since the snapshot as refill time
+        :return: the restored bucket
+        """
+
+        factory = _factory(factory)
+        state = self.state(index, downtime)
+        bucket = factory(state[1], state[3], state[4])
+        bucket.__setstate__(state)
+        return bucket
+
+    def buckets(self, factory=None, downtime=True):
+        # type: (Callable[..., TokenBucket], bool) -> Iterator[TokenBucket]
+        """
+        restores all buckets of the snapshot, one by one
+        """
+
+        factory = _factory(factory)
+        elapsed = max(0.0, time.time() - self.timestamp) if downtime else 0.0
+        version = self.version
+        with memoryview(self.buffer) as view:
+            records = view[HEADER.size:HEADER.size + RECORD.size * self.count]
+            for size, value, refill_rate, refill_amount, age, flags in RECORD.iter_unpack(records):
+                bucket = factory(size, refill_rate, refill_amount)
+                bucket.__setstate__((version, size, value, refill_rate, refill_amount, age + elapsed,
+                                     bool(flags & FLAG_FIFO), bool(flags & FLAG_CONTINUOUS)))
+                yield bucket
+            records.release()
+
+
+def loads(data, factory=None, downtime=True):
+    # type: (bytes, Callable[..., TokenBucket], bool) -> List[TokenBucket]
+    """
+    :param data: a snapshot returned by dumps()
+    :param factory: the bucket class to restore the buckets as, defaults to the TokenBucket of the active backend
+    :param downtime: count the time since the snapshot as refill time
+    :return: the restored buckets, in the order they were stored
+    """
+
+    return list(SnapshotView(data).buckets(factory, downtime))
+
+
+def load(file, factory=None, downtime=True):
+    # type: (BinaryIO, Callable[..., TokenBucket], bool) -> List[TokenBucket]
+    """
+    restores the buckets of a snapshot from a binary file
+    """
+
+    return loads(file.read(), factory, downtime)
+
+
+def open_snapshot(path):
+    # type: (str) -> SnapshotView
+    """
+    memory maps a snapshot file read only, the records are read from the file on access
+
+    :param path: the path of the snapshot file
+    :return: a view on the snapshot
+    """
+
+    with open(path, 'rb') as file:
+        return SnapshotView(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
@@ -0,0 +1,35 @@
+"""
+monotonic clock for the Cython buckets, cimported by every Cython module
+"""
+
+cdef extern from *:
+    """
+    #if defined(__APPLE__)
+    #include <mach/mach_time.h>
+    #define TB_HAVE_MONOTONIC 1
+    static double tb_monotonic_time(void) {
+        static mach_timebase_info_data_t timebase;
+        if (timebase.denom == 0) {
+            mach_timebase_info(&timebase);
+        }
+        return (double) mach_absolute_time() * timebase.numer / timebase.denom * 1e-9;
+    }
+    #elif defined(_WIN32)
+    /* the source of time.monotonic() differs between Python versions, call it instead */
+    #define TB_HAVE_MONOTONIC 0
+    static double tb_monotonic_time(void) {
+        return -1;
+    }
+    #else
+    #include <time.h>
+    #define TB_HAVE_MONOTONIC 1
+    static double tb_monotonic_time(void) {
+        struct timespec ts;
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+        return (double) ts.tv_sec + (double) ts.tv_nsec * 1e-9;
+    }
+    #endif
+    """
+    # same time scale as time.monotonic(), but without a Python call
+    double tb_monotonic_time() nogil
+    bint TB_HAVE_MONOTONIC
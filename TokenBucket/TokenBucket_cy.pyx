@@ -1,15 +1,154 @@
-import threading
-import time
-
+cimport cython
+from cpython cimport pythread
 from libc cimport math
 
+from .TokenBucketTime cimport tb_monotonic_time, TB_HAVE_MONOTONIC
+
+import collections
+import threading
+
+from .TokenBucketClock import DEFAULT_CLOCK, check_timestamp
+from .TokenBucketCore import STATE_VERSION, check_state_version
 from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
 
+
+cdef class FastRLock(object):
+    """
+    Reentrant lock, that is taken without touching the underlying PyThread lock while it is uncontended.
+
+    An uncontended acquire only records the owning thread, which is atomic because the GIL is held. Only when a
+    second thread has to wait, the real lock gets acquired on behalf of the owner and the waiter blocks on it with
+    the GIL released. Provides the private RLock protocol, so it can be used with threading.Condition.
+    """
+
+    cdef pythread.PyThread_type_lock _real_lock
+    cdef long _owner
+    cdef int _count
+    cdef int _pending_requests
+    cdef bint _is_locked
+
+    def __cinit__(self):
+        self._owner = 0
+        self._count = 0
+        self._pending_requests = 0
+        self._is_locked = False
+        self._real_lock = pythread.PyThread_allocate_lock()
+        if self._real_lock is NULL:
+            raise MemoryError()
+
+    def __dealloc__(self):
+        if self._real_lock is not NULL:
+            pythread.PyThread_free_lock(self._real_lock)
+            self._real_lock = NULL
+
+    def acquire(self, bint blocking=True):
+        return lock_lock(self, pythread.PyThread_get_thread_ident(), blocking)
+
+    def release(self):
+        if self._count == 0 or self._owner != pythread.PyThread_get_thread_ident():
+            raise RuntimeError("cannot release un-acquired lock")
+        unlock_lock(self)
+
+    def __enter__(self):
+        # self.acquire()
+        return lock_lock(self, pythread.PyThread_get_thread_ident(), True)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # self.release()
+        if self._count == 0 or self._owner != pythread.PyThread_get_thread_ident():
+            raise RuntimeError("cannot release un-acquired lock")
+        unlock_lock(self)
+        return False
+
+    def _is_owned(self):
+        return self._count > 0 and self._owner == pythread.PyThread_get_thread_ident()
+
+    def _release_save(self):
+        # fully release a recursively held lock, used by threading.Condition.wait()
+        if self._count == 0 or self._owner != pythread.PyThread_get_thread_ident():
+            raise RuntimeError("cannot release un-acquired lock")
+        state = (self._count, self._owner)
+        self._count = 1
+        unlock_lock(self)
+        return state
+
+    def _acquire_restore(self, state):
+        lock_lock(self, pythread.PyThread_get_thread_ident(), True)
+        self._count, self._owner = state
+
+
+cdef inline bint lock_lock(FastRLock lock, long current_thread, bint blocking) noexcept:
+    # the GIL is held and no Python code is executed, so nobody can interfere while the lock state is updated
+    if lock._count:
+        if current_thread == lock._owner:
+            lock._count += 1
+            return 1
+    elif not lock._pending_requests:
+        # not locked and nobody waiting, no need to touch the real lock
+        lock._owner = current_thread
+        lock._count = 1
+        return 1
+    return _acquire_lock(lock, current_thread, pythread.WAIT_LOCK if blocking else pythread.NOWAIT_LOCK)
+
+
+cdef bint _acquire_lock(FastRLock lock, long current_thread, int wait) noexcept:
+    cdef bint locked
+    if not lock._is_locked and not lock._pending_requests:
+        # the owner took the lock without the real lock, acquire the real lock on its behalf, the owner releases it
+        if not pythread.PyThread_acquire_lock(lock._real_lock, wait):
+            return 0
+        lock._is_locked = True
+    lock._pending_requests += 1
+    with nogil:
+        # wait for the owning thread to release the real lock
+        locked = pythread.PyThread_acquire_lock(lock._real_lock, wait)
+    lock._pending_requests -= 1
+    if not locked:
+        return 0
+    lock._is_locked = True
+    lock._owner = current_thread
+    lock._count = 1
+    return 1
+
+
+cdef inline void unlock_lock(FastRLock lock) noexcept:
+    lock._count -= 1
+    if lock._count == 0 and lock._is_locked:
+        pythread.PyThread_release_lock(lock._real_lock)
+        lock._is_locked = False
+
+
+@cython.cdivision(True)
+cdef inline long refill_steps(double last_update, double interval, double now) noexcept nogil:
+    """
+    the amount of whole intervals between last_update and now
+    """
+    cdef long steps = <long> ((now - last_update) / interval)
+
+    if last_update + (steps + 1) * interval <= now:
+        # the division rounded down, but the time to wait for the next refill has passed
+        steps += 1
+    return steps
+
 cdef class TokenBucket(object):
     """
     Simple implementation of a synchronized Token Bucket.
     Created mainly for learning purposes.
 
+    In the default greedy mode every blocked consumer races for the tokens after its own sleep, so small requests
+    can overtake large ones. In FIFO mode blocked consumers are queued and served in order, only the consumer at
+    the head of the queue waits for the next refill and hands over to its successor when it leaves.
+
+    In continuous mode the bucket is refilled token by token, one token every refillrate / refillamount seconds,
+    instead of refillamount tokens every refillrate seconds. This avoids bursts of admissions at the refill
+    boundaries. The fractional progress towards the next token is kept in last_update, so the exact time to wait
+    for any amount of tokens is known in advance.
+
+    Time is taken from a monotonic clock per default, all timestamps (lastupdate, now) are in the time scale of
+    the clock of the bucket.
+
+    Consumes are recorded into the metrics attribute, if it is set to a TokenBucketMetrics.
+
     Cython implementation
     """
 
@@ -17,31 +156,59 @@ cdef class TokenBucket(object):
     cdef public long value
     cdef public double refill_rate
     cdef public long refill_amount
-    cdef public object mutex
+    cdef readonly FastRLock mutex
     cdef public double last_update
+    cdef public bint fifo
+    cdef public bint continuous
+    cdef public object waiters
+    cdef readonly object clock
+    cdef bint _c_clock  # the clock is the default clock, read it without a Python call
+    cdef public object metrics
+    cdef object __weakref__
 
-    def __init__(self, long size, double refillrate, long refillamount, long value=-1, long lastupdate=-1):
-        # type: (int, float, int, int, int) -> None
+    def __init__(self, long size, double refillrate, long refillamount, long value=-1, double lastupdate=-1,
+                 bint fifo=False, bint continuous=False, clock=None, metrics=None):
+        # type: (int, float, int, int, float, bool, bool, object, object) -> None
         """
         :param size: The size of the Token Bucket
         :param refillrate: The time interval for refilling the Token Bucket
         :param refillamount: The amount of tokens to refill per refill operation
         :param value: Initialize the Token Bucket with a given value
-        :param lastupdate: Initialize the Token Bucket with a given time
+        :param lastupdate: Initialize the Token Bucket with a given timestamp of its clock
+        :param fifo: Serve blocked consumers in FIFO order instead of greedy
+        :param continuous: Refill token by token instead of refillamount tokens at once
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        :param metrics: Record the consumes into the given metrics
         """
 
         self.size = size
         self.value = size
         self.refill_rate = refillrate
         self.refill_amount = refillamount
-        self.mutex = threading.RLock()
-        self.last_update = time.time()
+        self.mutex = FastRLock()
+        self.clock = clock if clock is not None else DEFAULT_CLOCK
+        self._c_clock = TB_HAVE_MONOTONIC and self.clock is DEFAULT_CLOCK
+        self.last_update = self._now()
         if value != -1:
             self.value = value
         if lastupdate != -1:
+            check_timestamp(self.clock, lastupdate)
             self.last_update = lastupdate
+        self.fifo = fifo
+        self.continuous = continuous
+        # created by the first queued FIFO consumer, most buckets never queue and stay small, e.g. one per key
+        self.waiters = None
+        self.metrics = None
+        if metrics is not None:
+            metrics.attach(self)
 
-    cdef long _refill_count(self, double now=-1):
+    cdef inline double _now(self) except? -1:
+        if self._c_clock:
+            return tb_monotonic_time()
+        return self.clock.time()
+
+    @cython.cdivision(True)
+    cdef inline long _refill_count(self, double now) noexcept nogil:
         # type: (float) -> int
         """
         calculate the amount of refill operations that can be executed,
@@ -58,6 +225,8 @@ cdef class TokenBucket(object):
         = 0.8
         = int 0
 
+        Must be called with the mutex held.
+
         :param now: Specifies the current time to use
         :return: The amount of refill operations
         """
@@ -66,10 +235,41 @@ cdef class TokenBucket(object):
         # now is second 15
         # refilltime is 10
         #            (    15     -       7         ) /       10           = 8 / 10 = 0.8 = int 0
-        with self.mutex:
-            if now == -1:
-                now = time.time()
-            return <long> ((now - self.last_update) / self.refill_rate)
+        return refill_steps(self.last_update, self.refill_rate, now)
+
+    @cython.cdivision(True)
+    cdef inline void _refill(self, double now, bint force) noexcept nogil:
+        """
+        refill operation without locking, must be called with the mutex held.
+        Does not execute any Python code, so it cannot be interrupted by another thread while the GIL is held.
+        """
+        cdef long refill_count
+        cdef double token_interval
+
+        if self.continuous and not force:
+            # refill token by token
+            token_interval = self.refill_rate / self.refill_amount
+            refill_count = refill_steps(self.last_update, token_interval, now)
+            if refill_count > 0:
+                self.value += refill_count
+                self.last_update += refill_count * token_interval
+            if self.value > self.size:
+                self.value = self.size
+            return
+
+        refill_count = self._refill_count(now)  # calculate how many refill operations we can perform
+        if refill_count > 0:
+            self.value += refill_count * self.refill_amount  # how many items can be refilled
+
+            # amount of refill operations * refilltime -> last update
+            # this is a logical calculation, based that time.time() is accurate
+            self.last_update += refill_count * self.refill_rate
+        elif force:
+            self.value += self.refill_amount
+            self.last_update += 1 * self.refill_rate
+
+        if self.value > self.size:
+            self.value = self.size
 
     cpdef long current_filllevel(self):
         # type: () -> int
@@ -79,10 +279,15 @@ cdef class TokenBucket(object):
 
         :return: the current fill level of the Token Bucket
         """
+        cdef long value
+        cdef double now = self._now()
 
-        with self.mutex:
-            self.refill()  # refilling inside mutex, because another thread could jump between refill() and return value
-            return self.value
+        # refilling inside mutex, because another thread could jump between refill() and return value
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        self._refill(now, False)
+        value = self.value
+        unlock_lock(self.mutex)
+        return value
 
     cpdef int refill(self, double now=-1, bint force=False) except -1:
         # type: (float, bool) -> None
@@ -93,27 +298,57 @@ cdef class TokenBucket(object):
         :param now: Specifies the current time to use
         :param force: perform a refill operation, even if no refill operation can be done at the moment.
         """
-        cdef long refill_count
 
-        with self.mutex:
-            if now == -1:
-                now = time.time()
-            refill_count = self._refill_count(now)  # calculate how many refill operations we can perform
-            if refill_count > 0:
-                self.value += refill_count * self.refill_amount  # how many items can be refilled
+        if now == -1:
+            now = self._now()
+        else:
+            check_timestamp(self.clock, now)
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        self._refill(now, force)
+        unlock_lock(self.mutex)
+        return 0
+
+    cdef double _fifo_time_to_wait(self, long token_amount, double now) except? -1:
+        # type: (int, float) -> float
+        """
+        calculates the time until token_amount tokens are available for a consumer, that queues up behind all
+        currently waiting consumers.
 
-                # amount of refill operations * refilltime -> last update
-                # this is a logical calculation, based that time.time() is accurate
-                self.last_update += refill_count * self.refill_rate
-            elif force:
-                self.value += self.refill_amount
-                self.last_update += 1 * self.refill_rate
+        :param token_amount: amount of tokens to consume
+        :param now: Specifies the current time to use
+        :return: the time to wait in seconds
+        """
+        if self.waiters is not None:
+            for waiter in self.waiters:
+                token_amount += <long> waiter[0]
+        return self._time_to_wait(token_amount, now)
 
-            if self.value > self.size:
-                self.value = self.size
-        return 0
+    @cython.cdivision(True)
+    cdef double _time_to_wait(self, long token_amount, double now) noexcept nogil:
+        """
+        calculates the exact time until token_amount tokens are available, must be called with the mutex held
+        and after a refill.
 
-    cpdef bint consumeToken(self, long token_amount, bint blocking=True, double timeout=-1) except *:
+        :param token_amount: amount of tokens to wait for
+        :param now: Specifies the current time to use
+        :return: the time to wait in seconds
+        """
+        cdef long additional_tokes = token_amount - self.value  # the ammount of tokens we are short
+        cdef double refill_rate = self.refill_rate
+        cdef long refill_amount = self.refill_amount
+        cdef double time_to_wait
+
+        if additional_tokes <= 0:
+            return 0.0
+        if self.continuous:
+            refill_rate = refill_rate / refill_amount
+            refill_amount = 1
+        # time until enough refill operations took place for the tokens we are short
+        time_to_wait = (self.last_update - now
+                        + math.ceil(<double> additional_tokes / <double> refill_amount) * refill_rate)
+        return time_to_wait if time_to_wait > 0 else 0.0
+
+    cpdef bint consumeToken(self, long token_amount, bint blocking=True, timeout=None) except *:
         # type: (int, bool, float) -> bool
         """
         Consumes x tokens from the Token Bucket.
@@ -130,60 +365,282 @@ cdef class TokenBucket(object):
         :raises TimeoutError: a TimeoutError is raised, if the bucket has not enough tokens and the time to wait for a 
                               sufficient amount of tokens woould take longer than the given timeout
         """
-        cdef double now, time_to_wait
-        cdef long additional_tokes
+        cdef double now, time_to_wait, started = -1
+        cdef double c_timeout = timeout if timeout else -1  # like the py version, None and 0 wait without limit
 
         if token_amount > self.size:
             raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
 
+        # fast path, refill and debit in a single critical section, that does not execute any Python code
+        now = self._now()
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        if not self.fifo or not self.waiters:
+            self._refill(now, False)
+            if token_amount <= self.value:
+                self.value -= token_amount
+                unlock_lock(self.mutex)
+                if self.metrics is not None:
+                    self.metrics.record_granted(self, token_amount, 0.0)
+                return True
+        unlock_lock(self.mutex)
+
+        if self.fifo:
+            return self._consume_fifo(token_amount, blocking, c_timeout)
+
+        while True:
+            with self.mutex:
+                now = self._now()
+                self._refill(now, False)  # perform a refill, before we consume tokens, maybe we have gained some more tokens
+
+                # we want to consume less tokens than there are tokens currently in the bucket, nice case
+                if token_amount <= self.value:
+                    self.value -= token_amount
+                    if self.metrics is not None:
+                        self.metrics.record_granted(self, token_amount, now - started if started != -1 else 0.0)
+                    return True
+                else:  # we want to consume more tokens, than there are tokens in the bucket, bad case
+                    if not blocking:
+                        if self.metrics is not None:
+                            self.metrics.record_denied(self, token_amount, self._time_to_wait(token_amount, now))
+                        raise TokenAmountError(
+                            "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, current aviable tokens are " + str(
+                                self.value))
+                    else:  # we enabled to wait for more tokens
+                        # time until enough refill operations took place for the tokens we are short,
+                        # so we only have to sleep once
+                        time_to_wait = self._time_to_wait(token_amount, now)
+                        if c_timeout != -1:
+                            if time_to_wait > c_timeout:
+                                if self.metrics is not None:
+                                    self.metrics.record_timeout(self, token_amount, time_to_wait)
+                                raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                                    time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                                    c_timeout) + " seconds, returning")
+                        if started == -1:
+                            started = now
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if c_timeout != -1:
+                c_timeout = c_timeout - time_to_wait
+
+    cdef bint _consume_fifo(self, long token_amount, bint blocking, double timeout) except *:
+        # type: (int, bool, float) -> bool
+        """
+        FIFO variant of consumeToken.
+        Blocked consumers are queued in self.waiters, each with its own Condition on self.mutex. Only the head of
+        the queue waits for the next refill, all others sleep until their predecessor leaves the queue and notifies
+        them.
+        """
+        cdef double now, started, time_to_wait, deadline = -1
+        cdef bint was_head
+
         with self.mutex:
-            now = time.time()
-            self.refill(now)  # perform a refill, before we consume tokens, maybe we have gained some more tokens
+            now = started = self._now()
+            self._refill(now, False)
 
-            # we want to consume less tokens than there are tokens currently in the bucket, nice case
-            if token_amount <= self.value:
+            # only take the nice case, if nobody is waiting in front of us
+            if not self.waiters and token_amount <= self.value:
                 self.value -= token_amount
+                if self.metrics is not None:
+                    self.metrics.record_granted(self, token_amount, 0.0)
                 return True
-            else:  # we want to consume more tokens, than there are tokens in the bucket, bad case
-                additional_tokes = token_amount - self.value  # the ammount of tokens we are short
-                if not blocking:
-                    raise TokenAmountError(
-                        "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, current aviable tokens are " + str(
-                            self.value))
-                else:  # we enabled to wait for more tokens
-                    time_to_wait = now - self.last_update
-
-                    # time delta between now and the last update (could also be negative)
-                    if time_to_wait < 0:
-                        time_to_wait = 0
-
-                    # theoretical time to wait for additional tokens, substracted by timedelta
-                    if additional_tokes > self.refill_amount:
-                        # we want more tokens than a refill operation could provide, we have to wait longer than
-                        # one refill operation.
-                        time_to_wait = (math.ceil(
-                            <double> self.refill_amount / <double> additional_tokes) * self.refill_rate) - time_to_wait
-                    else:
-                        # we want less or equal tokens than a refill operation could provide, we only have to wait
-                        # for this refill operation to take place
-                        time_to_wait = self.refill_rate - time_to_wait
-
-                    if time_to_wait < 0:
-                        time_to_wait = 0
-                    if timeout != -1:
-                        if time_to_wait > timeout:
-                            raise TimeoutError("not enough tokens aviable, waiting would be " + str(
-                                time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+            if not blocking:
+                if self.metrics is not None:
+                    self.metrics.record_denied(self, token_amount, self._fifo_time_to_wait(token_amount, now))
+                raise TokenAmountError(
+                    "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, current aviable tokens are " + str(
+                        self.value))
+            if timeout != -1:
+                time_to_wait = self._fifo_time_to_wait(token_amount, now)
+                if time_to_wait > timeout:
+                    if self.metrics is not None:
+                        self.metrics.record_timeout(self, token_amount, time_to_wait)
+                    raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                        time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                        timeout) + " seconds, returning")
+                deadline = now + timeout
+
+            waiter = (token_amount, threading.Condition(self.mutex))
+            if self.waiters is None:
+                self.waiters = collections.deque()
+            self.waiters.append(waiter)
+            try:
+                while True:
+                    time_to_wait = -1
+                    if self.waiters[0] is waiter:
+                        self._refill(now, False)
+                        if token_amount <= self.value:
+                            self.value -= token_amount
+                            if self.metrics is not None:
+                                self.metrics.record_granted(self, token_amount, now - started)
+                            return True
+                        time_to_wait = self._time_to_wait(token_amount, now)
+                    if deadline != -1:
+                        if now >= deadline:
+                            if self.metrics is not None:
+                                self.metrics.record_timeout(self, token_amount, timeout)
+                            raise TimeoutError("not enough tokens aviable, waited longer than allowed timeout of " + str(
                                 timeout) + " seconds, returning")
+                        if time_to_wait == -1 or deadline - now < time_to_wait:
+                            time_to_wait = deadline - now
+                    self.clock.wait(waiter[1], None if time_to_wait == -1 else time_to_wait)
+                    now = self._now()
+            finally:
+                # leaving the queue, the head hands over to the next consumer in line
+                was_head = self.waiters[0] is waiter
+                self.waiters.remove(waiter)
+                if was_head and self.waiters:
+                    self.waiters[0][1].notify()
+
+    cpdef bint try_consume(self, long token_amount=1) except -1:
+        # type: (int) -> bool
+        """
+        Consumes x tokens from the Token Bucket, if there are enough tokens, without blocking and without raising.
+        In FIFO mode blocked consumers are not overtaken.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+        cdef double now, time_to_wait = 0
+        cdef bint granted = False
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        now = self._now()
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        self._refill(now, False)
+        if token_amount <= self.value and not (self.fifo and self.waiters):
+            self.value -= token_amount
+            granted = True
+        elif self.metrics is not None:
+            time_to_wait = self._fifo_time_to_wait(token_amount, now)
+        unlock_lock(self.mutex)
+        if self.metrics is not None:
+            if granted:
+                self.metrics.record_granted(self, token_amount, 0.0)
+            else:
+                self.metrics.record_denied(self, token_amount, time_to_wait)
+        return granted
+
+    cpdef double reserve(self, long token_amount=1) except? -1:
+        # type: (int) -> float
+        """
+        Debits x tokens from the Token Bucket immediately, even if there are not enough tokens, and returns the time
+        the caller has to wait before using them. The fill level stays negative, until the refills paid the debt.
+        Reservations take precedence over blocked consumers, which wait until the debt is paid.
+
+        :param token_amount: amount of tokens to reserve
+        :return: the time to wait in seconds, 0 if the tokens were available
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+        cdef double now, time_to_wait
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        now = self._now()
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        self._refill(now, False)
+        time_to_wait = self._time_to_wait(token_amount, now)
+        self.value -= token_amount
+        unlock_lock(self.mutex)
+        if self.metrics is not None:
+            self.metrics.record_granted(self, token_amount, time_to_wait)
+        return time_to_wait
+
+    def refund(self, long token_amount):
+        # type: (int) -> None
+        """
+        Gives x unused tokens back to the Token Bucket, e.g. tokens, that were taken ahead of use, but not used.
+        The fill level is capped at the size, a blocked consumer at the head of the FIFO queue recalculates its wait.
+
+        :param token_amount: amount of tokens to give back
+        """
+        cdef double now = self._now()
+
+        with self.mutex:
+            self._refill(now, False)
+            self.value += token_amount
+            if self.value > self.size:
+                self.value = self.size
+            if self.metrics is not None:
+                self.metrics.record_refunded(self, token_amount)
+            if self.waiters:
+                self.waiters[0][1].notify()
+
+    def reconfigure(self, size=None, refillrate=None, refillamount=None):
+        # type: (int, float, int) -> None
+        """
+        Changes the configuration of the Token Bucket at runtime, thread safe.
+        The bucket is refilled with the old configuration up to now first, so the tokens accumulated so far are
+        kept, only tokens above a smaller size are dropped. The time since the last refill counts towards the next
+        refill with the new configuration. A blocked consumer at the head of the FIFO queue recalculates its wait.
+
+        :param size: The new size of the Token Bucket, None to keep the size
+        :param refillrate: The new time interval for refilling the Token Bucket, None to keep it
+        :param refillamount: The new amount of tokens to refill per refill operation, None to keep it
+        """
+        cdef double now = self._now()
+
+        with self.mutex:
+            self._refill(now, False)
+            if size is not None:
+                self.size = size
+                if self.value > self.size:
+                    self.value = self.size
+            if refillrate is not None:
+                self.refill_rate = refillrate
+            if refillamount is not None:
+                self.refill_amount = refillamount
+            if self.waiters:
+                self.waiters[0][1].notify()
+
+    def __getstate__(self):
+        # type: () -> tuple
+        """
+        returns the state of the bucket: (version, size, value, refill_rate, refill_amount, age, fifo, continuous).
+        The age of the last update is stored instead of its timestamp, timestamps of a monotonic clock are
+        meaningless in another process or after a restart. Waiters, the clock and the metrics are not part of the
+        state, a restored bucket uses the default clock.
+        """
+        cdef double now = self._now()
+        cdef long value
+        cdef double last_update
+
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        value = self.value
+        last_update = self.last_update
+        unlock_lock(self.mutex)
+        return (STATE_VERSION, self.size, value, self.refill_rate, self.refill_amount, now - last_update, self.fifo,
+                self.continuous)
+
+    def __setstate__(self, tuple state):
+        # type: (tuple) -> None
+        """
+        restores a state returned by __getstate__(), the last update is placed age seconds before now
+        """
+        cdef double now
+
+        check_state_version(state[0])
+        _, size, value, refill_rate, refill_amount, age, fifo, continuous = state
+        now = self._now()
+        lock_lock(self.mutex, pythread.PyThread_get_thread_ident(), True)
+        self.size = size
+        self.value = value
+        self.refill_rate = refill_rate
+        self.refill_amount = refill_amount
+        self.last_update = now - age
+        self.fifo = fifo
+        self.continuous = continuous
+        unlock_lock(self.mutex)
 
-        # due to using 'with mutex' we have to move the following block outside the else block
-        # this is VERY ugly, exchange it with mutex.aquire()+mutex.release()
-        # will change in the future, maybe
-        time.sleep(time_to_wait)
-        if timeout != -1:
-            timeout = timeout - time_to_wait
-        return self.consumeToken(token_amount, blocking=blocking,
-                                 timeout=timeout)  # lets try again to consume some tokens
+    def __reduce__(self):
+        return self.__class__, (self.size, self.refill_rate, self.refill_amount), self.__getstate__()
 
     def __enter__(self):
         self.consumeToken(1)
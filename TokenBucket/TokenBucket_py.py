@@ -1,24 +1,46 @@
-import math
+import collections
 import threading
-import time
 
+from .TokenBucketClock import Clock, DEFAULT_CLOCK, check_timestamp
+from .TokenBucketCore import STATE_VERSION, check_state_version, refill_state, time_to_wait as core_time_to_wait
 from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError
+from .TokenBucketMetrics import TokenBucketMetrics
 
 
 class TokenBucket(object):
     """
     Simple implementation of a synchronized Token Bucket.
     Created mainly for learning purposes.
+
+    In the default greedy mode every blocked consumer races for the tokens after its own sleep, so small requests
+    can overtake large ones. In FIFO mode blocked consumers are queued and served in order, only the consumer at
+    the head of the queue waits for the next refill and hands over to its successor when it leaves.
+
+    In continuous mode the bucket is refilled token by token, one token every refillrate / refillamount seconds,
+    instead of refillamount tokens every refillrate seconds. This avoids bursts of admissions at the refill
+    boundaries. The fractional progress towards the next token is kept in last_update, so the exact time to wait
+    for any amount of tokens is known in advance.
+
+    Time is taken from a monotonic clock per default, all timestamps (lastupdate, now) are in the time scale of
+    the clock of the bucket. The default clock used to be the wall clock, timestamps of time.time() are rejected
+    with a ValueError by a bucket with a monotonic clock, such buckets need clock=WallClock().
+
+    Consumes are recorded into the metrics attribute, if it is set to a TokenBucketMetrics.
     """
 
-    def __init__(self, size, refillrate, refillamount, value=None, lastupdate=None):
-        # type: (int, float, int, int, float) -> None
+    def __init__(self, size, refillrate, refillamount, value=None, lastupdate=None, fifo=False, continuous=False,
+                 clock=None, metrics=None):
+        # type: (int, float, int, int, float, bool, bool, Clock, TokenBucketMetrics) -> None
         """
         :param size: The size of the Token Bucket
         :param refillrate: The time interval for refilling the Token Bucket
         :param refillamount: The amount of tokens to refill per refill operation
         :param value: Initialize the Token Bucket with a given value
-        :param lastupdate: Initialize the Token Bucket with a given timestamp
+        :param lastupdate: Initialize the Token Bucket with a given timestamp of its clock
+        :param fifo: Serve blocked consumers in FIFO order instead of greedy
+        :param continuous: Refill token by token instead of refillamount tokens at once
+        :param clock: The clock to take the time from and to wait with, defaults to a monotonic clock
+        :param metrics: Record the consumes into the given metrics
         """
 
         self.size = size  # type: int
@@ -26,11 +48,19 @@ class TokenBucket(object):
         self.refill_rate = refillrate  # type: float
         self.refill_amount = refillamount  # type: int
         self.mutex = threading.RLock()  # type: threading.RLock
-        self.last_update = time.time()  # type: float
-        if value:
+        self.clock = clock if clock is not None else DEFAULT_CLOCK  # type: Clock
+        self.last_update = self.clock.time()  # type: float
+        if value is not None:
             self.value = value  # type: int
-        if lastupdate:
+        if lastupdate is not None:
+            check_timestamp(self.clock, lastupdate)
             self.last_update = lastupdate  # type: float
+        self.fifo = fifo  # type: bool
+        self.continuous = continuous  # type: bool
+        self.waiters = collections.deque()  # type: collections.deque
+        self.metrics = None  # type: TokenBucketMetrics
+        if metrics is not None:
+            metrics.attach(self)
 
     def _refill_count(self, now=None):
         # type: (float) -> int
@@ -59,7 +89,7 @@ class TokenBucket(object):
         #            (    15     -       7         ) /       10           = 8 / 10 = 0.8 = int 0
         with self.mutex:
             if not now:
-                now = time.time()  # type: float
+                now = self.clock.time()  # type: float
             return int(((now - self.last_update) / self.refill_rate))
 
     def current_filllevel(self):
@@ -72,7 +102,8 @@ class TokenBucket(object):
         """
 
         with self.mutex:
-            self.refill()  # refilling inside mutex, because another thread could jump between refill() and return value
+            # refilling inside mutex, because another thread could jump between refill() and return value
+            self._refill(self.clock.time())
             return self.value
 
     def refill(self, now=None, force=False):
@@ -87,20 +118,54 @@ class TokenBucket(object):
 
         with self.mutex:
             if not now:
-                now = time.time()  # type: float
-            refill_count = self._refill_count(now)  # calculate how many refill operations we can perform
-            if refill_count > 0:
-                self.value += refill_count * self.refill_amount  # how many items can be refilled
+                now = self.clock.time()  # type: float
+            else:
+                check_timestamp(self.clock, now)
+            self._refill(now, force)
+
+    def _refill(self, now, force=False):
+        # type: (float, bool) -> None
+        """
+        refill operation without locking, must be called with the mutex held.
+        Avoids re-entering the mutex for every refill on the consume path.
+        """
+
+        if self.continuous and not force:
+            self.value, self.last_update = refill_state(self.value, self.last_update, self.size,
+                                                        self.refill_rate / self.refill_amount, 1, now)
+        else:
+            self.value, self.last_update = refill_state(self.value, self.last_update, self.size, self.refill_rate,
+                                                        self.refill_amount, now, force)
+
+    def _time_to_wait(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        calculates the exact time until token_amount tokens are available, must be called with the mutex held
+        and after a refill.
+
+        :param token_amount: amount of tokens to wait for
+        :param now: Specifies the current time to use
+        :return: the time to wait in seconds
+        """
+
+        if self.continuous:
+            return core_time_to_wait(self.value, self.last_update, self.refill_rate / self.refill_amount, 1,
+                                     token_amount, now)
+        return core_time_to_wait(self.value, self.last_update, self.refill_rate, self.refill_amount, token_amount,
+                                 now)
 
-                # amount of refill operations * refilltime -> last update
-                # this is a logical calculation, based that time.time() is accurate
-                self.last_update += refill_count * self.refill_rate
-            elif force:
-                self.value += self.refill_amount
-                self.last_update += 1 * self.refill_rate
+    def _fifo_time_to_wait(self, token_amount, now):
+        # type: (int, float) -> float
+        """
+        calculates the time until token_amount tokens are available for a consumer, that queues up behind all
+        currently waiting consumers.
+
+        :param token_amount: amount of tokens to consume
+        :param now: Specifies the current time to use
+        :return: the time to wait in seconds
+        """
 
-            if self.value > self.size:
-                self.value = self.size
+        return self._time_to_wait(sum(amount for amount, waiter in self.waiters) + token_amount, now)
 
     def consumeToken(self, token_amount, blocking=True, timeout=None):
         # type: (int, bool, float) -> bool
@@ -123,54 +188,244 @@ class TokenBucket(object):
         if token_amount > self.size:
             raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
 
+        if self.fifo:
+            return self._consume_fifo(token_amount, blocking, timeout)
+
+        started = None  # time of the first wait
+        while True:
+            with self.mutex:
+                now = self.clock.time()
+                self._refill(now)  # perform a refill, before we consume tokens, maybe we have gained some more tokens
+
+                # we want to consume less tokens than there are tokens currently in the bucket, nice case
+                if token_amount <= self.value:
+                    self.value -= token_amount
+                    if self.metrics is not None:
+                        self.metrics.record_granted(self, token_amount, now - started if started is not None else 0.0)
+                    return True
+                else:  # we want to consume more tokens, than there are tokens in the bucket, bad case
+                    if not blocking:
+                        if self.metrics is not None:
+                            self.metrics.record_denied(self, token_amount, self._time_to_wait(token_amount, now))
+                        raise TokenAmountError(
+                            "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                            "current aviable tokens are " + str(
+                                self.value))
+                    else:  # we enabled to wait for more tokens
+                        # time until enough refill operations took place for the tokens we are short,
+                        # so we only have to sleep once
+                        time_to_wait = self._time_to_wait(token_amount, now)
+                        if timeout:
+                            if time_to_wait > timeout:
+                                if self.metrics is not None:
+                                    self.metrics.record_timeout(self, token_amount, time_to_wait)
+                                raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                                    time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                                    timeout) + " seconds, returning")
+                        if started is None:
+                            started = now
+
+            # sleep outside of the mutex, then lets try again to consume some tokens
+            self.clock.sleep(time_to_wait)
+            if timeout:
+                timeout = timeout - time_to_wait
+
+    def _consume_fifo(self, token_amount, blocking, timeout):
+        # type: (int, bool, float) -> bool
+        """
+        FIFO variant of consumeToken.
+        Blocked consumers are queued in self.waiters, each with its own Condition on self.mutex. Only the head of
+        the queue waits for the next refill, all others sleep until their predecessor leaves the queue and notifies
+        them.
+        """
+
         with self.mutex:
-            now = time.time()
-            self.refill(now)  # perform a refill, before we consume tokens, maybe we have gained some more tokens
+            now = started = self.clock.time()
+            self._refill(now)
+
+            # only take the nice case, if nobody is waiting in front of us
+            if not self.waiters and token_amount <= self.value:
+                self.value -= token_amount
+                if self.metrics is not None:
+                    self.metrics.record_granted(self, token_amount, 0.0)
+                return True
+            if not blocking:
+                if self.metrics is not None:
+                    self.metrics.record_denied(self, token_amount, self._fifo_time_to_wait(token_amount, now))
+                raise TokenAmountError(
+                    "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
+                    "current aviable tokens are " + str(self.value))
+            deadline = None
+            if timeout:
+                time_to_wait = self._fifo_time_to_wait(token_amount, now)
+                if time_to_wait > timeout:
+                    if self.metrics is not None:
+                        self.metrics.record_timeout(self, token_amount, time_to_wait)
+                    raise TimeoutError("not enough tokens aviable, waiting would be " + str(
+                        time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
+                        timeout) + " seconds, returning")
+                deadline = now + timeout
+
+            waiter = (token_amount, threading.Condition(self.mutex))
+            self.waiters.append(waiter)
+            try:
+                while True:
+                    time_to_wait = None
+                    if self.waiters[0] is waiter:
+                        self._refill(now)
+                        if token_amount <= self.value:
+                            self.value -= token_amount
+                            if self.metrics is not None:
+                                self.metrics.record_granted(self, token_amount, now - started)
+                            return True
+                        time_to_wait = self._time_to_wait(token_amount, now)
+                    if deadline is not None:
+                        if now >= deadline:
+                            if self.metrics is not None:
+                                self.metrics.record_timeout(self, token_amount, timeout)
+                            raise TimeoutError("not enough tokens aviable, waited longer than allowed timeout of " +
+                                               str(timeout) + " seconds, returning")
+                        if time_to_wait is None or deadline - now < time_to_wait:
+                            time_to_wait = deadline - now
+                    self.clock.wait(waiter[1], time_to_wait)
+                    now = self.clock.time()
+            finally:
+                # leaving the queue, the head hands over to the next consumer in line
+                was_head = self.waiters[0] is waiter
+                self.waiters.remove(waiter)
+                if was_head and self.waiters:
+                    self.waiters[0][1].notify()
+
+    def try_consume(self, token_amount=1):
+        # type: (int) -> bool
+        """
+        Consumes x tokens from the Token Bucket, if there are enough tokens, without blocking and without raising.
+        In FIFO mode blocked consumers are not overtaken.
+
+        :param token_amount: amount of tokens to consume
+        :return: returns if token_amount tokens could be consumed or not
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
 
-            # we want to consume less tokens than there are tokens currently in the bucket, nice case
-            if token_amount <= self.value:
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        with self.mutex:
+            now = self.clock.time()
+            self._refill(now)
+            if token_amount <= self.value and not (self.fifo and self.waiters):
                 self.value -= token_amount
+                if self.metrics is not None:
+                    self.metrics.record_granted(self, token_amount, 0.0)
                 return True
-            else:  # we want to consume more tokens, than there are tokens in the bucket, bad case
-                additional_tokes = token_amount - self.value  # the ammount of tokens we are short
-                if not blocking:
-                    raise TokenAmountError(
-                        "cannot reduce bucket by more tokens than there are tokens in bucket, try less tokens, "
-                        "current aviable tokens are " + str(
-                            self.value))
-                else:  # we enabled to wait for more tokens
-                    time_to_wait = now - self.last_update
-
-                    # time delta between now and the last update (could also be negative)
-                    if time_to_wait < 0:
-                        time_to_wait = 0
-
-                    # theoretical time to wait for additional tokens, substracted by timedelta
-                    if additional_tokes > self.refill_amount:
-                        # we want more tokens than a refill operation could provide, we have to wait longer than
-                        # one refill operation.
-                        time_to_wait = (math.ceil(
-                            self.refill_amount / float(additional_tokes)) * self.refill_rate) - time_to_wait
-                    else:
-                        # we want less or equal tokens than a refill operation could provide, we only have to wait
-                        # for this refill operation to take place
-                        time_to_wait = self.refill_rate - time_to_wait
-                    if time_to_wait < 0:
-                        time_to_wait = 0
-                    if timeout:
-                        if time_to_wait > timeout:
-                            raise TimeoutError("not enough tokens aviable, waiting would be " + str(
-                                time_to_wait) + " seconds, but is longer than allowed timeout of " + str(
-                                timeout) + " seconds, returning")
-
-        # due to using 'with mutex' we have to move the following block outside the else block
-        # this is VERY ugly, exchange it with mutex.aquire()+mutex.release()
-        # will change in the future, maybe
-        time.sleep(time_to_wait)
-        if timeout:
-            timeout = timeout - time_to_wait
-        return self.consumeToken(token_amount, blocking=blocking,
-                                 timeout=timeout)  # lets try again to consume some tokens
+            if self.metrics is not None:
+                self.metrics.record_denied(self, token_amount, self._fifo_time_to_wait(token_amount, now))
+            return False
+
+    def reserve(self, token_amount=1):
+        # type: (int) -> float
+        """
+        Debits x tokens from the Token Bucket immediately, even if there are not enough tokens, and returns the time
+        the caller has to wait before using them. The fill level stays negative, until the refills paid the debt.
+        Reservations take precedence over blocked consumers, which wait until the debt is paid.
+
+        :param token_amount: amount of tokens to reserve
+        :return: the time to wait in seconds, 0 if the tokens were available
+        :raises BucketSizeError: a BucketSizeError is raised, if the given token_amount is bigger than the maximum
+                                 bucket size
+        """
+
+        if token_amount > self.size:
+            raise BucketSizeError("cannot consume more tokens than the maximum amount of tokens in the bucket")
+
+        with self.mutex:
+            now = self.clock.time()
+            self._refill(now)
+            time_to_wait = self._time_to_wait(token_amount, now)
+            self.value -= token_amount
+            if self.metrics is not None:
+                self.metrics.record_granted(self, token_amount, time_to_wait)
+            return time_to_wait
+
+    def refund(self, token_amount):
+        # type: (int) -> None
+        """
+        Gives x unused tokens back to the Token Bucket, e.g. tokens, that were taken ahead of use, but not used.
+        The fill level is capped at the size, a blocked consumer at the head of the FIFO queue recalculates its wait.
+
+        :param token_amount: amount of tokens to give back
+        """
+
+        with self.mutex:
+            self._refill(self.clock.time())
+            value = self.value + token_amount
+            self.value = value if value < self.size else self.size
+            if self.metrics is not None:
+                self.metrics.record_refunded(self, token_amount)
+            if self.waiters:
+                self.waiters[0][1].notify()
+
+    def reconfigure(self, size=None, refillrate=None, refillamount=None):
+        # type: (int, float, int) -> None
+        """
+        Changes the configuration of the Token Bucket at runtime, thread safe.
+        The bucket is refilled with the old configuration up to now first, so the tokens accumulated so far are
+        kept, only tokens above a smaller size are dropped. The time since the last refill counts towards the next
+        refill with the new configuration. A blocked consumer at the head of the FIFO queue recalculates its wait.
+
+        :param size: The new size of the Token Bucket, None to keep the size
+        :param refillrate: The new time interval for refilling the Token Bucket, None to keep it
+        :param refillamount: The new amount of tokens to refill per refill operation, None to keep it
+        """
+
+        with self.mutex:
+            self._refill(self.clock.time())
+            if size is not None:
+                self.size = size
+                if self.value > size:
+                    self.value = size
+            if refillrate is not None:
+                self.refill_rate = refillrate
+            if refillamount is not None:
+                self.refill_amount = refillamount
+            if self.waiters:
+                self.waiters[0][1].notify()
+
+    def __getstate__(self):
+        # type: () -> tuple
+        """
+        returns the state of the bucket: (version, size, value, refill_rate, refill_amount, age, fifo, continuous).
+        The age of the last update is stored instead of its timestamp, timestamps of a monotonic clock are
+        meaningless in another process or after a restart. Waiters, the clock and the metrics are not part of the
+        state, a restored bucket uses the default clock.
+        """
+
+        with self.mutex:
+            return (STATE_VERSION, self.size, self.value, self.refill_rate, self.refill_amount,
+                    self.clock.time() - self.last_update, self.fifo, self.continuous)
+
+    def __setstate__(self, state):
+        # type: (tuple) -> None
+        """
+        restores a state returned by __getstate__(), the last update is placed age seconds before now
+        """
+
+        check_state_version(state[0])
+        _, size, value, refill_rate, refill_amount, age, fifo, continuous = state
+        if not hasattr(self, 'mutex'):
+            self.__init__(size, refill_rate, refill_amount)
+        with self.mutex:
+            self.size = size
+            self.value = value
+            self.refill_rate = refill_rate
+            self.refill_amount = refill_amount
+            self.last_update = self.clock.time() - age
+            self.fifo = fifo
+            self.continuous = continuous
+
+    def __reduce__(self):
+        return self.__class__, (self.size, self.refill_rate, self.refill_amount), self.__getstate__()
 
     def __enter__(self):
         self.consumeToken(1)
@@ -1,9 +1,127 @@
-try:
-    from .TokenBucket_cy import TokenBucket
-except ImportError:
-    from .TokenBucket_py import TokenBucket
+"""
+The exports of the package are imported lazily on first access (PEP 562), so importing the package does not load
+the compiled modules, wrapt or the optional parts, until they are used.
 
-from .TokenBucketDecorator import withTokenBucket
-from .TokenBucketErrors import TimeoutError, TokenAmountError, BucketSizeError, TokenBucketError
+The limiters with a Cython and a Python implementation are taken from the backend named by BACKEND, 'cython' if the
+compiled modules are available, else 'python'. The backend can be forced with the environment variable
+TOKENBUCKET_BACKEND set to 'cython' or 'python'.
+"""
+import importlib
+import os
 
-__all__ = ['TokenBucket', 'withTokenBucket', 'TokenBucketError', 'BucketSizeError', 'TokenAmountError', 'TimeoutError']
+BACKEND_ENVIRONMENT_VARIABLE = 'TOKENBUCKET_BACKEND'
+BACKENDS = ('cython', 'python')
+
+# limiters with a Cython and a Python implementation: name -> (Cython module, Python module)
+_BACKEND_EXPORTS = {
+    'TokenBucket': ('.TokenBucket_cy', '.TokenBucket_py'),
+    'SlidingWindowLimiter': ('.SlidingWindow_cy', '.SlidingWindow_py'),
+    'LeakyBucket': ('.LeakyBucket_cy', '.LeakyBucket_py'),
+}
+
+# all other exports: name -> module
+_EXPORTS = {
+    'AIMDController': '.TokenBucketAdaptive',
+    'AsyncTokenBucket': '.TokenBucketAsync',
+    'BackendTokenBucket': '.TokenBucketBackend',
+    'TokenBucketBackend': '.TokenBucketBackend',
+    'LocalBackend': '.TokenBucketBackend',
+    'RedisBackend': '.TokenBucketBackend',
+    'consume_many': '.TokenBucketBatch',
+    'Clock': '.TokenBucketClock',
+    'MonotonicClock': '.TokenBucketClock',
+    'WallClock': '.TokenBucketClock',
+    'VirtualClock': '.TokenBucketClock',
+    'withTokenBucket': '.TokenBucketDecorator',
+    'RateLimitedExecutor': '.TokenBucketExecutor',
+    'AsyncRateLimitedExecutor': '.TokenBucketExecutor',
+    'HierarchicalTokenBucket': '.TokenBucketHierarchy',
+    'ThrottledFile': '.TokenBucketIO',
+    'ThrottledSocket': '.TokenBucketIO',
+    'ThrottledStreamReader': '.TokenBucketIO',
+    'ThrottledStreamWriter': '.TokenBucketIO',
+    'KeyedTokenBucket': '.TokenBucketKeyed',
+    'LeasedTokenBucket': '.TokenBucketLease',
+    'TokenBucketMetrics': '.TokenBucketMetrics',
+    'prometheus_text': '.TokenBucketMetrics',
+    'SharedTokenBucket': '.TokenBucketShared',
+    'simulate': '.TokenBucketSimulator',
+    'poisson_trace': '.TokenBucketSimulator',
+    'load_trace': '.TokenBucketSimulator',
+    'SimulationResult': '.TokenBucketSimulator',
+    'SnapshotView': '.TokenBucketSnapshot',
+    'open_snapshot': '.TokenBucketSnapshot',
+    'TokenBucketError': '.TokenBucketErrors',
+    'BucketSizeError': '.TokenBucketErrors',
+    'TokenAmountError': '.TokenBucketErrors',
+    'TimeoutError': '.TokenBucketErrors',
+    'QueueFullError': '.TokenBucketErrors',
+}
+
+
+def _resolve_backend():
+    # type: () -> str
+    """
+    selects the backend by the environment variable or by the availability of the compiled modules
+
+    :return: the name of the backend
+    :raises ValueError: the environment variable names an unknown backend
+    :raises ImportError: the Cython backend is forced, but the compiled modules are not available
+    """
+
+    wanted = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, '').strip().lower()
+    if wanted and wanted not in BACKENDS:
+        raise ValueError(BACKEND_ENVIRONMENT_VARIABLE + " must be one of " + ", ".join(BACKENDS) + ", not " + repr(
+            wanted))
+    if wanted == 'python':
+        return 'python'
+    try:
+        for cython_module, _ in _BACKEND_EXPORTS.values():
+            importlib.import_module(cython_module, __name__)
+    except ImportError:
+        if wanted == 'cython':
+            raise
+        return 'python'
+    return 'cython'
+
+
+def _backend():
+    # type: () -> str
+    """
+    :return: the name of the backend, selected on first use only and cached as module attribute BACKEND
+    """
+
+    backend = globals().get('BACKEND')
+    if backend is None:
+        backend = globals()['BACKEND'] = _resolve_backend()
+    return backend
+
+
+def __getattr__(name):
+    if name == 'BACKEND':
+        return _backend()
+    elif name in _BACKEND_EXPORTS:
+        cython_module, python_module = _BACKEND_EXPORTS[name]
+        module = cython_module if _backend() == 'cython' else python_module
+        value = getattr(importlib.import_module(module, __name__), name)
+    elif name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    else:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    # cache the export, the next access does not call __getattr__ anymore
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | {'BACKEND'})
+
+
+__all__ = ['TokenBucket', 'SlidingWindowLimiter', 'LeakyBucket', 'AsyncTokenBucket', 'KeyedTokenBucket',
+           'SharedTokenBucket', 'BackendTokenBucket', 'LeasedTokenBucket', 'HierarchicalTokenBucket',
+           'TokenBucketBackend', 'LocalBackend', 'RedisBackend', 'AIMDController', 'withTokenBucket', 'consume_many',
+           'Clock', 'MonotonicClock', 'WallClock', 'VirtualClock', 'simulate', 'poisson_trace', 'load_trace',
+           'SimulationResult', 'SnapshotView', 'open_snapshot', 'TokenBucketMetrics', 'prometheus_text',
+           'ThrottledFile', 'ThrottledSocket', 'ThrottledStreamReader', 'ThrottledStreamWriter', 'RateLimitedExecutor',
+           'AsyncRateLimitedExecutor', 'TokenBucketError', 'BucketSizeError', 'TokenAmountError', 'TimeoutError',
+           'QueueFullError']
@@ -0,0 +1,46 @@
+"""
+Microbenchmark for the uncontended consumeToken() hot path.
+
+Prints consumes/sec for the pure Python and the Cython TokenBucket.
+
+usage: python -m benchmarks.bench_consume [iterations]
+"""
+import sys
+import time
+
+from TokenBucket import TokenBucket_py
+
+try:
+    from TokenBucket import TokenBucket_cy
+except ImportError:
+    TokenBucket_cy = None
+
+
+def bench_consume(bucket_class, iterations):
+    # type: (type, int) -> float
+    """
+    consumes one token per call from a bucket that never runs empty
+
+    :return: consumes per second
+    """
+
+    bucket = bucket_class(size=iterations + 1, refillrate=1.0, refillamount=1)
+    consume = bucket.consumeToken
+    start = time.perf_counter()
+    for _ in range(iterations):
+        consume(1)
+    return iterations / (time.perf_counter() - start)
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 1000000
+    implementations = [('py', TokenBucket_py.TokenBucket)]
+    if TokenBucket_cy is not None:
+        implementations.append(('cy', TokenBucket_cy.TokenBucket))
+    for name, bucket_class in implementations:
+        best = max(bench_consume(bucket_class, iterations) for _ in range(3))
+        print('%s: %.0f consumes/sec' % (name, best))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
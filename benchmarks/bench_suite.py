@@ -0,0 +1,252 @@
+"""
+Benchmark suite for the pure Python and the Cython TokenBucket.
+
+Measures uncontended and contended consume throughput, wakeup latency of blocked consumers, memory per bucket and
+import time, the admission throughput of the limiter algorithms side by side and the call overhead of the decorator,
+and prints the results as JSON, so they can be stored and compared across releases.
+
+usage: python -m benchmarks.bench_suite [--quick] [--output results.json]
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from TokenBucket import LeakyBucket_py, SlidingWindow_py, TokenBucket_py
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from .bench_consume import bench_consume
+
+try:
+    from TokenBucket import LeakyBucket_cy, SlidingWindow_cy, TokenBucket_cy
+except ImportError:
+    LeakyBucket_cy = SlidingWindow_cy = TokenBucket_cy = None
+
+THREAD_COUNTS = (1, 4, 16, 64)
+
+
+def bench_contended(bucket_class, threads, iterations):
+    # type: (type, int, int) -> float
+    """
+    threads consume one token per call from a shared bucket, that never runs empty
+
+    :return: consumes per second of all threads together
+    """
+
+    bucket = bucket_class(size=threads * iterations + 1, refillrate=1.0, refillamount=1)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        consume = bucket.consumeToken
+        barrier.wait()
+        for _ in range(iterations):
+            consume(1)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * iterations / (time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    # type: (list, float) -> float
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def bench_wakeup_latency(bucket_class, threads, grants, fifo):
+    # type: (type, int, int, bool) -> dict
+    """
+    threads block on an empty bucket, that refills one token every millisecond. The latency of a grant is the time
+    between the refill that made its token available and the return of consumeToken().
+
+    :return: latency percentiles in milliseconds
+    """
+
+    refill_rate = 0.001
+    start = time.monotonic()
+    bucket = bucket_class(size=1, refillrate=refill_rate, refillamount=1, value=0, lastupdate=start, fifo=fifo)
+    latencies = []
+    remaining = [grants]
+    mutex = threading.Lock()
+
+    def worker():
+        while True:
+            with mutex:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            bucket.consumeToken(1)
+            granted = time.monotonic()
+            refilled = start + int((granted - start) / refill_rate) * refill_rate
+            with mutex:
+                latencies.append((granted - refilled) * 1000)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return {
+        'p50': percentile(latencies, 0.50),
+        'p90': percentile(latencies, 0.90),
+        'p99': percentile(latencies, 0.99),
+        'max': max(latencies),
+    }
+
+
+def bench_memory(bucket_class, count):
+    # type: (type, int) -> float
+    """
+    :return: bytes allocated per bucket
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    buckets = [bucket_class(size=10, refillrate=1.0, refillamount=1) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del buckets
+    return allocated / float(count)
+
+
+def bench_import(module, repeat):
+    # type: (str, int) -> float
+    """
+    imports module in fresh interpreters
+
+    :return: the fastest import time in milliseconds
+    """
+
+    code = ("import time; start = time.perf_counter(); import " + module +
+            "; print((time.perf_counter() - start) * 1000)")
+    return min(float(subprocess.check_output([sys.executable, '-c', code])) for _ in range(repeat))
+
+
+def bench_try_consume(limiter, iterations):
+    # type: (object, int) -> float
+    """
+    decides about one token per call without blocking, the limiter admits every call
+
+    :return: decisions per second
+    """
+
+    try_consume = limiter.try_consume
+    start = time.perf_counter()
+    for _ in range(iterations):
+        try_consume(1)
+    return iterations / (time.perf_counter() - start)
+
+
+def bench_limiters(iterations, repeat):
+    # type: (int, int) -> dict
+    """
+    compares the admission throughput of the limiter algorithms, each configured to admit every call
+    """
+
+    factories = {
+        'token_bucket': lambda module: module.TokenBucket(size=iterations + 1, refillrate=1.0, refillamount=1),
+        'sliding_window': lambda module: module.SlidingWindowLimiter(size=iterations + 1, window=1.0),
+        'leaky_bucket': lambda module: module.LeakyBucket(size=iterations + 1, leakrate=1e-9),
+    }
+    modules = {
+        'token_bucket': (TokenBucket_py, TokenBucket_cy),
+        'sliding_window': (SlidingWindow_py, SlidingWindow_cy),
+        'leaky_bucket': (LeakyBucket_py, LeakyBucket_cy),
+    }
+    results = {}
+    for algorithm, factory in factories.items():
+        results[algorithm] = {}
+        for name, module in zip(('py', 'cy'), modules[algorithm]):
+            if module is not None:
+                results[algorithm][name] = max(bench_try_consume(factory(module), iterations) for _ in range(repeat))
+    return results
+
+
+def bench_decorator(iterations, repeat):
+    # type: (int, int) -> dict
+    """
+    calls a function decorated with the fastest available TokenBucket, that admits every call, with the default
+    wrapt wrapper and with the plain function wrapper of fast
+
+    :return: calls per second per wrapper
+    """
+
+    bucket_class = (TokenBucket_cy or TokenBucket_py).TokenBucket
+    results = {}
+    for name, fast in (('wrapt', False), ('fast', True)):
+        bucket = bucket_class(size=iterations * repeat + 1, refillrate=1.0, refillamount=1)
+        limited = withTokenBucket(bucket, fast=fast)(abs)
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                limited(1)
+            durations.append(time.perf_counter() - start)
+        results[name] = iterations / min(durations)
+    return results
+
+
+def run(quick=False):
+    # type: (bool) -> dict
+    iterations = 100000 if quick else 1000000
+    contended_iterations = 5000 if quick else 50000
+    grants = 200 if quick else 2000
+    buckets = 1000 if quick else 10000
+    repeat = 1 if quick else 5
+
+    implementations = [('py', TokenBucket_py.TokenBucket)]
+    if TokenBucket_cy is not None:
+        implementations.append(('cy', TokenBucket_cy.TokenBucket))
+
+    results = {}
+    for name, bucket_class in implementations:
+        results[name] = {
+            'uncontended_consumes_per_sec': max(bench_consume(bucket_class, iterations) for _ in range(repeat)),
+            'contended_consumes_per_sec': dict(
+                (str(threads), bench_contended(bucket_class, threads, contended_iterations // threads))
+                for threads in THREAD_COUNTS),
+            'wakeup_latency_ms': {
+                'greedy': bench_wakeup_latency(bucket_class, 16, grants, fifo=False),
+                'fifo': bench_wakeup_latency(bucket_class, 16, grants, fifo=True),
+            },
+            'memory_per_bucket_bytes': bench_memory(bucket_class, buckets),
+            'import_time_ms': bench_import(bucket_class.__module__, repeat),
+        }
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'package_import_time_ms': bench_import('TokenBucket', repeat),
+        'results': results,
+        'limiters_decisions_per_sec': bench_limiters(iterations, repeat),
+        'decorator_calls_per_sec': bench_decorator(iterations, repeat),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='run with fewer iterations')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args(argv[1:])
+    results = json.dumps(run(args.quick), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results + '\n')
+    else:
+        print(results)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
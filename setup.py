@@ -1,5 +1,4 @@
 import os
-import platform
 
 try:
     from setuptools import setup
@@ -7,7 +6,11 @@ try:
 except ImportError:
     from distutils.core import setup
     from distutils.extension import Extension
-from Cython.Build import cythonize
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    # without Cython only the pure Python implementation is installed, it is selected at runtime
+    cythonize = None
 
 
 def scandir(dir, files=[]):
@@ -22,15 +25,12 @@ def scandir(dir, files=[]):
 
 # generate an Extension object from its dotted name
 def makeExtension(extName):
-    fopenmp = '-fopenmp'
-    if platform.system() == 'Windows':
-        fopenmp = '/openmp'
     extPath = extName.replace(".", os.path.sep) + ".pyx"
     return Extension(
         extName,
         [extPath],
-        extra_compile_args=[fopenmp],
-        extra_link_args=[fopenmp],
+        # a failed build only skips the extension, the pure Python implementation is used instead
+        optional=True,
     )
 
 
@@ -44,10 +44,16 @@ extNames = scandir("TokenBucket")
 # and build up the set of Extension objects
 extensions = [makeExtension(name) for name in extNames]
 
+if cythonize is not None:
+    extensions = cythonize(extensions, build_dir="build", compiler_directives={'language_level': 3})
+else:
+    extensions = []
+
 # finally, we can pass all this to distutils
 setup(
-    ext_modules=cythonize(extensions, build_dir="build", compiler_directives={'language_level': 3}),
-    install_requires=['Cython', 'wrapt'],
+    ext_modules=extensions,
+    install_requires=[],
+    extras_require={'cython': ['Cython'], 'wrapt': ['wrapt'], 'redis': ['redis']},
     name="TokenBucket",
     version="1.0.1",
     author="Florian Sauer",
@@ -56,6 +62,8 @@ setup(
     # keywords = "example documentation tutorial",
     url="https://github.com/FlorianSauer/TokenBucket",
     packages=['TokenBucket', ],
+    # the Cython sources, to build the extension from an installed package
+    package_data={'TokenBucket': ['*.pyx', '*.pxd']},
     long_description=read('README.md'),
     # classifiers=[
     #     "Development Status :: 3 - Alpha",
@@ -0,0 +1,55 @@
+"""
+Runs the tests of a limiter against both implementations, the pure Python one and the Cython one, the Cython tests
+are skipped, if the extension is not built.
+"""
+import importlib
+import unittest
+
+
+def implementations(module, name):
+    # type: (str, str) -> dict
+    """
+    :param module: the name of the implementation modules in TokenBucket, without the _py or _cy suffix
+    :param name: the name of the class in the implementation modules
+    :return: suffix -> class, None for the Cython implementation, if it is not built
+    """
+
+    classes = {'py': getattr(importlib.import_module('TokenBucket.' + module + '_py'), name)}
+    try:
+        classes['cy'] = getattr(importlib.import_module('TokenBucket.' + module + '_cy'), name)
+    except ImportError:
+        classes['cy'] = None
+    return classes
+
+
+TOKEN_BUCKETS = implementations('TokenBucket', 'TokenBucket')
+HAVE_CYTHON = TOKEN_BUCKETS['cy'] is not None
+
+requires_cython = unittest.skipUnless(HAVE_CYTHON, "the Cython extension is not built")
+
+
+def _implementation_test(method, implementation):
+    def test(self):
+        method(self, implementation)
+
+    test.__doc__ = method.__doc__
+    if implementation is None:
+        test = unittest.skip("the Cython extension is not built")(test)
+    return test
+
+
+class BackendTests(object):
+    """
+    Mixin for TestCases, every method _test_x(self, implementation) is run once per implementation, as test_x_py
+    and test_x_cy.
+    """
+
+    # suffix -> class of the implementation, passed to the _test_ methods
+    implementations = TOKEN_BUCKETS
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_test_') and callable(method):
+                for suffix, implementation in cls.implementations.items():
+                    setattr(cls, name[1:] + '_' + suffix, _implementation_test(method, implementation))
@@ -0,0 +1,63 @@
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from .TestBackends import BackendTests, implementations
+
+
+class TestLeakyBucket(BackendTests, TestCase):
+
+    implementations = implementations('LeakyBucket', 'LeakyBucket')
+
+    def _test_queue(self, LeakyBucket):
+        clock = VirtualClock()
+        bucket = LeakyBucket(size=4, leakrate=1.0, leakamount=4, clock=clock)
+        self.assertEqual(bucket.current_filllevel(), 4)
+        # the first consumer is released immediately, every further one a quarter second later
+        self.assertTrue(bucket.try_consume(1))
+        self.assertFalse(bucket.try_consume(1))
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(BucketSizeError, bucket.consumeToken, 5)
+        self.assertEqual(bucket.current_filllevel(), 3)
+        bucket.consumeToken(2)
+        self.assertEqual(clock.time(), 0.25)
+        self.assertEqual(bucket.current_filllevel(), 2)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=0.25)
+        # a consumer, that does not fit into the queue, waits for room and is released, when the queue has drained
+        bucket.consumeToken(4)
+        self.assertEqual(clock.time(), 0.75)
+        self.assertEqual(bucket.current_filllevel(), 0)
+        clock.advance(1.0)
+        self.assertEqual(bucket.current_filllevel(), 4)
+
+    def _test_smooth(self, LeakyBucket):
+        bucket = LeakyBucket(size=10, leakrate=0.02, leakamount=1)
+        released = []
+
+        def consumer():
+            bucket.consumeToken(1)
+            released.append(time.monotonic())
+
+        threads = [threading.Thread(target=consumer) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        released.sort()
+        gaps = [b - a for a, b in zip(released, released[1:])]
+        self.assertAlmostEqual(0.1, released[-1] - released[0], places=1)
+        self.assertGreater(min(gaps), 0.01)
+
+    def _test_decorator(self, LeakyBucket):
+        bucket = LeakyBucket(size=2, leakrate=0.05)
+
+        @withTokenBucket(bucket, on_reject=lambda: None)
+        def limited():
+            return True
+
+        self.assertTrue(limited())
+        self.assertIsNone(limited())
+
@@ -0,0 +1,57 @@
+import time
+from unittest import TestCase
+
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from .TestBackends import BackendTests, implementations
+
+
+class TestSlidingWindowLimiter(BackendTests, TestCase):
+
+    implementations = implementations('SlidingWindow', 'SlidingWindowLimiter')
+
+    def _test_window(self, SlidingWindowLimiter):
+        clock = VirtualClock()
+        limiter = SlidingWindowLimiter(size=10, window=1.0, clock=clock)
+        self.assertTrue(limiter.try_consume(10))
+        self.assertEqual(limiter.current_filllevel(), 0)
+        self.assertFalse(limiter.try_consume(1))
+        self.assertRaises(TokenAmountError, limiter.consumeToken, 1, blocking=False)
+        self.assertRaises(BucketSizeError, limiter.consumeToken, 11)
+        # at the start of the next window the previous window still counts in full, then it fades out
+        clock.advance(1.0)
+        self.assertEqual(limiter.current_filllevel(), 0)
+        clock.advance(0.25)
+        self.assertEqual(limiter.current_filllevel(), 2)
+        self.assertTrue(limiter.try_consume(2))
+        self.assertFalse(limiter.try_consume(1))
+        # the previous window has to fade by half a token, 0.05 seconds
+        self.assertRaises(TimeoutError, limiter.consumeToken, 1, timeout=0.04)
+        limiter.consumeToken(1)
+        self.assertAlmostEqual(clock.time(), 1.3)
+        # the previous window is gone after two windows
+        clock.advance(2.0)
+        self.assertEqual(limiter.current_filllevel(), 10)
+
+    def _test_wait_next_window(self, SlidingWindowLimiter):
+        clock = VirtualClock()
+        limiter = SlidingWindowLimiter(size=4, window=1.0, clock=clock)
+        clock.advance(0.5)
+        limiter.consumeToken(4)
+        # all tokens were consumed in the current window, which becomes the previous window at 1.0
+        limiter.consumeToken(2)
+        self.assertAlmostEqual(clock.time(), 1.5)
+
+    def _test_decorator(self, SlidingWindowLimiter):
+        limiter = SlidingWindowLimiter(size=2, window=0.2)
+
+        @withTokenBucket(limiter)
+        def limited(value):
+            return value
+
+        past = time.time()
+        self.assertEqual([limited(i) for i in range(4)], [0, 1, 2, 3])
+        # the third call waits until the first window has faded by one token at 0.3, the fourth until 0.4
+        self.assertAlmostEqual(0.4, time.time() - past, places=1)
+
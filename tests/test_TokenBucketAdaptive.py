@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketAdaptive import AIMDController
+from TokenBucket.TokenBucketClock import VirtualClock
+from .TestBackends import BackendTests
+
+
+class TestAIMDController(BackendTests, TestCase):
+
+    def _test_aimd(self, TokenBucket):
+        clock = VirtualClock()
+        bucket = TokenBucket(size=10, refillrate=1.0, refillamount=10, clock=clock)
+        controller = AIMDController(bucket, min_rate=2.0, max_rate=12.0, latency_target=0.5)
+        self.assertEqual(controller.rate, 10.0)
+        for _ in range(10):
+            controller.success(latency=0.1)
+        self.assertAlmostEqual(controller.rate, 11.0, places=1)
+        # the increases are applied once per refill interval
+        self.assertEqual(bucket.refill_rate, 1.0)
+        clock.advance(1.0)
+        controller.success(latency=0.1)
+        self.assertAlmostEqual(bucket.refill_rate, 10 / controller.rate)
+        controller.success(latency=0.1)
+        self.assertNotAlmostEqual(bucket.refill_rate, 10 / controller.rate)
+        rate = controller.rate
+        self.assertEqual(controller.throttled(), controller.rate)
+        self.assertAlmostEqual(controller.rate, rate / 2)
+        self.assertAlmostEqual(bucket.refill_rate, 10 / controller.rate)
+        # rejections within the cooldown reduce the rate only once
+        controller.throttled()
+        self.assertAlmostEqual(controller.rate, rate / 2)
+        clock.advance(1.0)
+        # a slow success counts as throttled
+        controller.success(latency=1.0)
+        self.assertAlmostEqual(controller.rate, rate / 4)
+        clock.advance(1.0)
+        self.assertEqual(controller.throttled(), 2.0)
+        for _ in range(1000):
+            controller.success()
+            clock.advance(0.01)
+        self.assertEqual(controller.rate, 12.0)
+        self.assertAlmostEqual(bucket.refill_rate, 10 / 12.0)
+        self.assertEqual(bucket.size, 10)
+
+    def test_throughput(self):
+        """
+        the rate converges below the capacity of the downstream service
+        """
+
+        clock = VirtualClock()
+        bucket = TokenBucket_py.TokenBucket(size=1, refillrate=1.0, refillamount=1, clock=clock)
+        controller = AIMDController(bucket, min_rate=1.0, max_rate=1000.0, increase=5.0)
+        capacity = 50
+        window_start, in_window = 0.0, 0
+        for _ in range(5000):
+            bucket.consumeToken(1)
+            if clock.time() - window_start >= 1.0:
+                window_start, in_window = clock.time(), 0
+            in_window += 1
+            if in_window > capacity:
+                controller.throttled()
+            else:
+                controller.success()
+        self.assertLess(controller.rate, 2 * capacity)
+        self.assertGreater(controller.rate, capacity / 4.0)
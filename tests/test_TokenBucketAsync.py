@@ -0,0 +1,214 @@
+import asyncio
+import time
+from unittest import TestCase
+
+from TokenBucket.TokenBucketAsync import AsyncTokenBucket
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from .TestDefaults import *
+
+
+class TestAsyncTokenBucket(TestCase):
+
+    def test_consume(self):
+        async def run():
+            bucket = AsyncTokenBucket(
+                size=DEFAULT_BUCKET_SIZE,
+                refillrate=DEFAULT_REFILL_TIME,
+                refillamount=DEFAULT_REFILL_AMOUNT
+            )
+            await bucket.consume(DEFAULT_BUCKET_SIZE)
+            with self.assertRaises(TokenAmountError):
+                await bucket.consume(1, blocking=False)
+            with self.assertRaises(BucketSizeError):
+                await bucket.consume(DEFAULT_BUCKET_SIZE + 1, blocking=False)
+            with self.assertRaises(TimeoutError):
+                await bucket.consume(1, timeout=1.0)
+
+        asyncio.run(run())
+
+    def test_waiters_share_loop(self):
+        """
+        many waiting consumers must not block the event loop and are served in FIFO order
+        """
+
+        async def run():
+            bucket = AsyncTokenBucket(size=2, refillrate=0.2, refillamount=2)
+            await bucket.consume(2)
+            order = []
+
+            async def consumer(i):
+                await bucket.consume(1)
+                order.append(i)
+
+            ticks = []
+
+            async def ticker():
+                while len(order) < 4:
+                    ticks.append(time.time())
+                    await asyncio.sleep(0.01)
+
+            past = time.time()
+            await asyncio.gather(ticker(), *[consumer(i) for i in range(4)])
+            present = time.time()
+            self.assertEqual(order, [0, 1, 2, 3])
+            self.assertAlmostEqual(0.4, present - past, places=1)
+            self.assertGreater(len(ticks), 10)
+
+        asyncio.run(run())
+
+    def test_timeout_while_queued(self):
+        """
+        the timeout is enforced while waiting, also if the tokens are granted later than estimated
+        """
+
+        async def run():
+            bucket = AsyncTokenBucket(size=2, refillrate=0.2, refillamount=1)
+            await bucket.consume(2)
+            waiting = asyncio.ensure_future(bucket.consume(1, timeout=0.3))
+            behind = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0)
+            past = time.time()
+            # a reservation takes precedence, the waiting consumer would get its token after 0.6 seconds
+            bucket.reserve(2)
+            with self.assertRaises(TimeoutError):
+                await waiting
+            self.assertAlmostEqual(0.3, time.time() - past, places=1)
+            self.assertEqual(len(bucket.waiters), 1)
+            await behind
+            self.assertEqual(len(bucket.waiters), 0)
+            self.assertEqual(bucket.current_filllevel(), 0)
+
+        asyncio.run(run())
+
+    def test_cancelled_waiter(self):
+        async def run():
+            bucket = AsyncTokenBucket(size=1, refillrate=0.1, refillamount=1)
+            await bucket.consume(1)
+            task = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0)
+            task.cancel()
+            await asyncio.sleep(0.15)
+            self.assertEqual(bucket.current_filllevel(), 1)
+
+        asyncio.run(run())
+
+    def test_cancelled_head(self):
+        """
+        the consumers behind a cancelled consumer are served right away, not at the next refill
+        """
+
+        async def run():
+            bucket = AsyncTokenBucket(size=2, refillrate=0.2, refillamount=1)
+            await bucket.consume(2)
+            head = asyncio.ensure_future(bucket.consume(2))
+            behind = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0.25)  # one token refilled, too few for the head
+            self.assertFalse(behind.done())
+            head.cancel()
+            await asyncio.sleep(0.01)
+            self.assertTrue(behind.done())
+            self.assertEqual(len(bucket.waiters), 0)
+
+        asyncio.run(run())
+
+    def test_cancelled_after_grant(self):
+        """
+        tokens granted right before the cancellation are given back, but do not overfill the bucket
+        """
+
+        async def run():
+            clock = VirtualClock()
+            bucket = AsyncTokenBucket(size=1, refillrate=1.0, refillamount=1, clock=clock)
+            await bucket.consume(1)
+            task = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0)
+            clock.advance(1.0)
+            bucket._wakeup()  # grants the token to the waiting consumer
+            clock.advance(1.0)
+            bucket.refill()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(bucket.value, 1)
+
+        asyncio.run(run())
+
+    def test_try_consume(self):
+        async def run():
+            bucket = AsyncTokenBucket(size=2, refillrate=0.1, refillamount=1)
+            self.assertTrue(bucket.try_consume(2))
+            self.assertFalse(bucket.try_consume(1))
+            waiting = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0.15)
+            # a refilled token is not taken from the waiting consumer
+            self.assertTrue(waiting.done())
+            self.assertFalse(bucket.try_consume(1))
+            self.assertRaises(BucketSizeError, bucket.try_consume, 3)
+
+        asyncio.run(run())
+
+    def test_reserve(self):
+        bucket = AsyncTokenBucket(size=2, refillrate=1.0, refillamount=1, clock=VirtualClock())
+        self.assertEqual(bucket.reserve(2), 0.0)
+        self.assertEqual(bucket.reserve(2), 2.0)
+        self.assertEqual(bucket.value, -2)
+        self.assertRaises(BucketSizeError, bucket.reserve, 3)
+
+    def test_initialValue(self):
+        bucket = AsyncTokenBucket(size=2, refillrate=10, refillamount=1, value=0)
+        self.assertEqual(bucket.current_filllevel(), 0)
+        self.assertFalse(bucket.try_consume(1))
+
+    def test_refund(self):
+        async def run():
+            bucket = AsyncTokenBucket(size=2, refillrate=10, refillamount=1)
+            await bucket.consume(2)
+            waiting = asyncio.ensure_future(bucket.consume(1))
+            await asyncio.sleep(0)
+            # the refunded token is handed to the waiting consumer without waiting for the refill
+            bucket.refund(1)
+            await asyncio.sleep(0)
+            self.assertTrue(waiting.done())
+            bucket.refund(5)
+            self.assertEqual(bucket.value, 2)
+
+        asyncio.run(run())
+
+    def test_decorator_on_reject_and_reserve(self):
+        bucket = AsyncTokenBucket(size=1, refillrate=0.1, refillamount=1)
+
+        @withTokenBucket(bucket, on_reject=lambda x: None)
+        async def rejecting(x):
+            return x
+
+        @withTokenBucket(bucket, reserve=True)
+        async def reserving(x):
+            return x
+
+        async def run():
+            self.assertEqual(await rejecting(1), 1)
+            self.assertIsNone(await rejecting(2))
+            past = time.time()
+            self.assertEqual(await reserving(3), 3)
+            self.assertAlmostEqual(0.1, time.time() - past, places=1)
+
+        asyncio.run(run())
+
+    def test_decorator(self):
+        bucket = AsyncTokenBucket(size=1, refillrate=0.1, refillamount=1)
+
+        @withTokenBucket(bucket)
+        async def limited(x):
+            return x * 2
+
+        async def run():
+            past = time.time()
+            self.assertEqual(await limited(1), 2)
+            self.assertEqual(await limited(2), 4)
+            present = time.time()
+            self.assertAlmostEqual(0.1, present - past, places=1)
+
+        self.assertTrue(asyncio.iscoroutinefunction(limited))
+        asyncio.run(run())
@@ -0,0 +1,99 @@
+import time
+from unittest import TestCase, skipIf
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from TokenBucket.TokenBucketBackend import BackendTokenBucket, LocalBackend, RedisBackend
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketCore import consume_state, refill_state, time_to_wait
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from .TestDefaults import *
+
+
+class TestTokenBucketCore(TestCase):
+
+    def test_refill_state(self):
+        self.assertEqual(refill_state(0, 7, 3, 10, 2, 15), (0, 7))
+        self.assertEqual(refill_state(0, 7, 3, 10, 2, 17), (2, 17))
+        self.assertEqual(refill_state(0, 7, 3, 10, 2, 37), (3, 37))
+        self.assertEqual(refill_state(0, 7, 3, 10, 2, 15, force=True), (2, 17))
+
+    def test_time_to_wait(self):
+        self.assertEqual(time_to_wait(3, 0, 5, 3, 3, 1), 0)
+        self.assertEqual(time_to_wait(0, 0, 5, 3, 3, 1), 4)
+        self.assertEqual(time_to_wait(0, 0, 5, 3, 4, 1), 9)
+        self.assertEqual(consume_state(1, 0, 6, 5, 3, 4, 1), (False, 1, 0, 4))
+        self.assertEqual(consume_state(1, 0, 6, 5, 3, 4, 5), (True, 0, 5, 0))
+
+
+class BackendTestMixin(object):
+
+    def create_backend(self):
+        raise NotImplementedError()
+
+    def test_consumeToken(self):
+        bucket = BackendTokenBucket(
+            self.create_backend(),
+            'test',
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT
+        )
+        self.assertEqual(bucket.current_filllevel(), DEFAULT_BUCKET_SIZE)
+        bucket.consumeToken(DEFAULT_BUCKET_SIZE)
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(BucketSizeError, bucket.consumeToken, DEFAULT_BUCKET_SIZE + 1, blocking=False)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=1.0)
+        self.assertEqual(bucket.current_filllevel(), 0)
+
+    def test_consumeTokenTime(self):
+        bucket = BackendTokenBucket(self.create_backend(), 'test', size=2, refillrate=0.2, refillamount=1)
+        bucket.consumeToken(2)
+        past = time.time()
+        bucket.consumeToken(2)
+        present = time.time()
+        self.assertAlmostEqual(0.4, present - past, places=1)
+
+    def test_consume_batch(self):
+        backend = self.create_backend()
+        results = backend.consume_batch([('a', 1), ('b', 2), ('a', 1), ('a', 1)], 2, 10, 1)
+        self.assertEqual([granted for granted, value, time_to_wait in results], [True, True, True, False])
+        self.assertEqual(results[-1][1], 0)
+        self.assertAlmostEqual(results[-1][2], 10, places=1)
+
+
+class TestLocalBackend(BackendTestMixin, TestCase):
+
+    def create_backend(self):
+        return LocalBackend()
+
+
+    def test_clock(self):
+        clock = VirtualClock()
+        bucket = BackendTokenBucket(LocalBackend(clock=clock), 'test', size=2, refillrate=10, refillamount=1)
+        self.assertIs(bucket.clock, clock)
+        bucket.consumeToken(2)
+        # waiting for the refill advances the virtual time instead of sleeping
+        bucket.consumeToken(1)
+        self.assertEqual(clock.time(), 10)
+        clock.advance(5)
+        self.assertEqual(bucket.current_filllevel(), 0)
+        clock.advance(5)
+        self.assertEqual(bucket.current_filllevel(), 1)
+
+
+@skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisBackend(BackendTestMixin, TestCase):
+
+    def create_backend(self):
+        return RedisBackend(fakeredis.FakeRedis())
+
+    def test_expire(self):
+        backend = self.create_backend()
+        backend.consume('a', 2, 0.05, 1, 1)
+        self.assertTrue(backend.client.exists('tokenbucket:a'))
+        time.sleep(0.1)
+        self.assertFalse(backend.client.exists('tokenbucket:a'))
@@ -0,0 +1,90 @@
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketBatch import consume_many
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketMetrics import TokenBucketMetrics
+from .TestBackends import BackendTests, TOKEN_BUCKETS
+
+
+class TestConsumeMany(BackendTests, TestCase):
+
+    def _test_atomic(self, TokenBucket):
+        user = TokenBucket(size=2, refillrate=10, refillamount=2)
+        tenant = TokenBucket(size=5, refillrate=10, refillamount=5)
+        everyone = TokenBucket(size=3, refillrate=10, refillamount=3)
+        self.assertTrue(consume_many([(user, 1), (tenant, 1), (everyone, 1)]))
+        self.assertTrue(consume_many([(everyone, 1), (everyone, 1)], blocking=False))
+        # the global bucket is empty, nothing may be consumed from the others
+        self.assertRaises(TokenAmountError, consume_many, [(user, 1), (tenant, 1), (everyone, 1)], blocking=False)
+        self.assertEqual(user.current_filllevel(), 1)
+        self.assertEqual(tenant.current_filllevel(), 4)
+        self.assertRaises(TimeoutError, consume_many, [(user, 1), (everyone, 1)], timeout=1.0)
+        self.assertRaises(BucketSizeError, consume_many, [(user, 2), (user, 1)], blocking=False)
+
+    def _test_fifo(self, TokenBucket):
+        """
+        a call is queued in turn between the waiting consumers of a FIFO bucket and is not starved by them
+        """
+
+        granted = []
+        metrics = TokenBucketMetrics(on_granted=lambda bucket, token_amount, waited: granted.append(token_amount))
+        bucket = TokenBucket(size=5, refillrate=0.01, refillamount=1, fifo=True, metrics=metrics)
+        other = TokenBucket(size=5, refillrate=10, refillamount=1)
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                bucket.consumeToken(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        batch = threading.Thread(target=consume_many, args=([(bucket, 5), (other, 2)],))
+        try:
+            time.sleep(0.05)
+            batch.start()
+            batch.join(2.0)
+            self.assertFalse(batch.is_alive())
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            batch.join()
+        self.assertIn(5, granted)
+        self.assertEqual(other.current_filllevel(), 3)
+        self.assertFalse(bucket.waiters)
+
+    def _test_metrics(self, TokenBucket):
+        metrics = TokenBucketMetrics()
+        bucket = TokenBucket(size=2, refillrate=10, refillamount=1, metrics=metrics)
+        consume_many([(bucket, 2)])
+        self.assertRaises(TokenAmountError, consume_many, [(bucket, 1)], blocking=False)
+        self.assertRaises(TimeoutError, consume_many, [(bucket, 1)], timeout=1.0)
+        self.assertEqual((metrics.granted, metrics.denied, metrics.timed_out), (1, 1, 1))
+        self.assertEqual(metrics.tokens_granted, 2)
+
+    def test_blocking(self):
+        first = TokenBucket_py.TokenBucket(size=2, refillrate=0.1, refillamount=1)
+        # mixes both implementations, if the Cython one is built
+        second = (TOKEN_BUCKETS['cy'] or TokenBucket_py.TokenBucket)(size=2, refillrate=0.2, refillamount=2)
+        counter = [0]
+
+        def worker(buckets):
+            for _ in range(3):
+                consume_many(buckets)
+                counter[0] += 1
+
+        # opposite request order must not deadlock
+        threads = [threading.Thread(target=worker, args=([(first, 1), (second, 1)],)),
+                   threading.Thread(target=worker, args=([(second, 1), (first, 1)],))]
+        past = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        present = time.time()
+        self.assertEqual(counter[0], 6)
+        self.assertAlmostEqual(0.4, present - past, places=1)
@@ -0,0 +1,56 @@
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket.TokenBucketErrors import TokenAmountError
+from .TestBackends import BackendTests
+
+
+class TestContention(BackendTests, TestCase):
+
+    def _test_no_over_admission(self, TokenBucket):
+        for fifo in (False, True):
+            with self.subTest(fifo=fifo):
+                self._no_over_admission(TokenBucket, fifo)
+
+    def _no_over_admission(self, TokenBucket, fifo):
+        # many threads race for the tokens of a bucket, that does not refill during the test
+        bucket = TokenBucket(size=1000, refillrate=3600, refillamount=1, fifo=fifo)
+        barrier = threading.Barrier(16)
+        granted = []
+
+        def worker():
+            count = 0
+            barrier.wait()
+            while True:
+                try:
+                    bucket.consumeToken(1, blocking=False)
+                except TokenAmountError:
+                    break
+                count += 1
+            granted.append(count)
+
+        workers = [threading.Thread(target=worker) for _ in range(16)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(sum(granted), 1000)
+        self.assertEqual(bucket.current_filllevel(), 0)
+
+    def _test_blocking_rate(self, TokenBucket):
+        for fifo in (False, True):
+            with self.subTest(fifo=fifo):
+                self._blocking_rate(TokenBucket, fifo)
+
+    def _blocking_rate(self, TokenBucket, fifo):
+        # blocked threads must not be granted more tokens than were refilled, 1 token + 20 refills
+        start = time.time()
+        bucket = TokenBucket(size=1, refillrate=0.01, refillamount=1, fifo=fifo)
+        workers = [threading.Thread(target=bucket.consumeToken, args=(1,)) for _ in range(21)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
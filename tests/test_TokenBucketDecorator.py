@@ -0,0 +1,210 @@
+import asyncio
+import inspect
+import time
+from unittest import TestCase, mock
+
+from TokenBucket import TokenBucket_py, TokenBucketDecorator
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import TokenAmountError
+from TokenBucket.TokenBucketKeyed import KeyedTokenBucket
+from .TestBackends import BackendTests
+
+
+class TestWithTokenBucket(BackendTests, TestCase):
+
+    def _test_default(self, TokenBucket):
+        bucket = TokenBucket(size=1, refillrate=0.2, refillamount=1)
+
+        @withTokenBucket(bucket)
+        def limited(value):
+            return value
+
+        self.assertEqual(limited(1), 1)
+        past = time.time()
+        self.assertEqual(limited(2), 2)
+        self.assertAlmostEqual(0.2, time.time() - past, places=1)
+
+    def _test_on_reject(self, TokenBucket):
+        bucket = TokenBucket(size=1, refillrate=10, refillamount=1)
+
+        @withTokenBucket(bucket, on_reject=lambda value: None)
+        def limited(value):
+            return value
+
+        self.assertEqual(limited(1), 1)
+        self.assertIsNone(limited(2))
+
+    def _test_reserve(self, TokenBucket):
+        bucket = TokenBucket(size=1, refillrate=0.2, refillamount=1)
+
+        @withTokenBucket(bucket, reserve=True)
+        async def limited(value):
+            return value
+
+        async def run():
+            ticks = []
+
+            async def ticker():
+                # the event loop must keep running while the reservation is waited for
+                while len(ticks) < 5:
+                    ticks.append(time.time())
+                    await asyncio.sleep(0.01)
+
+            tick = asyncio.ensure_future(ticker())
+            results = [await limited(1), await limited(2)]
+            await tick
+            return results, ticks
+
+        past = time.time()
+        results, ticks = asyncio.run(run())
+        self.assertEqual(results, [1, 2])
+        self.assertAlmostEqual(0.2, time.time() - past, places=1)
+        self.assertLess(ticks[-1] - past, 0.15)
+
+    def _test_blocking_async(self, TokenBucket):
+        bucket = TokenBucket(size=1, refillrate=0.2, refillamount=1)
+
+        @withTokenBucket(bucket)
+        async def limited(value):
+            return value
+
+        async def run():
+            ticks = []
+
+            async def ticker():
+                # the event loop must keep running while the synchronous bucket is waited for
+                while len(ticks) < 5:
+                    ticks.append(time.time())
+                    await asyncio.sleep(0.01)
+
+            tick = asyncio.ensure_future(ticker())
+            results = [await limited(1), await limited(2)]
+            await tick
+            return results, ticks
+
+        past = time.time()
+        results, ticks = asyncio.run(run())
+        self.assertEqual(results, [1, 2])
+        self.assertAlmostEqual(0.2, time.time() - past, places=1)
+        self.assertLess(ticks[-1] - past, 0.15)
+
+    def _test_cost(self, TokenBucket):
+        bucket = TokenBucket(size=10, refillrate=10, refillamount=1)
+
+        @withTokenBucket(bucket, cost=lambda payload: len(payload), on_reject=lambda payload: None)
+        def send(payload):
+            return payload
+
+        self.assertEqual(send(b'123456'), b'123456')
+        self.assertEqual(bucket.current_filllevel(), 4)
+        self.assertIsNone(send(b'123456'))
+        self.assertEqual(send(b'1234'), b'1234')
+        self.assertEqual(bucket.current_filllevel(), 0)
+
+    def _test_generator(self, TokenBucket):
+        bucket = TokenBucket(size=2, refillrate=10, refillamount=1)
+
+        @withTokenBucket(bucket, token_amount=2, on_reject=lambda count: ['rejected'])
+        def generate(count):
+            for i in range(count):
+                yield i
+
+        first = generate(3)
+        self.assertTrue(inspect.isgeneratorfunction(generate))
+        # the tokens are taken by the first iteration, not by the call
+        self.assertEqual(bucket.current_filllevel(), 2)
+        self.assertEqual(list(first), [0, 1, 2])
+        self.assertEqual(bucket.current_filllevel(), 0)
+        self.assertEqual(list(generate(3)), ['rejected'])
+
+    def test_async_generator(self):
+        bucket = TokenBucket_py.TokenBucket(size=1, refillrate=10, refillamount=1)
+
+        @withTokenBucket(bucket, on_reject=lambda count: None)
+        async def generate(count):
+            for i in range(count):
+                yield i
+
+        async def collect():
+            return [[i async for i in generate(2)], [i async for i in generate(2)]]
+
+        self.assertTrue(inspect.isasyncgenfunction(generate))
+        self.assertEqual(asyncio.run(collect()), [[0, 1], []])
+
+    def test_key_keyed(self):
+        store = KeyedTokenBucket(size=1, refillrate=10, refillamount=1)
+
+        @withTokenBucket(store, key=lambda user, request: user, on_reject=lambda user, request: None)
+        def handle(user, request):
+            return request
+
+        self.assertEqual(handle('alice', 1), 1)
+        self.assertEqual(handle('bob', 2), 2)
+        self.assertIsNone(handle('alice', 3))
+        self.assertEqual(store.current_filllevel('alice'), 0)
+        self.assertEqual(store.current_filllevel('carol'), 1)
+        with self.assertRaises(ValueError):
+            withTokenBucket(store, key=lambda user: user, reserve=True)
+
+    def test_key_mapping(self):
+        buckets = {'free': TokenBucket_py.TokenBucket(size=1, refillrate=10, refillamount=1),
+                   'paid': TokenBucket_py.TokenBucket(size=5, refillrate=10, refillamount=1)}
+
+        @withTokenBucket(buckets, key=lambda plan: plan, blocking=False)
+        def handle(plan):
+            return plan
+
+        self.assertEqual([handle('paid') for _ in range(5)], ['paid'] * 5)
+        self.assertEqual(handle('free'), 'free')
+        with self.assertRaises(TokenAmountError):
+            handle('free')
+
+    def test_fast(self):
+        buckets = [TokenBucket_py.TokenBucket(size=1, refillrate=10, refillamount=1)]
+        users = []
+
+        def key(user):
+            users.append(user)
+            return 0
+
+        class Client(object):
+            @withTokenBucket(buckets, key=lambda client, user: key(user), on_reject=lambda client, user: client)
+            def wrapt_method(self, user):
+                return user
+
+            @withTokenBucket(buckets, key=lambda client, user: key(user), on_reject=lambda client, user: client,
+                             fast=True)
+            def fast_method(self, user):
+                return user
+
+        client = Client()
+        # with and without wrapt, self is passed to key and on_reject like any other argument
+        self.assertEqual(client.wrapt_method('alice'), 'alice')
+        self.assertIs(client.wrapt_method('bob'), client)
+        buckets[0].refill(force=True)
+        self.assertEqual(client.fast_method('carol'), 'carol')
+        self.assertIs(client.fast_method('dave'), client)
+        self.assertEqual(users, ['alice', 'bob', 'carol', 'dave'])
+        self.assertIsInstance(Client.__dict__['wrapt_method'], TokenBucketDecorator.wrapt.FunctionWrapper)
+        self.assertEqual(Client.fast_method.__name__, 'fast_method')
+        self.assertNotIsInstance(Client.__dict__['fast_method'], TokenBucketDecorator.wrapt.FunctionWrapper)
+
+    def test_without_wrapt(self):
+        with mock.patch.object(TokenBucketDecorator, 'wrapt', None):
+            bucket = TokenBucket_py.TokenBucket(size=2, refillrate=10, refillamount=1)
+
+            @withTokenBucket(bucket, on_reject=lambda value: None)
+            def limited(value):
+                """limited"""
+                return value
+
+            @withTokenBucket(bucket, on_reject=lambda value: None)
+            async def limited_async(value):
+                return value
+
+        self.assertEqual(limited.__name__, 'limited')
+        self.assertEqual(limited.__doc__, 'limited')
+        self.assertTrue(asyncio.iscoroutinefunction(limited_async))
+        self.assertEqual(limited(1), 1)
+        self.assertEqual(asyncio.run(limited_async(2)), 2)
+        self.assertIsNone(limited(3))
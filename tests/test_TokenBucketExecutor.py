@@ -0,0 +1,140 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketAsync import AsyncTokenBucket
+from TokenBucket.TokenBucketErrors import BucketSizeError, QueueFullError
+from TokenBucket.TokenBucketExecutor import AsyncRateLimitedExecutor, RateLimitedExecutor
+from .TestBackends import BackendTests
+
+
+class TestRateLimitedExecutor(BackendTests, TestCase):
+
+    def _test_rate(self, TokenBucket):
+        bucket = TokenBucket(size=1, refillrate=0.05, refillamount=1)
+        past = time.monotonic()
+        with RateLimitedExecutor(bucket, max_workers=4) as executor:
+            futures = [executor.submit(time.monotonic) for _ in range(5)]
+        started = [future.result() - past for future in futures]
+        self.assertEqual(started, sorted(started))
+        self.assertAlmostEqual(0.2, started[-1], places=1)
+
+    def _test_priority(self, TokenBucket):
+        bucket = TokenBucket(size=100, refillrate=10, refillamount=100)
+        gate = threading.Event()
+        running = threading.Event()
+        order = []
+
+        def block():
+            running.set()
+            gate.wait()
+
+        with RateLimitedExecutor(bucket, max_workers=1, max_queue=3, costs={order.append: 10}) as executor:
+            executor.submit(block)
+            running.wait()
+            # the only worker is busy, the following callables are queued
+            executor.submit(order.append, 'low')
+            executor.submit_with(order.append, ('high',), priority=5)
+            executor.submit_with(order.append, ('normal',), priority=1)
+            self.assertEqual(executor.queue_depth, 3)
+            self.assertRaises(QueueFullError, executor.submit_with, order.append, ('full',), block=False)
+            self.assertRaises(QueueFullError, executor.submit_with, order.append, ('full',), timeout=0.05)
+            gate.set()
+        self.assertEqual(order, ['high', 'normal', 'low'])
+        self.assertEqual(bucket.current_filllevel(), 69)
+
+    def test_errors_and_cancel(self):
+        bucket = TokenBucket_py.TokenBucket(size=1, refillrate=0.2, refillamount=1)
+        executor = RateLimitedExecutor(bucket, max_workers=1)
+        self.assertRaises(BucketSizeError, executor.submit_with(len, ((),), cost=2).result)
+        self.assertRaises(ZeroDivisionError, executor.submit(lambda: 1 / 0).result)
+        # the bucket is empty, the queued callables, that the dispatcher does not wait for, are cancelled
+        futures = [executor.submit(len, ()) for _ in range(3)]
+        executor.shutdown(cancel_futures=True)
+        self.assertTrue(all(future.cancelled() for future in futures[1:]))
+        self.assertRaises(RuntimeError, executor.submit, len, ())
+
+    def test_async(self):
+        async def run():
+            past = time.monotonic()
+            async with AsyncRateLimitedExecutor(AsyncTokenBucket(size=1, refillrate=0.05, refillamount=1),
+                                                max_concurrency=2) as executor:
+                async def job(value):
+                    await asyncio.sleep(0.01)
+                    return value, time.monotonic() - past
+
+                futures = [await executor.submit(job, i) for i in range(5)]
+                results = await asyncio.gather(*futures)
+            self.assertEqual([value for value, _ in results], list(range(5)))
+            self.assertAlmostEqual(0.2, results[-1][1], places=1)
+
+            # a synchronous bucket is waited for by reservations, without blocking the event loop
+            bucket = TokenBucket_py.TokenBucket(size=1, refillrate=0.05, refillamount=1)
+            executor = AsyncRateLimitedExecutor(bucket, max_concurrency=1, max_queue=1)
+            gate = asyncio.Event()
+            running = await executor.submit(gate.wait)
+            while executor.queue_depth:
+                await asyncio.sleep(0)
+            futures = [await executor.submit(time.monotonic)]
+            with self.assertRaises(QueueFullError):
+                await executor.submit_with(time.monotonic, block=False)
+            gate.set()
+            futures.append(await executor.submit_with(time.monotonic, priority=1))
+            await executor.shutdown()
+            self.assertTrue(running.done())
+            self.assertAlmostEqual(0.05, futures[1].result() - futures[0].result(), places=1)
+
+        asyncio.run(run())
+
+    def test_async_cancelled_while_waiting(self):
+        """
+        the tokens of a callable, that was cancelled while its tokens were waited for, are given back
+        """
+
+        async def run(bucket):
+            executor = AsyncRateLimitedExecutor(bucket)
+            await executor.submit(len, ())
+            waiting = await executor.submit(len, ())
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            await executor.shutdown()
+            return bucket.current_filllevel()
+
+        for bucket in (AsyncTokenBucket(size=1, refillrate=0.1, refillamount=1),
+                       TokenBucket_py.TokenBucket(size=1, refillrate=0.1, refillamount=1)):
+            self.assertEqual(asyncio.run(run(bucket)), 1)
+
+    def test_async_loop_closed(self):
+        """
+        no future stays pending, if the dispatcher and the calls are cancelled with the event loop
+        """
+
+        async def run():
+            executor = AsyncRateLimitedExecutor(AsyncTokenBucket(size=1, refillrate=10, refillamount=1))
+            futures = [await executor.submit(asyncio.sleep, 10) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            return futures
+
+        running, waiting, queued = asyncio.run(run())
+        self.assertTrue(running.cancelled())
+        self.assertTrue(waiting.cancelled())
+        self.assertTrue(queued.cancelled())
+
+    def test_cancelled_while_waiting(self):
+        bucket = TokenBucket_py.TokenBucket(size=1, refillrate=0.1, refillamount=1)
+        executor = RateLimitedExecutor(bucket, max_workers=1)
+        executor.submit(len, ()).result()
+        waiting = executor.submit(len, ())
+        time.sleep(0.01)
+        waiting.cancel()
+        executor.shutdown()
+        self.assertEqual(bucket.current_filllevel(), 1)
+
+    def test_executor_interface(self):
+        bucket = TokenBucket_py.TokenBucket(size=10, refillrate=1, refillamount=10)
+        with RateLimitedExecutor(bucket) as executor:
+            self.assertIsInstance(executor, concurrent.futures.Executor)
+            self.assertEqual(list(executor.map(abs, [-1, -2, -3])), [1, 2, 3])
@@ -0,0 +1,77 @@
+import threading
+from unittest import TestCase
+
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketHierarchy import HierarchicalTokenBucket
+
+
+class TestHierarchicalTokenBucket(TestCase):
+
+    def test_nested_limits(self):
+        root = HierarchicalTokenBucket(size=5, refillrate=10, refillamount=5)
+        tenant = root.child(size=4, refillrate=10, refillamount=4, borrow=False)
+        user = tenant.child(size=3, refillrate=10, refillamount=3, borrow=False)
+        self.assertTrue(user.try_consume(3))
+        self.assertEqual((root.current_filllevel(), tenant.current_filllevel(), user.current_filllevel()), (2, 1, 0))
+        self.assertFalse(user.try_consume(1))
+        self.assertTrue(tenant.try_consume(1))
+        # the tenant is empty, nothing may be consumed from the root
+        self.assertRaises(TokenAmountError, tenant.consumeToken, 1, blocking=False)
+        self.assertEqual(root.current_filllevel(), 1)
+        self.assertRaises(TimeoutError, user.consumeToken, 1, timeout=1.0)
+        self.assertRaises(BucketSizeError, user.consumeToken, 4)
+
+    def test_borrowing(self):
+        clock = VirtualClock()
+        root = HierarchicalTokenBucket(size=12, refillrate=1.0, refillamount=12, clock=clock)
+        hot = root.child(size=4, refillrate=1.0, refillamount=4)
+        idle = root.child(size=4, refillrate=1.0, refillamount=4)
+        # the idle tenant keeps its 4 tokens, the hot one may use its own 4 and the 4 spare tokens of the root
+        self.assertTrue(hot.try_consume(6))
+        self.assertTrue(hot.try_consume(2))
+        self.assertFalse(hot.try_consume(1))
+        self.assertTrue(idle.try_consume(4))
+        self.assertEqual(root.current_filllevel(), 0)
+        # blocking waits for the next refill
+        hot.consumeToken(8)
+        self.assertEqual(clock.time(), 1.0)
+
+    def test_weighted_borrowing(self):
+        clock = VirtualClock()
+        root = HierarchicalTokenBucket(size=100, refillrate=1.0, refillamount=100, clock=clock)
+        heavy = root.child(size=10, refillrate=1.0, refillamount=10, weight=3)
+        light = root.child(size=10, refillrate=1.0, refillamount=10, weight=1)
+        # the only borrower may take all spare tokens
+        self.assertTrue(heavy.try_consume(11))
+        self.assertTrue(light.try_consume(10))
+        # both borrow within the refill interval, each borrow takes at most its share of the 79 spare tokens
+        self.assertTrue(light.try_consume(20))
+        self.assertFalse(light.try_consume(20))
+        self.assertTrue(heavy.try_consume(45))
+        self.assertFalse(heavy.try_consume(12))
+        clock.advance(1.0)
+        # the borrowers are not active anymore after the refill interval of the parent
+        self.assertTrue(light.try_consume(10))
+        # the own tokens of heavy are not spare
+        self.assertFalse(light.try_consume(81))
+        self.assertTrue(light.try_consume(80))
+        self.assertTrue(heavy.try_consume(10))
+
+    def test_threads(self):
+        root = HierarchicalTokenBucket(size=100, refillrate=3600, refillamount=1)
+        tenants = [root.child(size=40, refillrate=3600, refillamount=1) for _ in range(4)]
+        granted = []
+
+        def worker(tenant):
+            count = 0
+            while tenant.try_consume(1):
+                count += 1
+            granted.append(count)
+
+        workers = [threading.Thread(target=worker, args=(tenant,)) for tenant in tenants]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(sum(granted), 100)
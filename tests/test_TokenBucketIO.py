@@ -0,0 +1,203 @@
+import asyncio
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketAsync import AsyncTokenBucket
+from TokenBucket.TokenBucketHierarchy import HierarchicalTokenBucket
+from TokenBucket.TokenBucketIO import ThrottledFile, ThrottledSocket, ThrottledStreamReader, ThrottledStreamWriter
+from TokenBucket.TokenBucketLease import LeasedTokenBucket
+from TokenBucket.TokenBucketMetrics import TokenBucketMetrics
+from .TestBackends import BackendTests
+
+
+class CountingWriter(io.RawIOBase):
+    """records the size of every write"""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.writes.append(len(b))
+        self.data += b
+        return len(b)
+
+
+class BlockingWriter(io.RawIOBase):
+    """a non-blocking file, whose writes would block"""
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return None
+
+
+class TestThrottledIO(BackendTests, TestCase):
+
+    def _test_file_large_buffer(self, TokenBucket):
+        bucket = TokenBucket(size=1000, refillrate=0.05, refillamount=1000)
+        raw = CountingWriter()
+        data = os.urandom(2500)
+        past = time.time()
+        # a buffer larger than the bucket is written in pieces, no BucketSizeError
+        self.assertEqual(ThrottledFile(raw, bucket).write(data), 2500)
+        self.assertAlmostEqual(0.1, time.time() - past, places=1)
+        self.assertEqual(bytes(raw.data), data)
+        self.assertEqual(raw.writes, [1000, 1000, 500])
+
+    def _test_file_tokens(self, TokenBucket):
+        """
+        a write takes only the tokens for its bytes, no tokens are held between operations
+        """
+
+        bucket = TokenBucket(size=1000, refillrate=10, refillamount=1000)
+        throttled = ThrottledFile(CountingWriter(), bucket, chunk_size=100)
+        for _ in range(20):
+            throttled.write(b'0123456789')
+        self.assertEqual(bucket.current_filllevel(), 800)
+        throttled.write(b'01234')
+        self.assertEqual(bucket.current_filllevel(), 795)
+
+    def _test_file_short_read(self, TokenBucket):
+        """
+        the tokens of bytes, that were not read, are given back right away
+        """
+
+        metrics = TokenBucketMetrics()
+        bucket = metrics.attach(TokenBucket(size=1000, refillrate=10, refillamount=1000))
+        throttled = ThrottledFile(io.BytesIO(b'0123456789'), bucket)
+        self.assertEqual(throttled.read(100), b'0123456789')
+        self.assertEqual(bucket.current_filllevel(), 990)
+        self.assertEqual(throttled.read(100), b'')
+        self.assertEqual(bucket.current_filllevel(), 990)
+        self.assertEqual(metrics.tokens_refunded, 190)
+
+    def _test_file_would_block(self, TokenBucket):
+        bucket = TokenBucket(size=1000, refillrate=10, refillamount=1000)
+        # no busy loop, the tokens are given back and None is returned like the wrapped file does
+        self.assertIsNone(ThrottledFile(BlockingWriter(), bucket).write(b'0123456789'))
+        self.assertEqual(bucket.current_filllevel(), 1000)
+
+    def _test_file_leased(self, TokenBucket):
+        authority = TokenBucket(size=1000, refillrate=10, refillamount=1000)
+        bucket = LeasedTokenBucket(authority, lease_size=100)
+        throttled = ThrottledFile(CountingWriter(), bucket)
+        self.assertEqual(throttled.write(b'0123456789'), 10)
+        self.assertEqual(bucket.current_filllevel(), 990)
+        self.assertEqual(authority.current_filllevel(), 900)
+
+    def _test_file_read(self, TokenBucket):
+        data = os.urandom(3000)
+        with tempfile.TemporaryFile() as file:
+            file.write(data)
+            file.seek(0)
+            bucket = TokenBucket(size=1024, refillrate=0.02, refillamount=1024)
+            throttled = ThrottledFile(file, bucket, chunk_size=512)
+            buffer = bytearray(2048)
+            # only the bucket size may be read at once
+            self.assertEqual(throttled.readinto(buffer), 1024)
+            self.assertEqual(bytes(buffer[:1024]), data[:1024])
+            self.assertEqual(throttled.read(), data[1024:])
+            self.assertEqual(throttled.read(10), b'')
+
+    def _test_socket(self, TokenBucket):
+        left, right = socket.socketpair()
+        received = bytearray()
+
+        def receive():
+            with ThrottledSocket(right, TokenBucket(size=4096, refillrate=0.01, refillamount=4096)) as throttled:
+                while True:
+                    chunk = throttled.recv(65536)
+                    if not chunk:
+                        return
+                    received.extend(chunk)
+
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        data = os.urandom(20000)
+        bucket = TokenBucket(size=8192, refillrate=0.05, refillamount=8192)
+        past = time.time()
+        with ThrottledSocket(left, bucket) as throttled:
+            throttled.sendall(data)
+        receiver.join()
+        self.assertEqual(bytes(received), data)
+        self.assertAlmostEqual(0.1, time.time() - past, places=1)
+
+    def _test_sendfile(self, TokenBucket):
+        left, right = socket.socketpair()
+        data = os.urandom(5000)
+        with tempfile.TemporaryFile() as file:
+            file.write(data)
+            file.flush()
+            bucket = TokenBucket(size=2000, refillrate=0.05, refillamount=2000)
+            past = time.time()
+            with ThrottledSocket(left, bucket) as throttled:
+                self.assertEqual(throttled.sendfile(file, offset=1000), 4000)
+            self.assertAlmostEqual(0.1, time.time() - past, places=1)
+        received = bytearray()
+        while True:
+            chunk = right.recv(65536)
+            if not chunk:
+                break
+            received.extend(chunk)
+        right.close()
+        self.assertEqual(bytes(received), data[1000:])
+
+    def test_file_hierarchy(self):
+        root = HierarchicalTokenBucket(size=100, refillrate=0.05, refillamount=100)
+        child = root.child(size=1000, refillrate=10, refillamount=1000, borrow=False)
+        raw = CountingWriter()
+        past = time.time()
+        # the child has the tokens, but the root limits the write
+        self.assertEqual(ThrottledFile(raw, child).write(os.urandom(250)), 250)
+        self.assertAlmostEqual(0.1, time.time() - past, places=1)
+        self.assertEqual(raw.writes, [100, 100, 50])
+        self.assertEqual(root.current_filllevel(), 50)
+
+    def test_stream_incomplete_read(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'0123456789')
+            reader.feed_eof()
+            bucket = TokenBucket_py.TokenBucket(size=1000, refillrate=10, refillamount=1000)
+            with self.assertRaises(asyncio.IncompleteReadError) as context:
+                await ThrottledStreamReader(reader, bucket).readexactly(100)
+            return context.exception, bucket.current_filllevel()
+
+        error, filllevel = asyncio.run(run())
+        self.assertEqual(error.partial, b'0123456789')
+        self.assertEqual(filllevel, 990)
+
+    def test_streams(self):
+        data = os.urandom(3000)
+
+        async def run():
+            left, right = socket.socketpair()
+            reader, right_writer = await asyncio.open_connection(sock=right)
+            _, writer = await asyncio.open_connection(sock=left)
+            throttled_writer = ThrottledStreamWriter(writer, AsyncTokenBucket(size=1000, refillrate=0.05,
+                                                                              refillamount=1000))
+            throttled_reader = ThrottledStreamReader(reader, TokenBucket_py.TokenBucket(size=1500, refillrate=0.01,
+                                                                                         refillamount=1500))
+            past = time.time()
+            await throttled_writer.write(data)
+            duration = time.time() - past
+            throttled_writer.close()
+            received = await throttled_reader.read()
+            right_writer.close()
+            return received, duration
+
+        received, duration = asyncio.run(run())
+        self.assertEqual(received, data)
+        self.assertAlmostEqual(0.1, duration, places=1)
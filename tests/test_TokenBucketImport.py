@@ -0,0 +1,100 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+import TokenBucket
+from .TestBackends import requires_cython
+
+
+class TestLazyImport(TestCase):
+
+    def _run(self, code, backend=None):
+        """
+        runs code in a fresh interpreter, so no module is imported already
+
+        :return: the stripped output of the code
+        """
+
+        env = dict(os.environ)
+        env.pop('TOKENBUCKET_BACKEND', None)
+        if backend is not None:
+            env['TOKENBUCKET_BACKEND'] = backend
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.strip()
+
+    def test_import(self):
+        """
+        importing the package loads no submodule and not wrapt
+        """
+
+        output = self._run("import sys, TokenBucket\n"
+                           "print(sorted(m for m in sys.modules if m.startswith('TokenBucket.') or m == 'wrapt'))")
+        self.assertEqual(output, '[]')
+
+    def test_access(self):
+        """
+        accessing an export loads only its module
+        """
+
+        output = self._run("import sys, TokenBucket\n"
+                           "TokenBucket.VirtualClock\n"
+                           "print(sorted(m for m in sys.modules if m.startswith('TokenBucket.')))")
+        self.assertEqual(output, "['TokenBucket.TokenBucketClock']")
+
+    def test_submodules(self):
+        """
+        the decorator and the snapshots resolve the buckets on use, not on import
+        """
+
+        output = self._run("import sys, TokenBucket.TokenBucketDecorator, TokenBucket.TokenBucketSnapshot\n"
+                           "print(sorted(m for m in sys.modules if m.startswith('TokenBucket.')))")
+        self.assertEqual(output, "['TokenBucket.TokenBucketCore', 'TokenBucket.TokenBucketDecorator', "
+                                 "'TokenBucket.TokenBucketErrors', 'TokenBucket.TokenBucketSnapshot']")
+
+    def test_backend_python(self):
+        output = self._run("import TokenBucket\n"
+                           "print(TokenBucket.BACKEND, TokenBucket.TokenBucket.__module__, "
+                           "TokenBucket.SlidingWindowLimiter.__module__, TokenBucket.LeakyBucket.__module__)",
+                           backend='python')
+        self.assertEqual(output, 'python TokenBucket.TokenBucket_py TokenBucket.SlidingWindow_py '
+                                 'TokenBucket.LeakyBucket_py')
+
+    @requires_cython
+    def test_backend_cython(self):
+        output = self._run("import TokenBucket\n"
+                           "print(TokenBucket.BACKEND, TokenBucket.TokenBucket.__module__, "
+                           "TokenBucket.SlidingWindowLimiter.__module__, TokenBucket.LeakyBucket.__module__)",
+                           backend='cython')
+        self.assertEqual(output, 'cython TokenBucket.TokenBucket_cy TokenBucket.SlidingWindow_cy '
+                                 'TokenBucket.LeakyBucket_cy')
+
+    def test_backend_fallback(self):
+        """
+        without the compiled modules, the Python backend is selected
+        """
+
+        output = self._run("import sys\n"
+                           "sys.modules['TokenBucket.TokenBucket_cy'] = None\n"
+                           "import TokenBucket\n"
+                           "print(TokenBucket.BACKEND, TokenBucket.TokenBucket.__module__)")
+        self.assertEqual(output, 'python TokenBucket.TokenBucket_py')
+
+    def test_backend_invalid(self):
+        output = self._run("import TokenBucket\n"
+                           "try:\n"
+                           "    TokenBucket.BACKEND\n"
+                           "except ValueError:\n"
+                           "    print('ValueError')", backend='fortran')
+        self.assertEqual(output, 'ValueError')
+
+    def test_exports(self):
+        for name in TokenBucket.__all__:
+            self.assertIsNotNone(getattr(TokenBucket, name), name)
+        self.assertIn(TokenBucket.BACKEND, TokenBucket.BACKENDS)
+        self.assertTrue(set(TokenBucket.__all__) <= set(dir(TokenBucket)))
+        with self.assertRaises(AttributeError):
+            getattr(TokenBucket, 'NoSuchExport')
@@ -0,0 +1,75 @@
+import time
+from unittest import TestCase
+
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketKeyed import KeyedTokenBucket
+from .TestDefaults import *
+
+
+class TestKeyedTokenBucket(TestCase):
+
+    def test_consumeToken(self):
+        buckets = KeyedTokenBucket(
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT
+        )
+        buckets.consumeToken('a', DEFAULT_BUCKET_SIZE)
+        self.assertRaises(TokenAmountError, buckets.consumeToken, 'a', 1, blocking=False)
+        self.assertRaises(BucketSizeError, buckets.consumeToken, 'a', DEFAULT_BUCKET_SIZE + 1, blocking=False)
+        self.assertRaises(TimeoutError, buckets.consumeToken, 'a', 1, timeout=1.0)
+        # other keys are independent
+        buckets.consumeToken('b', DEFAULT_BUCKET_SIZE)
+        self.assertEqual(buckets.current_filllevel('a'), 0)
+        self.assertEqual(buckets.current_filllevel('c'), DEFAULT_BUCKET_SIZE)
+        self.assertEqual(len(buckets), 2)
+        self.assertNotIn('c', buckets)
+
+    def test_consumeTokenTime(self):
+        buckets = KeyedTokenBucket(size=2, refillrate=0.2, refillamount=1)
+        buckets.consumeToken('a', 2)
+        past = time.time()
+        buckets.consumeToken('a', 2)
+        present = time.time()
+        self.assertAlmostEqual(0.4, present - past, places=1)
+
+    def test_evict(self):
+        buckets = KeyedTokenBucket(size=2, refillrate=0.1, refillamount=1)
+        now = time.monotonic()
+        buckets.consumeToken('a', 2)
+        buckets.consumeToken('b', 1)
+        self.assertEqual(buckets.evict(now + 0.1), 0)
+        # both buckets are refilled to full after 0.2 seconds, evicting them is lossless
+        self.assertEqual(buckets.evict(now + 0.25), 2)
+        self.assertEqual(len(buckets), 0)
+        self.assertEqual(buckets.current_filllevel('a'), 2)
+        # freed slots are reused
+        buckets.consumeToken('c', 1)
+        self.assertEqual(len(buckets.values), 2)
+
+    def test_ttl_and_max_keys(self):
+        buckets = KeyedTokenBucket(size=10, refillrate=10, refillamount=1, ttl=0.05, max_keys=2)
+        buckets.consumeToken('a', 5)
+        buckets.consumeToken('b', 5)
+        buckets.consumeToken('a', 1)
+        buckets.consumeToken('c', 1)  # evicts the least recently used key 'b'
+        self.assertEqual(sorted(buckets.slots), ['a', 'c'])
+        time.sleep(0.06)
+        self.assertEqual(buckets.evict(), 2)
+
+    def test_consume_batch(self):
+        buckets = KeyedTokenBucket(size=2, refillrate=10, refillamount=1)
+        self.assertEqual(buckets.consume_batch(['a', 'b', 'a', 'a', 'b']), [True, True, True, False, True])
+        self.assertEqual(buckets.consume_batch(['c', 'c', 'd'], [2, 1, 2]), [True, False, True])
+        self.assertEqual(buckets.current_filllevel('d'), 0)
+        # like consumeToken(blocking=False), an amount larger than the bucket raises, nothing is consumed then
+        self.assertRaises(BucketSizeError, buckets.consume_batch, ['e', 'f'], [1, 3])
+        self.assertEqual(buckets.current_filllevel('e'), 2)
+
+    def test_try_consume(self):
+        buckets = KeyedTokenBucket(size=2, refillrate=10, refillamount=1)
+        self.assertTrue(buckets.try_consume('a', 2))
+        self.assertFalse(buckets.try_consume('a'))
+        self.assertTrue(buckets.try_consume('b'))
+        self.assertEqual(buckets.current_filllevel('a'), 0)
+        self.assertRaises(BucketSizeError, buckets.try_consume, 'a', 3)
@@ -0,0 +1,130 @@
+import threading
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketBackend import BackendTokenBucket, LocalBackend
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketLease import LeasedTokenBucket
+from TokenBucket.TokenBucketMetrics import TokenBucketMetrics
+from .TestBackends import BackendTests
+
+
+class TestLeasedTokenBucket(BackendTests, TestCase):
+
+    def _test_lease(self, TokenBucket):
+        authority = TokenBucket(size=100, refillrate=10, refillamount=1)
+        bucket = LeasedTokenBucket(authority, lease_size=10)
+        for _ in range(25):
+            bucket.consumeToken(1)
+        self.assertEqual(bucket.fetches, 3)
+        self.assertEqual(authority.current_filllevel(), 70)
+        self.assertEqual(bucket.current_filllevel(), 75)
+        bucket.release()
+        self.assertEqual(authority.current_filllevel(), 75)
+        self.assertRaises(BucketSizeError, bucket.consumeToken, 101)
+
+    def _test_refund(self, TokenBucket):
+        """
+        unused tokens are given back through the authority, so its metrics count them
+        """
+
+        metrics = TokenBucketMetrics()
+        authority = metrics.attach(TokenBucket(size=10, refillrate=10, refillamount=1, fifo=True))
+        bucket = LeasedTokenBucket(authority, lease_size=5)
+        bucket.consumeToken(1)
+        bucket.release()
+        self.assertEqual(authority.current_filllevel(), 9)
+        self.assertEqual(metrics.tokens_refunded, 4)
+
+    def _test_virtual_clock(self, TokenBucket):
+        clock = VirtualClock()
+        authority = TokenBucket(size=10, refillrate=10, refillamount=1, clock=clock)
+        bucket = LeasedTokenBucket(authority, lease_size=5, max_staleness=1.0)
+        bucket.consumeToken(1)
+        clock.advance(0.5)
+        bucket.consumeToken(1)
+        self.assertEqual(bucket.fetches, 1)
+        clock.advance(0.5)
+        self.assertEqual(bucket.current_filllevel(), 5)  # the lease expired
+        bucket.consumeToken(1)
+        self.assertEqual(bucket.fetches, 2)
+        self.assertEqual(authority.current_filllevel(), 3)
+
+    def test_backend_clock(self):
+        """
+        the clock of a BackendTokenBucket is used for the expiry, or the given one
+        """
+
+        clock = VirtualClock()
+        authority = BackendTokenBucket(LocalBackend(clock=clock), 'lease', size=10, refillrate=10, refillamount=1)
+        bucket = LeasedTokenBucket(authority, lease_size=5)
+        bucket.consumeToken(1)
+        clock.advance(1.0)
+        self.assertEqual(bucket.current_filllevel(), 5)  # the lease expired, a backend has no refund
+        other = VirtualClock()
+        self.assertIs(LeasedTokenBucket(authority, lease_size=5, clock=other).clock, other)
+
+    def test_wait_unlocked(self):
+        """
+        a consume waiting for the authority does not hold the lock of the lease
+        """
+
+        entered = threading.Event()
+        gate = threading.Event()
+
+        class GatedTokenBucket(TokenBucket_py.TokenBucket):
+            def consumeToken(self, token_amount, blocking=True, timeout=None):
+                if blocking:
+                    entered.set()
+                    gate.wait(5.0)
+                return super(GatedTokenBucket, self).consumeToken(token_amount, blocking, timeout)
+
+        authority = GatedTokenBucket(size=10, refillrate=0.01, refillamount=1, value=3)
+        authority.consumeToken(3, blocking=False)
+        bucket = LeasedTokenBucket(authority, lease_size=5)
+        thread = threading.Thread(target=bucket.consumeToken, args=(1,))
+        thread.start()
+        self.assertTrue(entered.wait(5.0))
+        started = time.monotonic()
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 5, blocking=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        gate.set()
+        thread.join()
+        self.assertEqual(bucket.fetches, 2)
+
+    def test_exhausted_authority(self):
+        authority = TokenBucket_py.TokenBucket(size=15, refillrate=10, refillamount=1)
+        bucket = LeasedTokenBucket(authority, lease_size=10)
+        bucket.consumeToken(1)
+        bucket.consumeToken(12)  # lease holds 9, the authority can only give the missing 3 tokens
+        self.assertEqual(authority.current_filllevel(), 2)
+        bucket.consumeToken(2)
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=1.0)
+
+    def test_expiry(self):
+        authority = TokenBucket_py.TokenBucket(size=10, refillrate=10, refillamount=1)
+        bucket = LeasedTokenBucket(authority, lease_size=5, max_staleness=0.05)
+        bucket.consumeToken(1)
+        self.assertEqual(authority.current_filllevel(), 5)
+        time.sleep(0.06)
+        bucket.consumeToken(1)  # expired lease returns its 4 tokens, then a new lease is fetched
+        self.assertEqual(authority.current_filllevel(), 4)
+        self.assertEqual(bucket.fetches, 2)
+
+    def test_per_thread(self):
+        authority = TokenBucket_py.TokenBucket(size=100, refillrate=10, refillamount=1)
+        bucket = LeasedTokenBucket(authority, lease_size=10, per_thread=True)
+
+        def worker():
+            for _ in range(5):
+                bucket.consumeToken(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(authority.current_filllevel(), 60)
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketBackend import BackendTokenBucket, LocalBackend
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketMetrics import TokenBucketMetrics, prometheus_text
+from .TestBackends import BackendTests
+
+
+class TestTokenBucketMetrics(BackendTests, TestCase):
+
+    def _test_counters(self, TokenBucket):
+        for fifo in (False, True):
+            with self.subTest(fifo=fifo):
+                self._counters(TokenBucket, fifo)
+
+    def _counters(self, TokenBucket, fifo):
+        denied = []
+        metrics = TokenBucketMetrics(on_denied=lambda bucket, amount, seconds: denied.append((amount, seconds)))
+        bucket = TokenBucket(size=2, refillrate=1.0, refillamount=1, fifo=fifo, clock=VirtualClock(),
+                             metrics=metrics)
+        self.assertIs(bucket.metrics, metrics)
+        bucket.consumeToken(2)
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 2, timeout=1.5)
+        bucket.consumeToken(2)  # waits 2 seconds of virtual time
+        self.assertEqual((metrics.granted, metrics.denied, metrics.timed_out), (2, 1, 1))
+        self.assertEqual(metrics.tokens_granted, 4)
+        self.assertEqual(metrics.wait_sum, 2.0)
+        self.assertEqual(metrics.wait_counts[0], 1)
+        self.assertEqual(metrics.wait_counts[-3], 1)  # 1.0 < 2.0 <= 5.0
+        self.assertEqual(denied, [(1, 1.0)])
+        self.assertEqual(metrics.fill_level(), 0)
+
+    def _test_disabled(self, TokenBucket):
+        self.assertIsNone(TokenBucket(size=1, refillrate=1.0, refillamount=1).metrics)
+
+    def test_decorator(self):
+        metrics = TokenBucketMetrics()
+        bucket = BackendTokenBucket(LocalBackend(), 'key', size=1, refillrate=10, refillamount=1)
+
+        @withTokenBucket(bucket, blocking=False, metrics=metrics)
+        def limited():
+            return True
+
+        self.assertTrue(limited())
+        self.assertRaises(TokenAmountError, limited)
+        self.assertEqual((metrics.granted, metrics.denied, metrics.timed_out), (1, 1, 0))
+
+    def test_prometheus_text(self):
+        metrics = TokenBucketMetrics(labels={'bucket': 'api'}, wait_buckets=(0.1, 1.0))
+        bucket = TokenBucket_py.TokenBucket(size=3, refillrate=1.0, refillamount=1, metrics=metrics)
+        bucket.consumeToken(2)
+        bucket.refund(1)
+        text = prometheus_text([metrics])
+        self.assertIn('# TYPE tokenbucket_consumes_total counter\n', text)
+        self.assertIn('tokenbucket_consumes_total{bucket="api",result="granted"} 1\n', text)
+        self.assertIn('tokenbucket_tokens_consumed_total{bucket="api"} 2\n', text)
+        self.assertIn('tokenbucket_tokens_refunded_total{bucket="api"} 1\n', text)
+        self.assertIn('tokenbucket_wait_seconds_bucket{bucket="api",le="0.1"} 1\n', text)
+        self.assertIn('tokenbucket_wait_seconds_bucket{bucket="api",le="+Inf"} 1\n', text)
+        self.assertIn('tokenbucket_wait_seconds_count{bucket="api"} 1\n', text)
+        self.assertIn('tokenbucket_fill_level{bucket="api"} ', text)
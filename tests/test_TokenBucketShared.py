@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketBatch import consume_many
+from TokenBucket.TokenBucketDecorator import withTokenBucket
+from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
+from TokenBucket.TokenBucketShared import SharedTokenBucket
+from .TestDefaults import *
+
+
+def drain(bucket, results):
+    # type: (SharedTokenBucket, multiprocessing.Queue) -> None
+    consumed = 0
+    try:
+        while True:
+            bucket.consumeToken(1, blocking=False)
+            consumed += 1
+    except TokenAmountError:
+        results.put(consumed)
+
+
+def open_bucket(path, barrier, results):
+    # type: (str, multiprocessing.Barrier, multiprocessing.Queue) -> None
+    barrier.wait()
+    try:
+        bucket = SharedTokenBucket(path, size=10, refillrate=1, refillamount=1)
+        results.put(bucket.current_filllevel())
+    except Exception as e:
+        results.put(repr(e))
+
+
+class TestSharedTokenBucket(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bucket')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_consumeToken(self):
+        bucket = SharedTokenBucket(
+            self.path,
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT
+        )
+        bucket.consumeToken(DEFAULT_BUCKET_SIZE)
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(BucketSizeError, bucket.consumeToken, DEFAULT_BUCKET_SIZE + 1, blocking=False)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=1.0)
+        # a second instance attaches to the same state, the configuration is read from the file
+        other = SharedTokenBucket(self.path)
+        self.assertEqual(other.size, DEFAULT_BUCKET_SIZE)
+        self.assertEqual(other.current_filllevel(), 0)
+        bucket.refill(force=True)
+        self.assertEqual(other.current_filllevel(), DEFAULT_REFILL_AMOUNT)
+        self.assertRaises(ValueError, SharedTokenBucket, os.path.join(self.directory, 'missing'))
+
+    def test_consumeTokenTime(self):
+        bucket = SharedTokenBucket(self.path, size=2, refillrate=0.2, refillamount=1)
+
+        @withTokenBucket(bucket, token_amount=2)
+        def limited():
+            pass
+
+        limited()
+        past = time.time()
+        limited()
+        present = time.time()
+        self.assertAlmostEqual(0.4, present - past, places=1)
+        self.assertTrue(consume_many([(bucket, 1)], timeout=1.0))
+
+    def test_consume_many_clocks(self):
+        """
+        a shared bucket with the wall clock can be combined with a bucket with a monotonic clock
+        """
+
+        shared = SharedTokenBucket(self.path, size=2, refillrate=0.1, refillamount=1)
+        local = TokenBucket_py.TokenBucket(size=2, refillrate=0.1, refillamount=1)
+        self.assertTrue(consume_many([(shared, 2), (local, 2)], blocking=False))
+        past = time.time()
+        self.assertTrue(consume_many([(shared, 1), (local, 1)]))
+        self.assertAlmostEqual(0.1, time.time() - past, places=1)
+        self.assertEqual((shared.current_filllevel(), local.current_filllevel()), (0, 0))
+
+    def test_processes(self):
+        """
+        the limit must hold for all processes together
+        """
+        bucket = SharedTokenBucket(self.path, size=1000, refillrate=1000, refillamount=1)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=drain, args=(bucket, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        consumed = [results.get(timeout=30) for _ in workers]
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sum(consumed), 1000)
+
+    def test_initialized_while_opening(self):
+        """
+        the file is initialized by another process between opening and locking it
+        """
+
+        path = self.path
+
+        class RacingBucket(SharedTokenBucket):
+            def _open(self):
+                super(RacingBucket, self)._open()
+                SharedTokenBucket(path, size=5, refillrate=1, refillamount=1).close()
+
+        bucket = RacingBucket(self.path, size=10, refillrate=1, refillamount=1)
+        self.assertEqual(bucket.size, 5)
+        bucket.consumeToken(5)
+        bucket.close()
+
+    def test_concurrent_first_open(self):
+        barrier = multiprocessing.Barrier(8)
+        results = multiprocessing.Queue()
+        for attempt in range(5):
+            path = os.path.join(self.directory, 'bucket' + str(attempt))
+            workers = [multiprocessing.Process(target=open_bucket, args=(path, barrier, results)) for _ in range(8)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual([results.get() for _ in workers], [10] * 8)
+
+    def test_refund(self):
+        bucket = SharedTokenBucket(self.path, size=5, refillrate=1000, refillamount=1)
+        bucket.consumeToken(3)
+        bucket.refund(2)
+        self.assertEqual(SharedTokenBucket(self.path).current_filllevel(), 4)
+        bucket.refund(5)
+        self.assertEqual(bucket.current_filllevel(), 5)
+
+    def test_initialValue(self):
+        bucket = SharedTokenBucket(self.path, size=5, refillrate=1000, refillamount=1, value=0)
+        self.assertEqual(bucket.current_filllevel(), 0)
+
+    def test_pickle(self):
+        bucket = SharedTokenBucket(self.path, size=5, refillrate=1000, refillamount=1)
+        bucket.consumeToken(2)
+        other = pickle.loads(pickle.dumps(bucket))
+        self.assertEqual(other.current_filllevel(), 3)
+        bucket.close()
+        other.close()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketAsync import AsyncTokenBucket
+from TokenBucket.TokenBucketClock import VirtualClock, WallClock
+from TokenBucket.TokenBucketSimulator import load_trace, poisson_trace, simulate
+from .TestBackends import BackendTests
+
+
+class TestSimulator(BackendTests, TestCase):
+
+    def _test_simulate(self, TokenBucket):
+        clock = VirtualClock()
+        bucket = TokenBucket(size=2, refillrate=1.0, refillamount=1, clock=clock)
+        trace = [(0.0, None, 1), (0.1, None, 1), (0.2, None, 1), (0.3, None, 1), (0.4, None, 3)]
+        result = simulate(trace, bucket, max_delay=1.5)
+        # two requests are served from the full bucket, the third waits for the refill at 1.0, the fourth for
+        # the refill at 2.0, which is too late, the last one is larger than the bucket
+        self.assertEqual((result.admitted, result.delayed, result.rejected), (2, 1, 2))
+        self.assertAlmostEqual(result.delays[0], 0.8)
+        self.assertEqual(result.total, 5)
+        self.assertEqual(clock.time(), 0.4)
+
+    def _test_wall_clock_timestamp(self, TokenBucket):
+        """
+        timestamps of time.time() are rejected by a bucket with the default monotonic clock
+        """
+
+        self.assertRaises(ValueError, TokenBucket, size=2, refillrate=1.0, refillamount=1, lastupdate=time.time())
+        bucket = TokenBucket(size=2, refillrate=1.0, refillamount=1, lastupdate=time.monotonic())
+        self.assertRaises(ValueError, bucket.refill, now=time.time())
+        bucket.refill(now=time.monotonic())
+        bucket = TokenBucket(size=2, refillrate=1.0, refillamount=1, lastupdate=time.time(), clock=WallClock())
+        bucket.refill(now=time.time())
+        self.assertRaises(ValueError, AsyncTokenBucket, size=2, refillrate=1.0, refillamount=1,
+                          lastupdate=time.time())
+
+    def test_simulate_keys(self):
+        clock = VirtualClock()
+        buckets = {key: TokenBucket_py.TokenBucket(size=10, refillrate=1.0, refillamount=10, clock=clock)
+                   for key in 'ab'}
+        trace = list(poisson_trace(rate=1000, duration=10.0, keys=('a', 'b'), seed=1))
+        result = simulate(trace, buckets, max_delay=0.5)
+        self.assertEqual(result.total, len(trace))
+        # each bucket admits 10 tokens plus 10 per second, the rest of the requests is rejected
+        self.assertAlmostEqual(result.admitted + result.delayed, 2 * 10 * 11, delta=20)
+        summary = result.summary()
+        self.assertLessEqual(summary['delay_max'], 0.5)
+        self.assertLessEqual(summary['delay_p50'], summary['delay_p99'])
+
+    def test_load_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'trace.csv')
+            with open(path, 'w') as trace:
+                trace.write('# timestamp,key,token_amount\n0.5,a,2\n1.5,b\n')
+            self.assertEqual(list(load_trace(path)), [(0.5, 'a', 2), (1.5, 'b', 1)])
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,96 @@
+import concurrent.futures
+import copy
+import os
+import pickle
+import tempfile
+import time
+from unittest import TestCase
+
+from TokenBucket import TokenBucket_py
+from TokenBucket.TokenBucketClock import VirtualClock
+from TokenBucket.TokenBucketKeyed import KeyedTokenBucket
+from TokenBucket.TokenBucketSnapshot import HEADER, RECORD, SnapshotView, dump, dumps, load, loads, open_snapshot
+from .TestBackends import BackendTests
+
+
+def consume(bucket):
+    bucket.consumeToken(1, blocking=False)
+    return bucket
+
+
+class TestTokenBucketSnapshot(BackendTests, TestCase):
+
+    def _test_pickle(self, TokenBucket):
+        clock = VirtualClock(100.0)
+        bucket = TokenBucket(size=10, refillrate=1.0, refillamount=2, fifo=True, continuous=True, clock=clock)
+        bucket.consumeToken(7)
+        clock.advance(0.25)
+        restored = pickle.loads(pickle.dumps(bucket))
+        self.assertIsInstance(restored, TokenBucket)
+        self.assertEqual((restored.size, restored.value, restored.refill_rate, restored.refill_amount),
+                         (10, 3, 1.0, 2))
+        self.assertTrue(restored.fifo)
+        self.assertTrue(restored.continuous)
+        # the age of the last update is kept, the restored bucket runs on the default clock
+        self.assertAlmostEqual(restored.clock.time() - restored.last_update, 0.25, places=2)
+        self.assertEqual(copy.deepcopy(bucket).value, 3)
+        state = bucket.__getstate__()
+        self.assertRaises(ValueError, restored.__setstate__, (99,) + state[1:])
+
+    def _test_process_pool(self, TokenBucket):
+        bucket = TokenBucket(size=5, refillrate=60, refillamount=5)
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            self.assertEqual(executor.submit(consume, bucket).result().value, 4)
+
+    def _test_snapshot(self, TokenBucket):
+        buckets = [TokenBucket(size=100, refillrate=1.0, refillamount=10, fifo=i % 2 == 0) for i in range(5)]
+        for i, bucket in enumerate(buckets):
+            bucket.consumeToken(i * 20)
+        data = dumps(buckets)
+        self.assertEqual(len(data), HEADER.size + 5 * RECORD.size)
+        restored = loads(data, factory=TokenBucket)
+        self.assertEqual([bucket.value for bucket in restored], [100, 80, 60, 40, 20])
+        self.assertEqual([bucket.fifo for bucket in restored], [True, False, True, False, True])
+
+        # the time between the snapshot and the restore counts as refill time
+        view = SnapshotView(data)
+        view.timestamp -= 2.0
+        self.assertEqual(view.restore(4, factory=TokenBucket).current_filllevel(), 40)
+        self.assertEqual(view.restore(4, factory=TokenBucket, downtime=False).current_filllevel(), 20)
+
+    def _test_file(self, TokenBucket):
+        buckets = [TokenBucket(size=10, refillrate=60, refillamount=1, value=i + 1) for i in range(1000)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'buckets.snapshot')
+            with open(path, 'wb') as file:
+                dump(buckets, file)
+            with open(path, 'rb') as file:
+                self.assertEqual([bucket.value for bucket in load(file, factory=TokenBucket)][:3], [1, 2, 3])
+            view = open_snapshot(path)
+            self.assertEqual(len(view), 1000)
+            self.assertEqual(view.state(999)[2], 1000)
+            self.assertRaises(IndexError, view.state, 1000)
+            view.buffer.close()
+
+    def test_invalid(self):
+        data = dumps([TokenBucket_py.TokenBucket(size=1, refillrate=1, refillamount=1)])
+        self.assertRaises(ValueError, SnapshotView, b'XXXX' + data[4:])
+        self.assertRaises(ValueError, SnapshotView, data[:-1])
+        self.assertRaises(ValueError, SnapshotView, data[:4] + b'\x02\x00' + data[6:])
+
+    def test_keyed(self):
+        clock = VirtualClock()
+        buckets = KeyedTokenBucket(size=10, refillrate=1.0, refillamount=1, clock=clock)
+        buckets.consumeToken('a', 10)
+        clock.advance(0.5)
+        buckets.consumeToken('b', 3)
+        buckets.consumeToken('c', 1)
+        restored = pickle.loads(pickle.dumps(buckets))
+        self.assertEqual(list(restored.slots), ['a', 'b', 'c'])
+        self.assertEqual([restored.current_filllevel(key) for key in 'abc'], [0, 7, 9])
+        # the age of the last update of 'a' is kept, half of the refill interval is left
+        past = time.monotonic()
+        restored.consumeToken('a', 1)
+        self.assertAlmostEqual(0.5, time.monotonic() - past, places=1)
+        restored.consumeToken('d', 1)
+        self.assertEqual(len(restored), 4)
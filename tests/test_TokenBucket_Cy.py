@@ -1,8 +1,14 @@
+import collections
+import threading
 import time
-from unittest import TestCase
+from unittest import SkipTest, TestCase
 
+from TokenBucket.TokenBucketClock import VirtualClock
 from TokenBucket.TokenBucketErrors import BucketSizeError, TimeoutError, TokenAmountError
-from TokenBucket.TokenBucket_cy import TokenBucket
+try:
+    from TokenBucket.TokenBucket_cy import TokenBucket, FastRLock
+except ImportError:
+    raise SkipTest("the Cython extension is not built")
 from .TestDefaults import *
 
 
@@ -20,6 +26,19 @@ class TestTokenBucket(TestCase):
         self.assertRaises(BucketSizeError, bucket.consumeToken, DEFAULT_BUCKET_SIZE + 1, blocking=False)
         self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=1.0)
 
+    def test_initialValue(self):
+        """
+        a bucket can be created empty
+        """
+        bucket = TokenBucket(
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT,
+            value=0
+        )
+        self.assertEqual(bucket.current_filllevel(), 0)
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+
     def test_current_filllevel(self):
         bucket = TokenBucket(
             size=DEFAULT_BUCKET_SIZE,
@@ -57,7 +76,7 @@ class TestTokenBucket(TestCase):
         bucket.refill(force=True)
         self.assertEqual(bucket.current_filllevel(), DEFAULT_BUCKET_SIZE)
         bucket.consumeToken(1)
-        bucket.refill(now=time.time())
+        bucket.refill(now=time.monotonic())
         self.assertEqual(bucket.current_filllevel(), DEFAULT_BUCKET_SIZE - 1)
 
     def test_consumeTokenTimeNiceCase(self):
@@ -114,3 +133,181 @@ class TestTokenBucket(TestCase):
         bucket.consumeToken(DEFAULT_BUCKET_SIZE * 2)  # request full bucket
         present = time.time()
         self.assertAlmostEqual(DEFAULT_REFILL_TIME, present - past, places=2)  # must refill at least once
+
+    def test_consumeTokenFifo(self):
+        """
+        tests if blocked consumers are served in order, a large request must not be overtaken by a small one
+        """
+        bucket = TokenBucket(
+            size=4,
+            refillrate=0.2,
+            refillamount=2,
+            fifo=True
+        )
+        bucket.consumeToken(4)
+        order = []
+
+        def consumer(name, amount):
+            bucket.consumeToken(amount)
+            order.append(name)
+
+        large = threading.Thread(target=consumer, args=('large', 4))
+        large.start()
+        time.sleep(0.05)
+        small = threading.Thread(target=consumer, args=('small', 1))
+        small.start()
+        self.assertRaises(TokenAmountError, bucket.consumeToken, 1, blocking=False)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=0.3)
+        large.join()
+        small.join()
+        self.assertEqual(order, ['large', 'small'])
+        self.assertEqual(len(bucket.waiters), 0)
+        # the queue is only created by a waiting FIFO consumer
+        self.assertIsNone(TokenBucket(size=4, refillrate=0.2, refillamount=2).waiters)
+
+    def test_fifoTimeToWaitRaises(self):
+        """
+        errors while computing the wait of a queued consumer are raised, not printed and swallowed
+        """
+        bucket = TokenBucket(size=4, refillrate=0.2, refillamount=2, fifo=True)
+        bucket.consumeToken(4)
+        bucket.waiters = collections.deque([('not an amount', None)])
+        self.assertRaises(TypeError, bucket.consumeToken, 1, timeout=1.0)
+
+    def test_FastRLock(self):
+        lock = FastRLock()
+        counter = [0]
+
+        def worker():
+            for _ in range(10000):
+                with lock:
+                    with lock:
+                        counter[0] += 1
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter[0], 40000)
+        self.assertRaises(RuntimeError, lock.release)
+
+        condition = threading.Condition(lock)
+        with condition:
+            with lock:
+                self.assertFalse(condition.wait(0.01))
+            self.assertTrue(lock._is_owned())
+        self.assertFalse(lock._is_owned())
+
+    def test_consumeTokenContinuous(self):
+        """
+        tests if a continuous bucket refills token by token and waits exactly once
+        """
+        bucket = TokenBucket(
+            size=4,
+            refillrate=0.4,
+            refillamount=4,
+            continuous=True
+        )
+        bucket.consumeToken(4)
+        past = time.time()
+        bucket.consumeToken(1)
+        present = time.time()
+        self.assertAlmostEqual(0.1, present - past, places=2)
+        past = time.time()
+        bucket.consumeToken(3)
+        present = time.time()
+        self.assertAlmostEqual(0.3, present - past, places=2)
+        self.assertEqual(bucket.current_filllevel(), 0)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 3, timeout=0.2)
+        bucket.refill(force=True)
+        self.assertEqual(bucket.current_filllevel(), 4)
+
+    def test_consumeTokenVirtualClock(self):
+        """
+        tests if waiting advances an injected clock instead of blocking
+        """
+        clock = VirtualClock(start=100.0)
+        bucket = TokenBucket(
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT,
+            clock=clock
+        )
+        self.assertIs(bucket.clock, clock)
+        self.assertEqual(bucket.last_update, 100.0)
+        bucket.consumeToken(DEFAULT_BUCKET_SIZE)
+        bucket.consumeToken(DEFAULT_BUCKET_SIZE)
+        self.assertEqual(clock.time(), 100.0 + DEFAULT_REFILL_TIME)
+        self.assertRaises(TimeoutError, bucket.consumeToken, 1, timeout=1.0)
+        clock.advance(DEFAULT_REFILL_TIME)
+        self.assertEqual(bucket.current_filllevel(), DEFAULT_REFILL_AMOUNT)
+        fifo = TokenBucket(size=2, refillrate=1.0, refillamount=1, fifo=True, clock=clock)
+        fifo.consumeToken(2)
+        fifo.consumeToken(2)
+        self.assertEqual(clock.time(), 100.0 + 2 * DEFAULT_REFILL_TIME + 2.0)
+
+    def test_tryConsume(self):
+        bucket = TokenBucket(
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT
+        )
+        self.assertTrue(bucket.try_consume(DEFAULT_BUCKET_SIZE))
+        self.assertFalse(bucket.try_consume(1))
+        self.assertRaises(BucketSizeError, bucket.try_consume, DEFAULT_BUCKET_SIZE + 1)
+        self.assertEqual(bucket.current_filllevel(), 0)
+
+    def test_reserve(self):
+        clock = VirtualClock()
+        bucket = TokenBucket(
+            size=DEFAULT_BUCKET_SIZE,
+            refillrate=DEFAULT_REFILL_TIME,
+            refillamount=DEFAULT_REFILL_AMOUNT,
+            clock=clock
+        )
+        self.assertEqual(bucket.reserve(DEFAULT_BUCKET_SIZE), 0.0)
+        self.assertEqual(bucket.reserve(1), DEFAULT_REFILL_TIME)
+        self.assertEqual(bucket.reserve(DEFAULT_BUCKET_SIZE), 2 * DEFAULT_REFILL_TIME)
+        self.assertEqual(bucket.current_filllevel(), -1 - DEFAULT_BUCKET_SIZE)
+        self.assertRaises(BucketSizeError, bucket.reserve, DEFAULT_BUCKET_SIZE + 1)
+        # blocked consumers wait until the debt is paid
+        bucket.consumeToken(1)
+        self.assertEqual(clock.time(), 2 * DEFAULT_REFILL_TIME)
+
+    def test_reconfigure(self):
+        clock = VirtualClock()
+        bucket = TokenBucket(size=10, refillrate=1.0, refillamount=2, clock=clock)
+        bucket.consumeToken(9)
+        clock.advance(1.25)
+        # the refill of the old configuration is kept, the quarter interval counts towards the next refill
+        bucket.reconfigure(refillrate=0.5, refillamount=4)
+        self.assertEqual(bucket.current_filllevel(), 3)
+        self.assertEqual((bucket.refill_rate, bucket.refill_amount), (0.5, 4))
+        clock.advance(0.25)
+        self.assertEqual(bucket.current_filllevel(), 7)
+        bucket.reconfigure(size=5)
+        self.assertEqual(bucket.current_filllevel(), 5)
+        self.assertRaises(BucketSizeError, bucket.consumeToken, 6)
+
+    def test_refillRounding(self):
+        # (last_update + refill_rate - last_update) / refill_rate rounds to 0.9999999999999998
+        clock = VirtualClock(1 / 6.0)
+        bucket = TokenBucket(size=1, refillrate=6 / 41.0, refillamount=1, clock=clock)
+        bucket.consumeToken(1)
+        bucket.consumeToken(1)
+        self.assertEqual(clock.time(), 1 / 6.0 + 6 / 41.0)
+
+    def test_reconfigureFifo(self):
+        bucket = TokenBucket(size=1, refillrate=60, refillamount=1, fifo=True)
+        bucket.consumeToken(1)
+        consumed = []
+        consumer = threading.Thread(target=lambda: consumed.append(bucket.consumeToken(1)))
+        consumer.start()
+        time.sleep(0.05)
+        past = time.time()
+        # the blocked consumer wakes up and waits for the new refill interval
+        bucket.reconfigure(refillrate=0.1)
+        consumer.join(1.0)
+        self.assertEqual(consumed, [True])
+        self.assertLess(time.time() - past, 0.5)